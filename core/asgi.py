@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Decide las conexiones persistentes en settings (ver SERVIDOR)
+os.environ.setdefault('SERVIDOR', 'asgi')
 
 application = get_asgi_application()
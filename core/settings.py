@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 import environ
 import dj_database_url
@@ -58,12 +59,15 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware", 
+    'expedientes.diagnostico.DiagnosticoMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'expedientes.perfilador.PerfiladorMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'expedientes.auditoria.BitacoraDiferidaMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -74,7 +78,8 @@ ROOT_URLCONF = 'core.urls'
 # ==========================================
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates que además mide el tiempo de render por petición
+        'BACKEND': 'expedientes.diagnostico.DjangoTemplatesMedidos',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -104,9 +109,14 @@ DATABASES = {
     }
 }
 
+# Bajo ASGI las conexiones persistentes se quedan colgadas en los hilos de sync_to_async:
+# se abren por petición. Lo fija el punto de entrada que carga Django (core/asgi.py o
+# core/wsgi.py), no el comando del servidor; runserver y los comandos son 'wsgi'
+SERVIDOR = os.environ.get('SERVIDOR', 'wsgi')
+
 # Si existe DATABASE_URL (Railway/Nube), sobrescribe la configuración para usar PostgreSQL
 if 'DATABASE_URL' in os.environ:
-    db_from_env = dj_database_url.config(conn_max_age=600, ssl_require=True)
+    db_from_env = dj_database_url.config(conn_max_age=600 if SERVIDOR == 'wsgi' else 0, ssl_require=True)
     DATABASES['default'].update(db_from_env)
 
 
@@ -211,4 +221,59 @@ if not DEBUG:
     # 4. Cabeceras extra contra ataques
     SECURE_BROWSER_XSS_FILTER = True
     SECURE_CONTENT_TYPE_NOSNIFF = True
-    X_FRAME_OPTIONS = 'DENY'
\ No newline at end of file
+    X_FRAME_OPTIONS = 'DENY'
+
+
+# ==========================================
+# 11. DIAGNÓSTICO DE RENDIMIENTO
+# ==========================================
+# Máximo de consultas por nombre de URL. 'log' avisa; 'error' lanza PresupuestoExcedido
+# (útil en desarrollo y en las pruebas para atrapar N+1 nuevos).
+PRESUPUESTO_CONSULTAS = {
+    'dashboard': 20,
+    'detalle_cliente': 25,
+    'detalle_carpeta': 25,
+    'panel_finanzas': 15,
+    'api_eventos': 10,
+    'agenda_legal': 15,
+}
+PRESUPUESTO_CONSULTAS_MODO = env('PRESUPUESTO_CONSULTAS_MODO', default='log')
+
+# Pico de memoria y sitios de asignación (tracemalloc) en las vistas pesadas (PDF, ZIP,
+# DOCX). Apagado, un admin lo pide por petición con '?_memoria=1'. Encendido mide todas
+# las peticiones de esas vistas: sólo en un worker aislado, encarece cada petición.
+DIAGNOSTICO_MEMORIA = env.bool('DIAGNOSTICO_MEMORIA', default=False)
+
+# /metrics en formato Prometheus: token para el scraper (los admins entran con su sesión)
+METRICAS_TOKEN = env('METRICAS_TOKEN', default='')
+
+
+# ==========================================
+# 12. CACHÉ (dos niveles)
+# ==========================================
+# 'default': LRU acotada en cada proceso delante de 'compartida', que ven todos los
+# workers. Con REDIS_URL la compartida es Redis; sin él, archivos en disco (sirve a
+# los workers de una misma máquina y en desarrollo).
+CACHES = {
+    'default': {
+        'BACKEND': 'expedientes.cache.CacheEscalonada',
+        'LOCATION': 'applegal',
+        'OPTIONS': {
+            'COMPARTIDA': 'compartida',
+            'MAX_ENTRADAS': env.int('CACHE_LOCAL_ENTRADAS', default=2000),
+            'MAX_BYTES': env.int('CACHE_LOCAL_MB', default=32) * 1024 * 1024,
+            'TTL_LOCAL': 60,
+        },
+    },
+    'compartida': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': env('REDIS_URL'),
+        'KEY_PREFIX': 'applegal',
+    } if env('REDIS_URL', default='') else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env('CACHE_DIR', default=os.path.join(tempfile.gettempdir(), 'applegal_cache')),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+# Vigencia por omisión de cachear_consulta y cachear_fragmento (segundos)
+CACHE_APP_TIMEOUT = 300
@@ -24,10 +24,15 @@ urlpatterns = [
     path('usuarios/autorizar/<uuid:user_id>/', views.autorizar_usuario, name='autorizar_usuario'),
     path('usuarios/editar/<uuid:user_id>/', views.editar_usuario, name='editar_usuario'),
     path('usuarios/eliminar/<uuid:user_id>/', views.eliminar_usuario, name='eliminar_usuario'),
+    path('diagnostico/', views.panel_diagnostico, name='panel_diagnostico'),
+    path('diagnostico/perfil/<int:perfil_id>/', views.detalle_perfil, name='detalle_perfil'),
+    path('diagnostico/perfil/<int:perfil_id>/<str:archivo>/', views.descargar_perfil, name='descargar_perfil'),
+    path('metrics', views.metricas_prometheus, name='metricas_prometheus'),
     
     path('cliente/nuevo/', views.nuevo_cliente, name='nuevo_cliente'),
     path('cliente/eliminar/<uuid:cliente_id>/', views.eliminar_cliente, name='eliminar_cliente'),
     path('cliente/<uuid:cliente_id>/', views.detalle_cliente, name='detalle_cliente'),
+    path('cliente/<uuid:cliente_id>/historial/', views.historial_cliente_api, name='historial_cliente_api'),
     path('cliente/<uuid:cliente_id>/carpeta/<int:carpeta_id>/', views.detalle_cliente, name='detalle_carpeta'),
     path('cliente/editar/<uuid:cliente_id>/', views.editar_cliente, name='editar_cliente'),
 
@@ -40,11 +45,18 @@ urlpatterns = [
     path('carpeta/eliminar/<int:carpeta_id>/', views.eliminar_carpeta, name='eliminar_carpeta'),
     path('expediente/crear/<uuid:cliente_id>/', views.crear_expediente, name='crear_expediente'),
     path('archivo/subir/<uuid:cliente_id>/', views.subir_archivo_drive, name='subir_archivo_drive'),
+    path('archivo/subida/iniciar/<uuid:cliente_id>/', views.iniciar_subida_api, name='iniciar_subida_api'),
+    path('archivo/subida/<uuid:subida_id>/<int:n>/', views.subir_fragmento_api, name='subir_fragmento_api'),
+    path('archivo/subida/<uuid:subida_id>/finalizar/', views.finalizar_subida_api, name='finalizar_subida_api'),
+    path('archivo/directa/firmar/<uuid:cliente_id>/', views.firmar_subida_api, name='firmar_subida_api'),
+    path('archivo/directa/local/<str:token>/', views.recibir_subida_local, name='recibir_subida_local'),
+    path('archivo/directa/confirmar/', views.confirmar_subida_api, name='confirmar_subida_api'),
     path('archivo/eliminar/<int:archivo_id>/', views.eliminar_archivo_drive, name='eliminar_archivo_drive'),
     path('drive/subir-requisito/<int:carpeta_id>/', views.subir_archivo_requisito, name='subir_archivo_requisito'),
     path('drive/zip/<int:carpeta_id>/', views.descargar_carpeta_zip, name='descargar_carpeta_zip'),
     path('drive/acciones-masivas/', views.acciones_masivas_drive, name='acciones_masivas_drive'),
     path('drive/preview/<int:documento_id>/', views.preview_archivo, name='preview_archivo'),
+    path('drive/descargar/<int:documento_id>/', views.descargar_documento, name='descargar_documento'),
 
     # TAREAS
     path('tarea/crear/<uuid:cliente_id>/', views.gestionar_tarea, name='gestionar_tarea'),
@@ -87,6 +99,9 @@ urlpatterns = [
     path('agenda/crear/', views.crear_evento, name='crear_evento'),
     path('agenda/eliminar/<int:evento_id>/', views.eliminar_evento, name='eliminar_evento'),
     path('agenda/mover/', views.mover_evento_api, name='mover_evento_api'),
+    path('agenda/ics/<uuid:token>/', views.feed_ics, name='feed_ics'),
+    path('agenda/ics/regenerar/', views.regenerar_enlace_ics, name='regenerar_enlace_ics'),
+    path('agenda/disponibilidad/', views.disponibilidad_api, name='disponibilidad_api'),
     # PARCHE DE EMERGENCIA: Acepta la ruta vieja por si el navegador tiene caché
     path('expedientes/drive/subir-requisito/<int:carpeta_id>/', views.subir_archivo_requisito),
     path('cliente/<uuid:cliente_id>/enviar-recordatorio/', views.enviar_recordatorio_documentacion, name='enviar_recordatorio'),
@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Decide las conexiones persistentes en settings (ver SERVIDOR)
+os.environ.setdefault('SERVIDOR', 'wsgi')
 
 application = get_wsgi_application()
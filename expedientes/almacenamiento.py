@@ -0,0 +1,869 @@
+import hashlib
+import queue
+import threading
+import time
+import logging
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, get_random_string
+from django.utils.text import get_valid_filename
+
+from . import metricas
+from .auditoria import registrar
+from .models import Documento, Blob, SubidaFragmentada
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 1. MINIATURAS (WebP para imágenes, primera página para PDF)
+# ==========================================
+
+EXT_IMAGEN = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tif', 'tiff'}
+EXT_PDF = {'pdf'}
+
+TAMANO_MINIATURA = getattr(settings, 'MINIATURAS_TAMANO', 480)
+CALIDAD_MINIATURA = getattr(settings, 'MINIATURAS_CALIDAD', 75)
+# En pruebas o con un solo proceso se puede generar en línea
+MINIATURAS_SINCRONO = getattr(settings, 'MINIATURAS_SINCRONO', False)
+
+pool_miniaturas = ThreadPoolExecutor(max_workers=getattr(settings, 'MINIATURAS_WORKERS', 2), thread_name_prefix='miniaturas')
+
+
+def extension(nombre):
+    return nombre.rsplit('.', 1)[-1].lower() if '.' in nombre else ''
+
+def admite_miniatura(nombre):
+    return extension(nombre) in EXT_IMAGEN | EXT_PDF
+
+def nombre_miniatura(nombre_original):
+    """Llave determinista junto al original: drive_legal/2026/02/06/miniaturas/acta.pdf.webp"""
+    carpeta, base = posixpath.split(nombre_original)
+    return posixpath.join(carpeta, 'miniaturas', f"{base}.webp")
+
+def _raster_imagen(f):
+    from PIL import Image, ImageOps
+
+    img = Image.open(f)
+    img.draft('RGB', (TAMANO_MINIATURA, TAMANO_MINIATURA))  # JPEG: decodifica ya reducido
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((TAMANO_MINIATURA, TAMANO_MINIATURA))
+    return img
+
+def _raster_pdf(f):
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        logger.info("pypdfium2 no está instalado; se omite la miniatura del PDF.")
+        return None
+
+    pdf = pdfium.PdfDocument(f.read())
+    try:
+        pagina = pdf[0]
+        ancho, alto = pagina.get_size()
+        escala = TAMANO_MINIATURA / max(ancho, alto)
+        img = pagina.render(scale=escala).to_pil()
+        pagina.close()
+        return img
+    finally:
+        pdf.close()
+
+def generar_miniatura(documento_id):
+    """Crea (o reemplaza) la miniatura de un documento y la guarda en Documento.miniatura."""
+    doc = Documento.objects.filter(id=documento_id).only('id', 'archivo', 'nombre_archivo', 'blob').first()
+    if not doc or not doc.archivo:
+        return None
+    if doc.blob_id:
+        # Mismo contenido, misma miniatura: se comparte con los demás documentos del Blob
+        existente = Documento.objects.filter(blob_id=doc.blob_id).exclude(miniatura='').values_list('miniatura', flat=True).first()
+        if existente:
+            Documento.objects.filter(id=doc.id).update(miniatura=existente)
+            return existente
+
+    ext = extension(doc.archivo.name)
+    with doc.archivo.open('rb') as f:
+        if ext in EXT_IMAGEN:
+            img = _raster_imagen(f)
+        elif ext in EXT_PDF:
+            img = _raster_pdf(f)
+        else:
+            return None
+    if img is None:
+        return None
+
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+    buffer = BytesIO()
+    img.save(buffer, format='WEBP', quality=CALIDAD_MINIATURA, method=4)
+
+    nombre = nombre_miniatura(doc.archivo.name)
+    storage = doc.archivo.storage
+    if storage.exists(nombre):
+        storage.delete(nombre)
+    nombre = storage.save(nombre, ContentFile(buffer.getvalue()))
+
+    destino = Documento.objects.filter(blob_id=doc.blob_id) if doc.blob_id else Documento.objects.filter(id=doc.id)
+    destino.update(miniatura=nombre)
+    return nombre
+
+def _generar_sin_fallar(documento_id):
+    try:
+        generar_miniatura(documento_id)
+    except Exception:
+        logger.exception("No se pudo generar la miniatura del documento %s", documento_id)
+
+def _generar_en_segundo_plano(documento_id):
+    # Cada hilo del pool abre su propia conexión; se libera al terminar
+    try:
+        _generar_sin_fallar(documento_id)
+    finally:
+        close_old_connections()
+
+def programar_miniatura(documento):
+    """Encola la miniatura cuando la transacción que creó el documento se confirma."""
+    if not admite_miniatura(documento.archivo.name or ''):
+        return
+    if MINIATURAS_SINCRONO:
+        transaction.on_commit(lambda: _generar_sin_fallar(documento.id))
+    else:
+        transaction.on_commit(lambda: pool_miniaturas.submit(_generar_en_segundo_plano, documento.id))
+
+# ==========================================
+# 2. SUBIDAS FRAGMENTADAS Y REANUDABLES
+# ==========================================
+
+TAMANO_FRAGMENTO = getattr(settings, 'SUBIDAS_TAMANO_FRAGMENTO', 8 * 1024 * 1024)
+TAMANO_MAXIMO_SUBIDA = getattr(settings, 'SUBIDAS_TAMANO_MAXIMO', 2 * 1024 ** 3)
+VIGENCIA_SUBIDA = timedelta(hours=getattr(settings, 'SUBIDAS_VIGENCIA_HORAS', 24))
+# Los fragmentos viven fuera de MEDIA: nunca deben publicarse ni llegar a Cloudinary
+DIR_FRAGMENTOS = getattr(settings, 'SUBIDAS_DIR_FRAGMENTOS', os.path.join(tempfile.gettempdir(), 'applegal_subidas'))
+
+BLOQUE_LECTURA = 64 * 1024
+RE_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class ErrorSubida(Exception):
+    """Error de protocolo que se devuelve al cliente como JSON (status 400/409)."""
+    def __init__(self, mensaje, status=400):
+        super().__init__(mensaje)
+        self.status = status
+
+def _dir_subida(subida):
+    # Llave acotada a la sesión de subida (y a su dueño)
+    return os.path.join(DIR_FRAGMENTOS, str(subida.usuario_id), str(subida.id))
+
+def _ruta_fragmento(subida, n):
+    return os.path.join(_dir_subida(subida), f"{n:06d}.part")
+
+def fragmentos_recibidos(subida):
+    """Índices de los fragmentos completos en disco (los parciales terminan en .tmp)."""
+    try:
+        nombres = os.listdir(_dir_subida(subida))
+    except FileNotFoundError:
+        return []
+    return sorted(int(n[:6]) for n in nombres if n.endswith('.part'))
+
+def iniciar_subida(usuario, cliente, carpeta, nombre, tamano, huella=''):
+    """
+    Crea la sesión de subida o devuelve la pendiente del mismo archivo para reanudarla.
+    La integridad se verifica por fragmento (X-Fragmento-Sha256): WebCrypto no calcula
+    un SHA-256 por partes y el del archivo completo obligaría a leerlo entero a memoria.
+    """
+    if tamano < 0 or tamano > TAMANO_MAXIMO_SUBIDA:
+        raise ErrorSubida("El archivo excede el tamaño permitido.")
+
+    limpiar_subidas_vencidas()
+    nombre = os.path.basename(nombre.replace('\\', '/'))[:255] or 'archivo'
+    if huella:
+        pendiente = SubidaFragmentada.objects.filter(
+            usuario=usuario, cliente=cliente, carpeta=carpeta,
+            nombre_archivo=nombre, tamano=tamano, huella=huella
+        ).order_by('-creada_el').first()
+        if pendiente:
+            return pendiente
+
+    return SubidaFragmentada.objects.create(
+        usuario=usuario, cliente=cliente, carpeta=carpeta, nombre_archivo=nombre,
+        tamano=tamano, tamano_fragmento=TAMANO_FRAGMENTO, huella=huella[:255]
+    )
+
+def guardar_fragmento(subida, n, flujo, longitud, sha256=''):
+    """
+    Copia el cuerpo de la petición al disco por bloques (sin pasar por request.body
+    ni por los temporales de Django) y lo publica con un rename atómico, así un
+    corte de conexión nunca deja un fragmento a medias marcado como recibido.
+    """
+    if not 0 <= n < subida.total_fragmentos:
+        raise ErrorSubida("Número de fragmento fuera de rango.")
+    sha256 = (sha256 or '').lower()
+    if sha256 and not RE_SHA256.match(sha256):
+        raise ErrorSubida("Checksum SHA-256 inválido.")
+    esperado = subida.tamano_esperado(n)
+    if longitud != esperado:
+        raise ErrorSubida(f"El fragmento {n} debe medir {esperado} bytes.")
+
+    os.makedirs(_dir_subida(subida), exist_ok=True)
+    destino = _ruta_fragmento(subida, n)
+    # Nombre único por intento: dos reintentos del mismo fragmento (aun en el mismo
+    # proceso) no escriben sobre el mismo temporal
+    descriptor, temporal = tempfile.mkstemp(dir=_dir_subida(subida), prefix=f"{n:06d}.", suffix='.tmp')
+    digest = hashlib.sha256()
+    copiados = 0
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            while copiados < esperado:
+                bloque = flujo.read(min(BLOQUE_LECTURA, esperado - copiados))
+                if not bloque:
+                    break
+                f.write(bloque)
+                digest.update(bloque)
+                copiados += len(bloque)
+        if copiados != esperado:
+            raise ErrorSubida(f"Fragmento {n} incompleto.")
+        if sha256 and digest.hexdigest() != sha256:
+            raise ErrorSubida(f"El checksum del fragmento {n} no coincide.")
+        os.replace(temporal, destino)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return n
+
+def finalizar_subida(subida, usuario):
+    """
+    Une los fragmentos (cada uno ya verificado al recibirlo) y, sólo si el tamaño
+    cuadra, crea el Documento y su única entrada de Bitácora en la misma transacción.
+    """
+    faltantes = sorted(set(range(subida.total_fragmentos)) - set(fragmentos_recibidos(subida)))
+    if faltantes:
+        raise ErrorSubida(f"Faltan {len(faltantes)} fragmentos.", status=409)
+
+    directorio = _dir_subida(subida)
+    with tempfile.NamedTemporaryFile(dir=directorio, suffix='.armado') as armado:
+        for n in range(subida.total_fragmentos):
+            with open(_ruta_fragmento(subida, n), 'rb') as parte:
+                shutil.copyfileobj(parte, armado, BLOQUE_LECTURA)
+        if armado.tell() != subida.tamano:
+            raise ErrorSubida("El tamaño final no coincide.", status=409)
+        armado.seek(0)
+
+        with transaction.atomic():
+            # Evita que dos "finalizar" simultáneos creen dos documentos
+            if not SubidaFragmentada.objects.select_for_update().filter(id=subida.id).exists():
+                raise ErrorSubida("La subida ya fue finalizada.", status=409)
+            doc = Documento(cliente=subida.cliente, carpeta=subida.carpeta, nombre_archivo=subida.nombre_archivo, subido_por=usuario)
+            doc.archivo.save(subida.nombre_archivo, File(armado), save=True)
+            ubicacion = subida.carpeta.nombre if subida.carpeta else "Raíz"
+            registrar(usuario, subida.cliente, 'subida', f"Subió {subida.nombre_archivo} en '{ubicacion}'.")
+            subida.delete()
+
+    shutil.rmtree(directorio, ignore_errors=True)
+    return doc
+
+def descartar_subida(subida):
+    shutil.rmtree(_dir_subida(subida), ignore_errors=True)
+    subida.delete()
+
+def limpiar_subidas_vencidas():
+    for subida in SubidaFragmentada.objects.filter(creada_el__lt=timezone.now() - VIGENCIA_SUBIDA):
+        descartar_subida(subida)
+
+# ==========================================
+# 3. SUBIDAS DIRECTAS FIRMADAS (el navegador sube directo al almacenamiento)
+# ==========================================
+
+# Por defecto sólo tiene sentido con un almacenamiento externo (Cloudinary)
+SUBIDAS_DIRECTAS = getattr(settings, 'SUBIDAS_DIRECTAS', bool(settings.CLOUDINARY_STORAGE.get('CLOUD_NAME')))
+VIGENCIA_FIRMA = getattr(settings, 'SUBIDAS_DIRECTAS_VIGENCIA', 15 * 60)  # segundos
+SAL_FIRMA = 'expedientes.subida_directa'
+
+
+def _llave_directa(nombre):
+    """Misma ruta que usaría Documento.archivo (drive_legal/%Y/%m/%d/), con sufijo único."""
+    base, ext = os.path.splitext(get_valid_filename(os.path.basename(nombre)) or 'archivo')
+    carpeta = timezone.now().strftime('drive_legal/%Y/%m/%d')
+    return f"{carpeta}/{base[:80]}_{get_random_string(7)}{ext.lower()}"
+
+
+class SubidaDirectaLocal:
+    """
+    Sustituto para desarrollo y pruebas sin red: el "almacenamiento" es una vista
+    propia (recibir_subida_local) que sólo acepta el token firmado y guarda en
+    default_storage. Mismo contrato que el backend de Cloudinary.
+    """
+    def destino(self, token, llave):
+        return {'url': reverse('recibir_subida_local', args=[token]), 'metodo': 'POST', 'campos': {}, 'campo_archivo': 'file'}
+
+    def _firma(self, llave, nombre):
+        return signing.Signer(salt=SAL_FIRMA).signature(f"{llave}:{nombre}")
+
+    def recibir(self, llave, archivo):
+        from django.core.files.storage import default_storage
+        nombre = default_storage.save(llave, archivo)
+        return {'public_id': nombre, 'firma': self._firma(llave, nombre)}
+
+    def confirmar(self, llave, resultado):
+        nombre = resultado.get('public_id', '')
+        if not constant_time_compare(resultado.get('firma', ''), self._firma(llave, nombre)):
+            raise ErrorSubida("Respuesta del almacenamiento no válida.", status=403)
+        return nombre
+
+
+def con_prefijo_cloudinary(nombre):
+    """
+    public_id con el que MediaCloudinaryStorage guarda 'nombre': lo antecede el
+    PREFIX de CLOUDINARY_STORAGE (por defecto MEDIA_URL) sin '/' inicial.
+    """
+    prefijo = settings.CLOUDINARY_STORAGE.get('PREFIX', settings.MEDIA_URL).lstrip('/')
+    if prefijo and not prefijo.endswith('/'):
+        prefijo += '/'
+    return nombre if nombre.startswith(prefijo) else prefijo + nombre
+
+
+class SubidaDirectaCloudinary:
+    """Subida firmada a la API de Cloudinary; el nombre final coincide con el que devuelve MediaCloudinaryStorage.save."""
+    def _storage(self):
+        from django.core.files.storage import default_storage
+        return default_storage
+
+    def destino(self, token, llave):
+        import time
+        import cloudinary
+        import cloudinary.utils
+
+        storage = self._storage()
+        nombre = con_prefijo_cloudinary(llave)
+        carpeta, base = posixpath.split(nombre)
+        params = {
+            'timestamp': int(time.time()),
+            'folder': carpeta,
+            'public_id': os.path.splitext(base)[0],
+            'tags': storage.TAG,
+        }
+        config = cloudinary.config()
+        params['signature'] = cloudinary.utils.api_sign_request(params, config.api_secret)
+        params['api_key'] = config.api_key
+        url = cloudinary.utils.cloudinary_api_url('upload', resource_type=storage.RESOURCE_TYPE)
+        return {'url': url, 'metodo': 'POST', 'campos': params, 'campo_archivo': 'file'}
+
+    def confirmar(self, llave, resultado):
+        import cloudinary.utils
+
+        public_id = resultado.get('public_id', '')
+        if not cloudinary.utils.verify_api_response_signature(public_id, resultado.get('version'), resultado.get('signature', '')):
+            raise ErrorSubida("Respuesta de Cloudinary no válida.", status=403)
+        esperado = os.path.splitext(con_prefijo_cloudinary(llave))[0]
+        if public_id != esperado:
+            raise ErrorSubida("El archivo subido no corresponde a la firma.", status=403)
+        return public_id
+
+
+def backend_subida_directa():
+    nombre = getattr(settings, 'SUBIDAS_DIRECTAS_BACKEND', None)
+    if nombre is None:
+        nombre = 'cloudinary' if settings.CLOUDINARY_STORAGE.get('CLOUD_NAME') else 'local'
+    return SubidaDirectaCloudinary() if nombre == 'cloudinary' else SubidaDirectaLocal()
+
+def firmar_subida_directa(usuario, cliente, carpeta, nombre, tamano):
+    """Devuelve el destino firmado y de corta vida al que el navegador sube el archivo."""
+    if tamano < 0 or tamano > TAMANO_MAXIMO_SUBIDA:
+        raise ErrorSubida("El archivo excede el tamaño permitido.")
+    nombre = os.path.basename(nombre.replace('\\', '/'))[:255] or 'archivo'
+    llave = _llave_directa(nombre)
+    token = signing.dumps({
+        'u': str(usuario.id), 'c': str(cliente.id), 'k': carpeta.id if carpeta else None,
+        'n': nombre, 'l': llave, 't': tamano,
+    }, salt=SAL_FIRMA)
+    return dict(backend_subida_directa().destino(token, llave), token=token)
+
+def leer_token_subida(token):
+    try:
+        return signing.loads(token, salt=SAL_FIRMA, max_age=VIGENCIA_FIRMA)
+    except signing.SignatureExpired:
+        raise ErrorSubida("La autorización de subida expiró.", status=403)
+    except signing.BadSignature:
+        raise ErrorSubida("Autorización de subida inválida.", status=403)
+
+def confirmar_subida_directa(usuario, token, resultado):
+    """Callback del navegador: valida la respuesta del almacenamiento y registra el Documento."""
+    datos = leer_token_subida(token)
+    if datos['u'] != str(usuario.id):
+        raise ErrorSubida("La subida pertenece a otro usuario.", status=403)
+    nombre_storage = backend_subida_directa().confirmar(datos['l'], resultado)
+
+    with transaction.atomic():
+        # El callback puede repetirse (reintentos del navegador): es idempotente
+        doc = Documento.objects.filter(archivo=nombre_storage).first()
+        if doc:
+            return doc
+        doc = Documento(cliente_id=datos['c'], carpeta_id=datos['k'], nombre_archivo=datos['n'], subido_por=usuario)
+        doc.archivo.name = nombre_storage
+        doc.save()
+        ubicacion = doc.carpeta.nombre if doc.carpeta else "Raíz"
+        registrar(usuario, datos['c'], 'subida', f"Subió {datos['n']} en '{ubicacion}'.")
+    return doc
+
+# ==========================================
+# 4. ALMACENAMIENTO DIRECCIONADO POR CONTENIDO (deduplicación)
+# ==========================================
+
+def llave_blob(sha256, nombre):
+    """drive_legal/blobs/3f/3fa2...e1.pdf: misma llave para el mismo contenido."""
+    return f"drive_legal/blobs/{sha256[:2]}/{sha256}{os.path.splitext(nombre)[1].lower()[:10]}"
+
+def _hash_contenido(contenido):
+    digest, tamano = hashlib.sha256(), 0
+    if hasattr(contenido, 'seek'):
+        contenido.seek(0)
+    for bloque in contenido.chunks() if hasattr(contenido, 'chunks') else iter(lambda: contenido.read(BLOQUE_LECTURA), b''):
+        digest.update(bloque)
+        tamano += len(bloque)
+    contenido.seek(0)
+    return digest.hexdigest(), tamano
+
+def _sumar_referencia(sha256):
+    # El UPDATE bloquea la fila hasta el final de la transacción: liberar_filas, que
+    # también la bloquea, ve la referencia nueva o termina antes y el UPDATE no encuentra
+    # el Blob borrado (se vuelve a subir)
+    with transaction.atomic():
+        if Blob.objects.filter(sha256=sha256).update(referencias=F('referencias') + 1):
+            return Blob.objects.get(sha256=sha256)
+    return None
+
+def guardar_blob(storage, nombre, contenido):
+    """
+    Devuelve el Blob del contenido con una referencia más; sólo sube el archivo si
+    es nuevo. Se llama dentro de la transacción que guarda el Documento: si ésta se
+    revierte, la referencia (o el Blob nuevo) también, y un archivo recién subido
+    queda sin Blob para que lo recoja limpiar_almacenamiento.
+    """
+    sha256, tamano = _hash_contenido(contenido)
+    blob = _sumar_referencia(sha256)
+    if blob:
+        return blob
+
+    guardado = storage.save(llave_blob(sha256, nombre), contenido)
+    try:
+        with transaction.atomic():
+            return Blob.objects.create(sha256=sha256, archivo=guardado, tamano=tamano, referencias=1)
+    except IntegrityError:
+        # Otro proceso subió el mismo contenido al mismo tiempo: se usa el suyo
+        if guardado != llave_blob(sha256, nombre):
+            storage.delete(guardado)
+        return _sumar_referencia(sha256)
+
+def liberar_filas(filas, storage):
+    """
+    Libera en bloque las referencias de documentos ya borrados; recibe tuplas
+    (blob_id, archivo, miniatura). Los Blobs que quedan sin referencias se
+    eliminan y sus archivos (con miniaturas) pasan al borrador en segundo plano
+    cuando la transacción se confirma. Son O(1) consultas sin importar cuántos.
+    """
+    nombres = []
+    por_blob = Counter()
+    miniaturas_blob = {}
+    for blob_id, archivo, miniatura in filas:
+        if blob_id is None:
+            # Documento previo a la deduplicación: el archivo es sólo suyo
+            nombres += [archivo, miniatura]
+        else:
+            por_blob[blob_id] += 1
+            miniaturas_blob[blob_id] = miniatura or miniaturas_blob.get(blob_id, '')
+
+    if por_blob:
+        with transaction.atomic():
+            # Filas bloqueadas (en orden de id, sin abrazos mortales) desde el descuento
+            # hasta el borrado: un guardar_blob concurrente no puede volver a referenciar
+            # un Blob entre que se lee en cero y se borra
+            list(Blob.objects.select_for_update().filter(id__in=list(por_blob)).order_by('id').values_list('id', flat=True))
+            # Un UPDATE por cada cantidad distinta de referencias (casi siempre uno solo)
+            por_cantidad = {}
+            for blob_id, cantidad in por_blob.items():
+                por_cantidad.setdefault(cantidad, []).append(blob_id)
+            for cantidad, ids in por_cantidad.items():
+                Blob.objects.filter(id__in=ids).update(referencias=Greatest(F('referencias') - cantidad, 0))
+            huerfanos = list(Blob.objects.filter(id__in=list(por_blob), referencias=0).values_list('id', 'archivo'))
+            for blob_id, archivo in huerfanos:
+                nombres += [archivo, miniaturas_blob[blob_id]]
+            Blob.objects.filter(id__in=[blob_id for blob_id, _ in huerfanos], referencias=0).delete()
+
+    nombres = [n for n in nombres if n]
+    if nombres:
+        transaction.on_commit(lambda: borrador.encolar(storage, nombres))
+
+# Dentro de eliminar_documentos: la señal post_delete no libera fila por fila, se libera todo al final
+_liberacion_en_bloque = ContextVar('liberacion_en_bloque', default=False)
+
+
+def liberar_archivos(documento):
+    if _liberacion_en_bloque.get():
+        return
+    liberar_filas([(documento.blob_id, documento.archivo.name, documento.miniatura.name)], documento.archivo.storage)
+
+def eliminar_documentos(queryset):
+    """
+    Borrado masivo basado en conjuntos: un SELECT de los campos de archivo, el
+    delete() normal (con sus señales, para cualquier receptor) y la liberación
+    en bloque de los Blobs en lugar de una por documento. Ninguna llamada al
+    almacenamiento ocurre dentro de la petición. Devuelve cuántos borró.
+    """
+    with transaction.atomic():
+        filas = list(queryset.select_for_update().values_list('id', 'blob_id', 'archivo', 'miniatura'))
+        if not filas:
+            return 0
+        token = _liberacion_en_bloque.set(True)
+        try:
+            Documento.objects.filter(id__in=[f[0] for f in filas]).delete()
+        finally:
+            _liberacion_en_bloque.reset(token)
+        liberar_filas([f[1:] for f in filas], Documento._meta.get_field('archivo').storage)
+    return len(filas)
+
+# ==========================================
+# 5. DESCARGAS (Range, ETag, X-Accel-Redirect)
+# ==========================================
+
+# 'stream' (Django sirve con Range), 'redirect' (URL del almacenamiento),
+# 'x-accel' (nginx) o 'x-sendfile' (Apache/lighttpd). Por defecto según el storage.
+DESCARGAS_MODO = getattr(settings, 'DESCARGAS_MODO', None)
+# Location "internal" de nginx que apunta a MEDIA_ROOT, p. ej. location /protegido/ { internal; alias /app/media/; }
+DESCARGAS_PREFIJO_INTERNO = getattr(settings, 'DESCARGAS_PREFIJO_INTERNO', '/protegido/')
+RE_RANGO = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def modo_descarga(storage):
+    if DESCARGAS_MODO:
+        return DESCARGAS_MODO
+    from django.core.files.storage import FileSystemStorage
+    return 'stream' if isinstance(storage, FileSystemStorage) else 'redirect'
+
+def etag_documento(documento, tamano, modificado):
+    # Con Blob el contenido ya tiene identidad fuerte; si no, tamaño + fecha de modificación
+    if documento.blob_id:
+        return f'"{documento.blob.sha256}"'
+    return f'"{tamano:x}-{int(modificado.timestamp()):x}"'
+
+def parsear_rango(cabecera, tamano):
+    """
+    Devuelve (inicio, fin) inclusivo para un único rango 'bytes=a-b', None si no
+    hay rango utilizable (se sirve completo) o False si no es satisfacible (416).
+    Rangos múltiples o inválidos ('bytes=5-3') se ignoran, como pide el RFC 9110.
+    """
+    m = RE_RANGO.match((cabecera or '').replace(' ', ''))
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if not m.group(1):
+        sufijo = int(m.group(2))
+        # Un archivo vacío no tiene ningún byte que mandar
+        if sufijo == 0 or tamano == 0:
+            return False
+        return max(0, tamano - sufijo), tamano - 1
+    inicio = int(m.group(1))
+    if m.group(2) and int(m.group(2)) < inicio:
+        return None
+    if inicio >= tamano:
+        return False
+    fin = int(m.group(2)) if m.group(2) else tamano - 1
+    return inicio, min(fin, tamano - 1)
+
+def leer_rango(archivo, inicio, longitud, bloque=BLOQUE_LECTURA):
+    try:
+        archivo.seek(inicio)
+        while longitud > 0:
+            datos = archivo.read(min(bloque, longitud))
+            if not datos:
+                break
+            longitud -= len(datos)
+            yield datos
+    finally:
+        archivo.close()
+
+async def aleer_rango(archivo, inicio, longitud, bloque=BLOQUE_LECTURA):
+    """Igual que leer_rango pero sin bloquear el event loop: cada lectura va a un hilo."""
+    leer = sync_to_async(archivo.read, thread_sensitive=False)
+    try:
+        await sync_to_async(archivo.seek, thread_sensitive=False)(inicio)
+        while longitud > 0:
+            datos = await leer(min(bloque, longitud))
+            if not datos:
+                break
+            longitud -= len(datos)
+            yield datos
+    finally:
+        await sync_to_async(archivo.close, thread_sensitive=False)()
+
+# ==========================================
+# 6. BORRADO DE ARCHIVOS EN SEGUNDO PLANO
+# ==========================================
+
+BORRADO_SINCRONO = getattr(settings, 'BORRADO_SINCRONO', False)
+BORRADO_LOTE = getattr(settings, 'BORRADO_LOTE', 100)            # Cloudinary acepta hasta 100 por llamada
+BORRADO_REINTENTOS = getattr(settings, 'BORRADO_REINTENTOS', 5)
+
+
+def _borrar_lote(storage, nombres):
+    """Borra un lote y devuelve los nombres que fallaron (para reintentar)."""
+    try:
+        from cloudinary_storage.storage import MediaCloudinaryStorage
+    except ImportError:
+        MediaCloudinaryStorage = None
+
+    if MediaCloudinaryStorage and isinstance(storage, MediaCloudinaryStorage):
+        import cloudinary.api
+        try:
+            resultado = cloudinary.api.delete_resources(nombres, resource_type=storage.RESOURCE_TYPE, invalidate=True)
+        except Exception:
+            logger.exception("Falló el borrado en lote de %s archivos en Cloudinary", len(nombres))
+            return list(nombres)
+        estados = resultado.get('deleted', {})
+        return [n for n in nombres if estados.get(n) not in ('deleted', 'not_found')]
+
+    fallidos = []
+    for nombre in nombres:
+        try:
+            storage.delete(nombre)
+        except Exception:
+            fallidos.append(nombre)
+    return fallidos
+
+
+class BorradorStorage:
+    """
+    Hilo único que junta los nombres encolados en lotes de BORRADO_LOTE y los
+    borra con el menor número de llamadas al almacenamiento. Lo que falla se
+    reintenta con espera exponencial; si se agotan los intentos queda en el log
+    y el recolector de huérfanos (limpiar_almacenamiento) lo encontrará después.
+    """
+    def __init__(self):
+        self.cola = queue.Queue()
+        self._hilo = None
+        self._candado = threading.Lock()
+
+    def encolar(self, storage, nombres):
+        if BORRADO_SINCRONO:
+            self._procesar(storage, list(nombres), intento=BORRADO_REINTENTOS)
+            return
+        for nombre in nombres:
+            self.cola.put((storage, nombre, 0, 0.0))
+        self._arrancar()
+
+    def _arrancar(self):
+        with self._candado:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ciclo, name='borrador-storage', daemon=True)
+                self._hilo.start()
+
+    def _ciclo(self):
+        pendientes = []
+        while True:
+            try:
+                pendientes.append(self.cola.get(timeout=1 if pendientes else None))
+                # Junta lo que ya esté en la cola sin esperar
+                while len(pendientes) < BORRADO_LOTE * 4:
+                    pendientes.append(self.cola.get_nowait())
+            except queue.Empty:
+                pass
+
+            ahora = time.monotonic()
+            listos = [p for p in pendientes if p[3] <= ahora]
+            pendientes = [p for p in pendientes if p[3] > ahora]
+            por_storage = {}
+            for storage, nombre, intento, _ in listos:
+                por_storage.setdefault(id(storage), (storage, []))[1].append((nombre, intento))
+            for storage, items in por_storage.values():
+                for i in range(0, len(items), BORRADO_LOTE):
+                    lote = items[i:i + BORRADO_LOTE]
+                    intentos = dict(lote)
+                    for nombre in self._procesar(storage, [n for n, _ in lote]):
+                        intento = intentos[nombre] + 1
+                        if intento >= BORRADO_REINTENTOS:
+                            logger.error("Se agotaron los reintentos para borrar %s", nombre)
+                        else:
+                            pendientes.append((storage, nombre, intento, time.monotonic() + 2 ** intento))
+
+    def _procesar(self, storage, nombres, intento=0):
+        fallidos = _borrar_lote(storage, nombres)
+        if fallidos and intento >= BORRADO_REINTENTOS:
+            logger.error("No se pudieron borrar %s archivos: %s", len(fallidos), fallidos[:10])
+        return fallidos
+
+
+borrador = BorradorStorage()
+
+# ==========================================
+# 7. RECOLECCIÓN DE ARCHIVOS HUÉRFANOS (mark & sweep)
+# ==========================================
+
+def huella_nombre(nombre):
+    """8 bytes por nombre en lugar del string completo; una colisión sólo conserva un huérfano."""
+    return hashlib.blake2b(nombre.encode('utf-8'), digest_size=8).digest()
+
+def campos_de_archivo():
+    """(modelo, campo) de todos los FileField/ImageField del proyecto."""
+    from django.apps import apps
+    from django.db.models import FileField
+
+    for modelo in apps.get_models():
+        for campo in modelo._meta.concrete_fields:
+            if isinstance(campo, FileField):
+                yield modelo, campo
+
+def marcar_referenciados(lote=5000):
+    """Fase mark: conjunto compacto con la huella de cada nombre guardado en la base de datos."""
+    vivos = set()
+    for modelo, campo in campos_de_archivo():
+        nombres = modelo._default_manager.exclude(**{campo.attname: ''}).exclude(**{f'{campo.attname}__isnull': True})
+        for nombre in nombres.values_list(campo.attname, flat=True).iterator(chunk_size=lote):
+            vivos.add(huella_nombre(nombre))
+    return vivos
+
+def _recorrer_ordenado(carpeta, relativa, desde):
+    """
+    Recorre en el mismo orden en que se comparan las rutas como texto (las carpetas
+    ordenan como 'nombre/'), así 'desde' sirve de cursor y se saltan ramas ya vistas.
+    """
+    try:
+        entradas = list(os.scandir(carpeta))
+    except FileNotFoundError:
+        return
+    entradas.sort(key=lambda e: e.name + '/' if e.is_dir() else e.name)
+    for entrada in entradas:
+        nombre = f"{relativa}{entrada.name}"
+        if entrada.is_dir():
+            if desde and nombre + '/' < desde and not desde.startswith(nombre + '/'):
+                continue
+            yield from _recorrer_ordenado(entrada.path, nombre + '/', desde)
+        elif not desde or nombre > desde:
+            yield nombre, entrada
+
+def _listar_local(storage, prefijo, desde, pagina):
+    prefijo = prefijo.strip('/')
+    buffer = []
+    for nombre, entrada in _recorrer_ordenado(storage.path(prefijo), f"{prefijo}/" if prefijo else '', desde):
+        try:
+            modificado = datetime.fromtimestamp(entrada.stat().st_mtime, tz=dt_timezone.utc)
+        except FileNotFoundError:
+            continue
+        buffer.append((nombre, modificado))
+        if len(buffer) >= pagina:
+            yield buffer, nombre
+            buffer = []
+    if buffer:
+        yield buffer, buffer[-1][0]
+
+def _listar_cloudinary(storage, prefijo, desde, pagina):
+    import cloudinary.api
+    from django.utils.dateparse import parse_datetime
+
+    cursor = desde or None
+    while True:
+        opciones = {'type': 'upload', 'prefix': con_prefijo_cloudinary(prefijo), 'max_results': min(pagina, 500)}
+        if cursor:
+            opciones['next_cursor'] = cursor
+        respuesta = cloudinary.api.resources(resource_type=storage.RESOURCE_TYPE, **opciones)
+        cursor = respuesta.get('next_cursor')
+        yield [(r['public_id'], parse_datetime(r['created_at'])) for r in respuesta.get('resources', [])], cursor
+        if not cursor:
+            break
+
+def listar_storage(storage, prefijo='', desde=None, pagina=1000):
+    """
+    Recorre el almacenamiento por páginas y produce (lista de (nombre, modificado), cursor).
+    Guardar el cursor permite reanudar el barrido donde se quedó.
+    """
+    from django.core.files.storage import FileSystemStorage
+    try:
+        from cloudinary_storage.storage import MediaCloudinaryStorage
+    except ImportError:
+        MediaCloudinaryStorage = None
+
+    if isinstance(storage, FileSystemStorage):
+        return _listar_local(storage, prefijo, desde, pagina)
+    if MediaCloudinaryStorage and isinstance(storage, MediaCloudinaryStorage):
+        return _listar_cloudinary(storage, prefijo, desde, pagina)
+    raise NotImplementedError(f"No se sabe listar {type(storage).__name__} por páginas.")
+
+# ==========================================
+# 8. ZIP EN FLUJO
+# ==========================================
+
+class _Tubo:
+    """
+    Destino de escritura para ZipFile sin seek: ZipFile pasa a modo flujo
+    (descriptores de datos) y aquí sólo se acumula lo escrito hasta vaciarlo.
+    """
+    def __init__(self):
+        self.partes, self.posicion = [], 0
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos, self.partes = b''.join(self.partes), []
+        return datos
+
+def _agregar_al_zip(zip_file, documento):
+    try:
+        with documento.archivo.open('rb') as f:
+            zip_file.writestr(documento.nombre_archivo, f.read())
+    except Exception:
+        logger.warning("No se pudo agregar %s al ZIP", documento.archivo.name, exc_info=True)
+
+def _medir_zip(tubo, inicio):
+    # También si el cliente corta la descarga: se registra lo que alcanzó a salir
+    metricas.zip_segundos.observar(time.perf_counter() - inicio)
+    metricas.zip_bytes.observar(tubo.posicion)
+
+def zip_en_flujo(documentos):
+    """
+    Produce el ZIP documento por documento: en memoria sólo vive el archivo en
+    curso y el cliente empieza a recibir bytes desde el primero.
+    """
+    tubo, inicio = _Tubo(), time.perf_counter()
+    try:
+        with zipfile.ZipFile(tubo, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for documento in documentos:
+                _agregar_al_zip(zip_file, documento)
+                yield tubo.vaciar()
+        yield tubo.vaciar()
+    finally:
+        _medir_zip(tubo, inicio)
+
+async def azip_en_flujo(documentos):
+    """Versión async: la lectura del storage y la compresión corren en un hilo por documento."""
+    tubo, inicio = _Tubo(), time.perf_counter()
+    agregar = sync_to_async(_agregar_al_zip, thread_sensitive=False)
+    try:
+        with zipfile.ZipFile(tubo, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            async for documento in documentos:
+                await agregar(zip_file, documento)
+                yield tubo.vaciar()
+        yield tubo.vaciar()
+    finally:
+        _medir_zip(tubo, inicio)
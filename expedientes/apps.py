@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ExpedientesConfig(AppConfig):
     name = 'expedientes'
+
+    def ready(self):
+        from .diagnostico import instalar
+        instalar()
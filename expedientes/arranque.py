@@ -0,0 +1,20 @@
+import importlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Librerías que las vistas importan bajo demanda (ver expedientes/views/__init__.py)
+LIBRERIAS_PESADAS = ('weasyprint', 'docxtpl', 'mammoth', 'docx', 'qrcode')
+
+
+def precargar_librerias():
+    """
+    Con gunicorn --preload se llama en el proceso maestro antes del fork: los
+    workers heredan las librerías ya importadas y comparten esas páginas
+    (copy-on-write) en lugar de cargarlas cada uno en su primera petición.
+    """
+    for nombre in LIBRERIAS_PESADAS:
+        try:
+            importlib.import_module(nombre)
+        except ImportError:
+            logger.warning("No se pudo precargar %s", nombre)
@@ -0,0 +1,14 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+# ==========================================
+# 1. E/S BLOQUEANTE
+# ==========================================
+
+async def enviar_correo(mensaje):
+    # Los backends de correo (Anymail, SMTP) son síncronos: el envío espera en un hilo
+    return await sync_to_async(mensaje.send, thread_sensitive=False)()
+
+def servido_por_asgi(request):
+    """Las respuestas en flujo deben ser async bajo ASGI y síncronas bajo WSGI para no cargarse completas en memoria."""
+    return isinstance(request, ASGIRequest)
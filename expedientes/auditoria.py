@@ -0,0 +1,292 @@
+import gzip
+import json
+import logging
+from collections import namedtuple
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateformat import format as formato_fecha
+
+from .models import Bitacora, ParticionBitacora
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 1. BITÁCORA DIFERIDA (un bulk_create por petición)
+# ==========================================
+
+# Lista de entradas pendientes de la petición en curso; None fuera de una petición.
+# ContextVar (y no threading.local) para que funcione igual en vistas async.
+_pendientes = ContextVar('bitacora_pendientes', default=None)
+
+
+def registrar(usuario, cliente, accion, descripcion):
+    """
+    Agrega una entrada a la bitácora. Dentro de una petición se acumula y se
+    escribe al final con un solo INSERT; fuera (comandos, hilos) se escribe ya.
+    Dentro de un transaction.atomic() también se escribe ya: la entrada es parte
+    de la transacción y desaparece con ella si se revierte.
+    """
+    entrada = _entrada(usuario, cliente, accion, descripcion)
+    pendientes = _pendientes.get()
+    if pendientes is None or connection.in_atomic_block:
+        entrada.save()
+    else:
+        pendientes.append(entrada)
+    return entrada
+
+async def aregistrar(usuario, cliente, accion, descripcion):
+    """registrar() para vistas async: fuera de una petición la entrada se escribe con asave()."""
+    entrada = _entrada(usuario, cliente, accion, descripcion)
+    pendientes = _pendientes.get()
+    if pendientes is None:
+        await entrada.asave()
+    else:
+        pendientes.append(entrada)
+    return entrada
+
+def _entrada(usuario, cliente, accion, descripcion):
+    return Bitacora(
+        usuario=usuario if getattr(usuario, 'is_authenticated', False) else None,
+        cliente_id=getattr(cliente, 'pk', cliente),
+        accion=accion,
+        descripcion=descripcion,
+        fecha=timezone.now(),
+    )
+
+def abrir_buffer():
+    return _pendientes.set([])
+
+def _escribir(pendientes):
+    try:
+        Bitacora.objects.bulk_create(pendientes)
+        return
+    except Exception:
+        logger.exception("Falló el INSERT de %s entradas de bitácora; se reintentan una por una", len(pendientes))
+    # Una fila mala (p. ej. su cliente se borró en la misma petición) no se lleva a las demás.
+    # La vista ya confirmó su trabajo: la entrada perdida queda completa en el log y la
+    # respuesta sale igual (un 500 aquí haría que el usuario repitiera la acción)
+    for entrada in pendientes:
+        try:
+            entrada.save()
+        except Exception:
+            logger.exception("Entrada de bitácora no escrita: usuario=%s cliente=%s fecha=%s accion=%s descripcion=%r",
+                             entrada.usuario_id, entrada.cliente_id, entrada.fecha.isoformat(), entrada.accion, entrada.descripcion)
+
+def vaciar_buffer(token):
+    pendientes = _pendientes.get()
+    _pendientes.reset(token)
+    if pendientes:
+        _escribir(pendientes)
+
+async def avaciar_buffer(token):
+    pendientes = _pendientes.get()
+    _pendientes.reset(token)
+    if pendientes:
+        await sync_to_async(_escribir)(pendientes)
+
+
+class BitacoraDiferidaMiddleware:
+    """
+    Abre el buffer de bitácora al entrar y lo escribe de un golpe al terminar la vista.
+    Funciona en ambos modos para no forzar un salto de hilo en las vistas async bajo ASGI.
+    Una entrada que no se puede escribir va al log de errores; la petición no falla
+    por eso después de que la vista ya hizo su trabajo.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = abrir_buffer()
+        try:
+            return self.get_response(request)
+        finally:
+            vaciar_buffer(token)
+
+    async def __acall__(self, request):
+        token = abrir_buffer()
+        try:
+            return await self.get_response(request)
+        finally:
+            await avaciar_buffer(token)
+
+# ==========================================
+# 2. HISTORIAL PAGINADO POR LLAVE
+# ==========================================
+
+HISTORIAL_POR_PAGINA = 50
+
+# Misma forma para filas vivas y archivadas; 'usuario' es el username
+Entrada = namedtuple('Entrada', 'id fecha usuario accion descripcion')
+
+
+_EPOCA = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+def _cursor(entrada):
+    # Microsegundos desde la época + id: seguro en una URL sin codificar
+    return f"{(entrada.fecha - _EPOCA) // timedelta(microseconds=1)}_{entrada.id}"
+
+def _leer_cursor(cursor):
+    try:
+        micro, id_ = cursor.split('_', 1)
+        return _EPOCA + timedelta(microseconds=int(micro)), int(id_)
+    except (ValueError, AttributeError):
+        return None
+
+def _entradas_vivas(cliente_id, llave, limite):
+    qs = Bitacora.objects.filter(cliente_id=cliente_id)
+    if llave:
+        fecha, id_ = llave
+        qs = qs.filter(Q(fecha__lt=fecha) | Q(fecha=fecha, id__lt=id_))
+    filas = qs.order_by('-fecha', '-id').values_list('id', 'fecha', 'usuario__username', 'accion', 'descripcion')[:limite]
+    return [Entrada(*f) for f in filas]
+
+def historial_cliente(cliente_id, antes=None, limite=HISTORIAL_POR_PAGINA):
+    """
+    Página de la bitácora del cliente, más reciente primero. El cursor
+    (fecha, id) usa el índice (cliente, -fecha, -id) directamente: el costo
+    no crece con la página, a diferencia de OFFSET. Cuando se acaban las filas
+    vivas la paginación continúa, sin que el cliente lo note, en el archivo.
+    """
+    llave = _leer_cursor(antes) if antes else None
+    filas = _entradas_vivas(cliente_id, llave, limite + 1)
+    if len(filas) <= limite:
+        ultima = (filas[-1].fecha, filas[-1].id) if filas else llave
+        filas += entradas_archivadas(cliente_id, ultima, limite + 1 - len(filas))
+    siguiente = _cursor(filas[limite - 1]) if len(filas) > limite else None
+    return filas[:limite], siguiente
+
+def historial_json(filas):
+    return [{
+        'fecha': formato_fecha(timezone.localtime(b.fecha), 'd M, H:i'),
+        'usuario': b.usuario or '',
+        'accion': b.accion,
+        'descripcion': b.descripcion,
+    } for b in filas]
+
+# ==========================================
+# 3. RETENCIÓN Y ARCHIVO FRÍO (JSONL comprimido por cliente y mes)
+# ==========================================
+
+RETENCION_DIAS = getattr(settings, 'BITACORA_RETENCION_DIAS', 365)
+LOTE_ARCHIVO = 5000
+
+
+def _ruta_particion(cliente_id, mes, primero, ultimo):
+    return f"bitacora_archivo/{cliente_id}/{mes:%Y/%m}/{primero}-{ultimo}.jsonl.gz"
+
+def _escribir_particion(storage, cliente_id, filas):
+    """filas: [(id, cliente_id, fecha, usuario, accion, descripcion)] de un mismo cliente y mes."""
+    lineas = [json.dumps({'id': f[0], 'fecha': f[2].isoformat(), 'usuario': f[3], 'accion': f[4], 'descripcion': f[5]}, ensure_ascii=False) for f in filas]
+    contenido = gzip.compress(('\n'.join(lineas) + '\n').encode('utf-8'))
+    mes = filas[0][2].date().replace(day=1)
+    nombre = storage.save(_ruta_particion(cliente_id, mes, filas[0][0], filas[-1][0]), ContentFile(contenido))
+    return ParticionBitacora(
+        cliente_id=cliente_id, mes=mes, archivo=nombre, filas=len(filas),
+        desde=min(f[2] for f in filas), hasta=max(f[2] for f in filas),
+    )
+
+def archivar_bitacora(dias=None, lote=LOTE_ARCHIVO, dry_run=False):
+    """
+    Mueve a archivos fríos las entradas más viejas que la retención y las borra
+    de la tabla por lotes: cada lote escribe sus particiones, registra el catálogo
+    y borra las filas en una transacción corta. Devuelve (filas, particiones).
+    """
+    corte = timezone.now() - timedelta(days=RETENCION_DIAS if dias is None else dias)
+    viejas = Bitacora.objects.filter(fecha__lt=corte)
+    if dry_run:
+        return viejas.count(), 0
+
+    storage = ParticionBitacora._meta.get_field('archivo').storage
+    total_filas = total_particiones = 0
+    while True:
+        filas = list(
+            viejas.order_by('cliente_id', 'fecha', 'id')
+            .values_list('id', 'cliente_id', 'fecha', 'usuario__username', 'accion', 'descripcion')[:lote]
+        )
+        if not filas:
+            break
+        grupos = {}
+        for f in filas:
+            grupos.setdefault((f[1], f[2].year, f[2].month), []).append(f)
+
+        # Primero el almacenamiento: si algo falla antes del commit las filas siguen vivas
+        # y el archivo queda huérfano (lo limpia limpiar_almacenamiento), nunca al revés.
+        particiones = [_escribir_particion(storage, cliente_id, grupo) for (cliente_id, _, _), grupo in grupos.items()]
+        with transaction.atomic():
+            ParticionBitacora.objects.bulk_create(particiones)
+            # Sin receptores ni relaciones inversas delete() es un solo DELETE; si algún día los hay, corren
+            Bitacora.objects.filter(id__in=[f[0] for f in filas]).delete()
+        total_filas += len(filas)
+        total_particiones += len(particiones)
+    return total_filas, total_particiones
+
+def _leer_particion(particion):
+    with particion.archivo.open('rb') as f:
+        datos = gzip.decompress(f.read())
+    for linea in datos.decode('utf-8').splitlines():
+        if linea:
+            d = json.loads(linea)
+            yield Entrada(d['id'], datetime.fromisoformat(d['fecha']), d['usuario'], d['accion'], d['descripcion'])
+
+def entradas_archivadas(cliente_id, antes=None, limite=HISTORIAL_POR_PAGINA):
+    """
+    Las 'limite' entradas archivadas más recientes anteriores a 'antes' (fecha, id).
+    Sólo abre las particiones necesarias: recorre el catálogo de la más reciente
+    a la más vieja y se detiene cuando la siguiente ya no puede aportar nada.
+    """
+    particiones = ParticionBitacora.objects.filter(cliente_id=cliente_id).order_by('-hasta', '-id')
+    if antes:
+        particiones = particiones.filter(desde__lte=antes[0])
+    encontradas = []
+    for particion in particiones.iterator():
+        if len(encontradas) >= limite and particion.hasta < encontradas[limite - 1].fecha:
+            break
+        for e in _leer_particion(particion):
+            if not antes or (e.fecha, e.id) < antes:
+                encontradas.append(e)
+        encontradas.sort(key=lambda e: (e.fecha, e.id), reverse=True)
+    return encontradas[:limite]
+
+def iterar_historial(cliente_id, desde=None, hasta=None, accion=None, texto=None):
+    """
+    Historial completo del cliente (vivo + archivado), más reciente primero,
+    con filtros opcionales. Pensado para exportaciones y consultas de auditoría.
+    """
+    qs = Bitacora.objects.filter(cliente_id=cliente_id)
+    particiones = ParticionBitacora.objects.filter(cliente_id=cliente_id)
+    if desde:
+        qs, particiones = qs.filter(fecha__gte=desde), particiones.filter(hasta__gte=desde)
+    if hasta:
+        qs, particiones = qs.filter(fecha__lt=hasta), particiones.filter(desde__lt=hasta)
+    if accion:
+        qs = qs.filter(accion=accion)
+    if texto:
+        qs = qs.filter(descripcion__icontains=texto)
+
+    def coincide(e):
+        return ((not desde or e.fecha >= desde) and (not hasta or e.fecha < hasta)
+                and (not accion or e.accion == accion)
+                and (not texto or texto.lower() in e.descripcion.lower()))
+
+    filas = qs.order_by('-fecha', '-id').values_list('id', 'fecha', 'usuario__username', 'accion', 'descripcion')
+    for f in filas.iterator(chunk_size=1000):
+        yield Entrada(*f)
+    archivadas = []
+    for particion in particiones.iterator():
+        archivadas += [e for e in _leer_particion(particion) if coincide(e)]
+    archivadas.sort(key=lambda e: (e.fecha, e.id), reverse=True)
+    yield from archivadas
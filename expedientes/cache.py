@@ -0,0 +1,357 @@
+import hashlib
+import pickle
+import secrets
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.http import HttpResponse
+from django.utils.functional import cached_property
+
+from . import metricas
+
+# Marca de "no está": permite cachear None
+_FALTA = object()
+
+# ==========================================
+# 1. NIVEL LOCAL (LRU acotada, por proceso)
+# ==========================================
+
+class LRUAcotada:
+    """
+    Diccionario LRU limitado en entradas y en bytes. Guarda los valores ya
+    serializados (igual que LocMemCache): quien lee recibe una copia y no puede
+    modificar lo que verá la siguiente petición.
+    """
+
+    def __init__(self, max_entradas, max_bytes):
+        self.max_entradas, self.max_bytes = max_entradas, max_bytes
+        self._datos = OrderedDict()  # llave -> (expira monotónico o None, bytes)
+        self._bytes = 0
+        self._candado = threading.Lock()
+
+    def obtener(self, llave):
+        with self._candado:
+            entrada = self._datos.get(llave)
+            if entrada is None:
+                return _FALTA
+            if entrada[0] is not None and entrada[0] <= time.monotonic():
+                self._quitar(llave)
+                return _FALTA
+            self._datos.move_to_end(llave)
+        return pickle.loads(entrada[1])
+
+    def guardar(self, llave, valor, segundos):
+        datos = pickle.dumps(valor, pickle.HIGHEST_PROTOCOL)
+        # Un valor enorme vaciaría el nivel entero: se queda sólo en la compartida
+        if len(datos) > self.max_bytes // 10:
+            self.borrar(llave)
+            return
+        expira = time.monotonic() + segundos if segundos is not None else None
+        with self._candado:
+            self._quitar(llave)
+            self._datos[llave] = (expira, datos)
+            self._bytes += len(datos)
+            while len(self._datos) > self.max_entradas or self._bytes > self.max_bytes:
+                self._quitar(next(iter(self._datos)))
+
+    def borrar(self, llave):
+        with self._candado:
+            return self._quitar(llave)
+
+    def limpiar(self):
+        with self._candado:
+            self._datos.clear()
+            self._bytes = 0
+
+    def _quitar(self, llave):
+        entrada = self._datos.pop(llave, None)
+        if entrada is not None:
+            self._bytes -= len(entrada[1])
+        return entrada is not None
+
+    def __len__(self):
+        return len(self._datos)
+
+# ==========================================
+# 2. BACKEND DE DOS NIVELES
+# ==========================================
+
+_locales = {}
+_candado_locales = threading.Lock()
+
+
+class CacheEscalonada(BaseCache):
+    """
+    Backend de Django: LRU local delante de otra caché de CACHES (OPTIONS['COMPARTIDA'],
+    Redis o archivos) que ven todos los workers. Se escribe en ambos niveles y se lee
+    primero el local. Un delete() de otro proceso no alcanza al nivel local, que puede
+    servir el valor viejo hasta TTL_LOCAL segundos: las llaves de cachear_consulta y
+    cachear_fragmento llevan las versiones de sus modelos y nunca se sobrescriben.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        opciones = params.get('OPTIONS', {})
+        self._alias_compartida = opciones.get('COMPARTIDA', 'compartida')
+        self.ttl_local = opciones.get('TTL_LOCAL', 60)
+        # Django crea una instancia del backend por hilo: el nivel local se comparte por LOCATION
+        with _candado_locales:
+            if location not in _locales:
+                _locales[location] = LRUAcotada(opciones.get('MAX_ENTRADAS', 1000), opciones.get('MAX_BYTES', 16 * 1024 * 1024))
+            self.local = _locales[location]
+
+    @cached_property
+    def compartida(self):
+        return caches[self._alias_compartida]
+
+    def _segundos_local(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return self.ttl_local if timeout is None else min(timeout, self.ttl_local)
+
+    def get(self, key, default=None, version=None):
+        llave = self.make_and_validate_key(key, version=version)
+        valor = self.local.obtener(llave)
+        if valor is not _FALTA:
+            metricas.cache_aciertos.inc(nivel='local')
+            return valor
+        valor = self.compartida.get(key, _FALTA, version=version)
+        if valor is _FALTA:
+            metricas.cache_fallos.inc()
+            return default
+        metricas.cache_aciertos.inc(nivel='compartida')
+        self.local.guardar(llave, valor, self.ttl_local)
+        return valor
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        llave = self.make_and_validate_key(key, version=version)
+        self.compartida.set(key, value, timeout, version=version)
+        if timeout == 0:
+            self.local.borrar(llave)
+        else:
+            self.local.guardar(llave, value, self._segundos_local(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if not self.compartida.add(key, value, timeout, version=version):
+            return False
+        self.local.guardar(self.make_and_validate_key(key, version=version), value, self._segundos_local(timeout))
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.local.borrar(self.make_and_validate_key(key, version=version))
+        return self.compartida.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        local = self.local.borrar(self.make_and_validate_key(key, version=version))
+        return self.compartida.delete(key, version=version) or local
+
+    def incr(self, key, delta=1, version=None):
+        self.local.borrar(self.make_and_validate_key(key, version=version))
+        return self.compartida.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _FALTA, version=version) is not _FALTA
+
+    def clear(self):
+        self.local.limpiar()
+        self.compartida.clear()
+
+def caches_aisladas():
+    """
+    CACHES para pruebas y mediciones (override_settings): el mismo backend de dos
+    niveles, pero con un nivel local y una compartida en memoria propios. Sin esto
+    comparten con la aplicación en marcha el directorio de FileBasedCache y un
+    clear() de las pruebas la vaciaría.
+    """
+    location = f"aislada-{uuid.uuid4().hex}"
+    return {
+        'default': {
+            'BACKEND': 'expedientes.cache.CacheEscalonada',
+            'LOCATION': location,
+            'OPTIONS': {'COMPARTIDA': 'compartida'},
+        },
+        'compartida': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': location,
+        },
+    }
+
+# ==========================================
+# 3. VERSIONES POR MODELO
+# ==========================================
+
+# Cada modelo registrado tiene una versión en la caché compartida; cualquier
+# post_save/post_delete/m2m_changed la cambia y las llaves que la incluían dejan de usarse.
+ALIAS = getattr(settings, 'CACHE_APP', 'default')
+TIMEOUT_POR_DEFECTO = getattr(settings, 'CACHE_APP_TIMEOUT', 300)
+
+_registrados = set()
+_candado_registro = threading.Lock()
+
+
+def _cache():
+    return caches[ALIAS]
+
+def _compartida():
+    # Las versiones nunca van al nivel local: otro worker las cambia sin avisar
+    cache = _cache()
+    return getattr(cache, 'compartida', cache)
+
+def _llave_version(modelo):
+    return f"version:{modelo._meta.label_lower}"
+
+def versiones(*modelos):
+    """Versión actual de cada modelo (una sola lectura a la caché compartida)."""
+    compartida = _compartida()
+    llaves = [_llave_version(m) for m in modelos]
+    actuales = compartida.get_many(llaves)
+    for llave in llaves:
+        if llave not in actuales:
+            # add(): si otro worker la creó primero, gana la suya
+            compartida.add(llave, secrets.token_hex(6), None)
+            actuales[llave] = compartida.get(llave)
+    return [actuales[llave] for llave in llaves]
+
+def _nueva_version(llave):
+    # Un valor nuevo y no un incr(): el de FileBasedCache no es atómico y dos workers
+    # podrían dejar la misma versión; un valor al azar nunca repite uno ya leído
+    _compartida().set(llave, secrets.token_hex(6), None)
+
+def subir_version(modelo):
+    llave = _llave_version(modelo)
+    _nueva_version(llave)
+    if connection.in_atomic_block:
+        # Hasta el commit otro worker puede leer los datos viejos y cachearlos con la
+        # versión nueva: se vuelve a cambiar cuando los nuevos ya son visibles
+        transaction.on_commit(lambda: _nueva_version(llave))
+
+def _al_modificar(sender, **kwargs):
+    subir_version(sender)
+
+def _al_cambiar_relacion(sender, action, instance, model, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    for modelo in {type(instance), model}:
+        if modelo in _registrados:
+            subir_version(modelo)
+
+def versionar(*modelos):
+    """Registra los modelos: sus señales mantienen la versión al día."""
+    with _candado_registro:
+        for modelo in modelos:
+            if modelo in _registrados:
+                continue
+            _registrados.add(modelo)
+            uid = f"cache_version_{modelo._meta.label_lower}"
+            post_save.connect(_al_modificar, sender=modelo, weak=False, dispatch_uid=uid)
+            post_delete.connect(_al_modificar, sender=modelo, weak=False, dispatch_uid=uid)
+            # Relaciones M2M en ambos sentidos (Usuario.clientes_asignados también toca a Cliente)
+            for campo in modelo._meta.get_fields(include_hidden=True):
+                if campo.many_to_many:
+                    intermedia = campo.remote_field.through if campo.concrete else campo.through
+                    m2m_changed.connect(_al_cambiar_relacion, sender=intermedia, weak=False,
+                                        dispatch_uid=f"cache_m2m_{intermedia._meta.label_lower}")
+
+# ==========================================
+# 4. DECORADORES
+# ==========================================
+
+def _normalizar(valor):
+    # Una instancia de modelo se identifica por su tabla y pk, no por su repr()
+    if hasattr(valor, '_meta') and hasattr(valor, 'pk'):
+        return (valor._meta.label_lower, valor.pk)
+    return valor
+
+def _llave(tipo, nombre, modelos, partes):
+    base = repr((nombre, versiones(*modelos), partes))
+    return f"{tipo}:{hashlib.md5(base.encode()).hexdigest()}"
+
+def cachear_consulta(*modelos, timeout=TIMEOUT_POR_DEFECTO, espacio=None):
+    """
+    Cachea el resultado de una función que consulta 'modelos'. La llave incluye
+    los argumentos y la versión de cada modelo: un cambio en cualquiera invalida.
+    Un QuerySet se guarda ya evaluado (lista). bulk_create() y update() no emiten
+    señales: tras ellos hay que llamar a subir_version().
+    """
+    def decorador(funcion):
+        nombre = espacio or f"{funcion.__module__}.{funcion.__qualname__}"
+        versionar(*modelos)
+
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            llave = _llave('consulta', nombre, modelos, (
+                tuple(_normalizar(a) for a in args), sorted((k, _normalizar(v)) for k, v in kwargs.items())))
+            valor = _cache().get(llave, _FALTA)
+            if valor is not _FALTA:
+                metricas.cache_llamadas.inc(espacio=nombre, resultado='acierto')
+                return valor
+            metricas.cache_llamadas.inc(espacio=nombre, resultado='fallo')
+            valor = funcion(*args, **kwargs)
+            if isinstance(valor, QuerySet):
+                valor = list(valor)
+            _cache().set(llave, valor, timeout)
+            return valor
+        return envoltura
+    return decorador
+
+def _llave_fragmento(request, nombre, modelos, usuario):
+    partes = (request.path, sorted(request.GET.lists()), getattr(request, 'LANGUAGE_CODE', None),
+              (usuario.id, usuario.rol) if usuario is not None else None)
+    return _llave('fragmento', nombre, modelos, partes)
+
+def _respuesta_cacheable(response):
+    return (response.status_code == 200 and not response.streaming
+            and not response.cookies and not response.has_header('Set-Cookie'))
+
+def cachear_fragmento(*modelos, timeout=TIMEOUT_POR_DEFECTO, por_usuario=True):
+    """
+    Cachea la respuesta GET de una vista parcial (JSON o un trozo de HTML que
+    pide el navegador por AJAX) por URL, usuario y versión de 'modelos'. No usar
+    en páginas completas: base.html lleva token CSRF, mensajes y notificaciones.
+    """
+    def decorador(vista):
+        nombre = f"{vista.__module__}.{vista.__qualname__}"
+        versionar(*modelos)
+
+        def leer(request, usuario):
+            if request.method not in ('GET', 'HEAD'):
+                return None, None
+            llave = _llave_fragmento(request, nombre, modelos, usuario if por_usuario else None)
+            guardado = _cache().get(llave)
+            metricas.cache_llamadas.inc(espacio=nombre, resultado='acierto' if guardado else 'fallo')
+            return llave, guardado
+
+        def guardar(llave, response):
+            if llave and _respuesta_cacheable(response):
+                _cache().set(llave, (response.content, response['Content-Type']), timeout)
+            return response
+
+        if iscoroutinefunction(vista):
+            @wraps(vista)
+            async def envoltura(request, *args, **kwargs):
+                usuario = await request.auser() if por_usuario else None
+                llave, guardado = await sync_to_async(leer)(request, usuario)
+                if guardado:
+                    return HttpResponse(guardado[0], content_type=guardado[1])
+                response = await vista(request, *args, **kwargs)
+                return await sync_to_async(guardar)(llave, response)
+            return envoltura
+
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            llave, guardado = leer(request, request.user if por_usuario else None)
+            if guardado:
+                return HttpResponse(guardado[0], content_type=guardado[1])
+            return guardar(llave, vista(request, *args, **kwargs))
+        return envoltura
+    return decorador
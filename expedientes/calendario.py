@@ -0,0 +1,469 @@
+import hashlib
+import json
+from bisect import bisect_left
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from itertools import islice, takewhile
+
+from asgiref.sync import sync_to_async
+from dateutil.rrule import rrulestr
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Cliente, Evento, ExcepcionEvento, Tarea, Usuario, VersionAgenda
+
+# Los rangos que pide FullCalendar se repiten mucho (cambio de vista, volver a la semana anterior...)
+CACHE_AGENDA_SEGUNDOS = 60 * 60
+# El feed ICS publica lo pendiente y una ventana corta hacia atrás
+ICS_DIAS_PASADOS = getattr(settings, 'AGENDA_ICS_DIAS_PASADOS', 180)
+ICS_LINEAS_POR_BLOQUE = 500
+# Rango más largo que expande una petición: la vista anual de FullCalendar pide ~370 días
+VENTANA_MAXIMA = timedelta(days=getattr(settings, 'AGENDA_VENTANA_MAXIMA_DIAS', 400))
+
+CAMPOS_EVENTO = ('id', 'usuario_id', 'cliente_id', 'titulo', 'inicio', 'fin', 'tipo', 'descripcion', 'recurrencia', 'cliente__nombre_empresa')
+
+
+def parsear_fecha(valor):
+    """Acepta '2026-03-01', '2026-03-01T00:00:00-06:00' o '...Z' (lo que manda FullCalendar)."""
+    if isinstance(valor, datetime):
+        fecha = valor
+    else:
+        fecha = parse_datetime(valor or '')
+        if fecha is None:
+            dia = parse_date(valor or '')
+            if dia is None:
+                raise ValueError(f"Fecha inválida: {valor}")
+            fecha = datetime.combine(dia, time.min)
+    if timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    return fecha
+
+def validar_ventana(desde, hasta, maxima=VENTANA_MAXIMA):
+    """ValueError si el rango está invertido o es más largo que 'maxima' (las series sin fin se expandirían sin límite)."""
+    if hasta < desde:
+        raise ValueError("El fin del rango es anterior al inicio.")
+    if hasta - desde > maxima:
+        raise ValueError(f"El rango no puede pasar de {maxima.days} días.")
+
+def version_agenda(usuario):
+    """Contador de cambios de la agenda del usuario; la fila se crea en 0 la primera vez que se lee."""
+    return VersionAgenda.objects.get_or_create(usuario_id=usuario.id)[0]
+
+def llave_agenda(usuario, start, end):
+    """
+    Llave versionada: cuando cambia un evento visible para el usuario sube su
+    VersionAgenda y la llave anterior simplemente deja de usarse.
+    """
+    base = f"{usuario.id}:{usuario.rol}:{version_agenda(usuario).version}:{start}:{end}"
+    return 'agenda:' + hashlib.md5(base.encode()).hexdigest()
+
+def filtro_rango(desde, hasta):
+    """Eventos únicos que empiezan en el rango + series que lo tocan (sin expandirlas en SQL)."""
+    unicos = Q(recurrencia='', inicio__range=[desde, hasta])
+    series = ~Q(recurrencia='') & Q(inicio__lte=hasta) & (Q(recurrencia_hasta__isnull=True) | Q(recurrencia_hasta__gte=desde))
+    return unicos | series
+
+def consulta_eventos(usuario, desde, hasta):
+    """Una sola consulta con el nombre del cliente ya unido (sin N+1)."""
+    qs = Evento.objects.filter(filtro_rango(desde, hasta))
+    if usuario.rol != 'admin':
+        asignados = Usuario.clientes_asignados.through.objects.filter(usuario_id=usuario.id).values('cliente_id')
+        qs = qs.filter(Q(usuario_id=usuario.id) | Q(cliente_id__in=asignados))
+    return qs.values(*CAMPOS_EVENTO)
+
+def expandir_ocurrencias(filas, desde, hasta):
+    """
+    Recibe filas de Evento (dicts de values()) y devuelve las ocurrencias que
+    caen en [desde, hasta]. Las series se expanden sólo dentro de la ventana y
+    sus excepciones se leen en una sola consulta.
+    Cada ocurrencia es la fila original más 'inicio', 'fin' y 'ocurrencia'
+    (inicio original de la ocurrencia, None en eventos únicos).
+    """
+    filas = list(filas)
+    ids_series = [f['id'] for f in filas if f['recurrencia']]
+
+    excepciones = {}
+    if ids_series:
+        qs = ExcepcionEvento.objects.filter(evento_id__in=ids_series).filter(
+            Q(fecha_original__range=[desde, hasta]) | Q(inicio__range=[desde, hasta])
+        ).values('evento_id', 'fecha_original', 'cancelada', 'inicio', 'fin')
+        for x in qs:
+            excepciones.setdefault(x['evento_id'], {})[x['fecha_original']] = x
+
+    for f in filas:
+        if not f['recurrencia']:
+            yield dict(f, ocurrencia=None)
+            continue
+
+        duracion = f['fin'] - f['inicio'] if f['fin'] else None
+        propias = excepciones.get(f['id'], {})
+        regla = rrulestr(f['recurrencia'], dtstart=timezone.localtime(f['inicio']))
+        # Perezoso y con tope: between() arma la lista completa de la ventana
+        ocurrencias = takewhile(lambda inicio: inicio <= hasta, regla.xafter(desde, inc=True))
+        for inicio in islice(ocurrencias, Evento.MAX_OCURRENCIAS):
+            if inicio in propias:
+                continue
+            yield dict(f, inicio=inicio, fin=inicio + duracion if duracion else None, ocurrencia=inicio)
+
+        # Ocurrencias movidas (pueden venir de fuera de la ventana)
+        for original, x in propias.items():
+            if not x['cancelada'] and x['inicio'] and desde <= x['inicio'] <= hasta:
+                yield dict(f, inicio=x['inicio'], fin=x['fin'], ocurrencia=original)
+
+def construir_recurrencia(frecuencia, repeticiones=None, hasta=None):
+    """Arma la RRULE del formulario de la agenda ('' si el evento no se repite)."""
+    if frecuencia not in ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY'):
+        return ''
+    regla = f"FREQ={frecuencia}"
+    if repeticiones and str(repeticiones).isdigit():
+        regla += f";COUNT={min(int(repeticiones), Evento.MAX_OCURRENCIAS)}"
+    elif hasta:
+        limite = datetime.combine(parse_date(hasta), time.max.replace(microsecond=0))
+        regla += f";UNTIL={_ics_fecha(timezone.make_aware(limite))}"
+    return regla
+
+def mover_ocurrencia(evento, ocurrencia, inicio, fin=None):
+    """Mueve sólo una ocurrencia de la serie guardándola como excepción."""
+    ExcepcionEvento.objects.update_or_create(
+        evento=evento, fecha_original=ocurrencia,
+        defaults={'inicio': inicio, 'fin': fin, 'cancelada': False},
+    )
+
+def cancelar_ocurrencia(evento, ocurrencia):
+    ExcepcionEvento.objects.update_or_create(
+        evento=evento, fecha_original=ocurrencia,
+        defaults={'inicio': None, 'fin': None, 'cancelada': True},
+    )
+
+def mover_serie(evento, ocurrencia, inicio, fin=None):
+    """
+    Desplaza toda la serie lo mismo que se movió la ocurrencia arrastrada.
+    Las excepciones se desplazan igual para que sigan apuntando a su ocurrencia.
+    """
+    excepcion = evento.excepciones.filter(fecha_original=ocurrencia).first()
+    base = excepcion.inicio if excepcion and excepcion.inicio else ocurrencia
+    delta = inicio - base
+
+    if fin:
+        evento.fin = evento.inicio + delta + (fin - inicio)
+    elif evento.fin:
+        evento.fin += delta
+    evento.inicio += delta
+    excepciones = list(evento.excepciones.all())
+    for x in excepciones:
+        x.fecha_original += delta
+        if x.inicio:
+            x.inicio += delta
+            x.fin = x.fin + delta if x.fin else None
+    with transaction.atomic():
+        evento.save()
+        # Se reescriben en lugar de un UPDATE fecha_original + delta: si el desplazamiento
+        # es justo la distancia entre dos excepciones, la primera choca con la segunda
+        # (unique_together) antes de que ésta se mueva
+        evento.excepciones.all().delete()
+        ExcepcionEvento.objects.bulk_create(excepciones)
+
+def eventos_json(usuario, start, end):
+    """
+    Devuelve (llave, cuerpo_json) del feed, usando la caché si la versión no cambió.
+    ValueError si 'start'/'end' faltan, no son fechas o exceden VENTANA_MAXIMA.
+    """
+    desde, hasta = parsear_fecha(start), parsear_fecha(end)
+    validar_ventana(desde, hasta)
+    llave = llave_agenda(usuario, start, end)
+    cuerpo = cache.get(llave)
+    if cuerpo is None:
+        tipos = dict(Evento.TIPOS)
+        eventos = []
+        for e in expandir_ocurrencias(consulta_eventos(usuario, desde, hasta), desde, hasta):
+            empresa = e['cliente__nombre_empresa']
+            ocurrencia = e['ocurrencia'].isoformat() if e['ocurrencia'] else None
+            eventos.append({
+                'id': f"{e['id']}_{int(e['ocurrencia'].timestamp())}" if ocurrencia else e['id'],
+                'title': f"{empresa}: {e['titulo']}" if empresa else e['titulo'],
+                'start': e['inicio'].isoformat(),
+                'end': e['fin'].isoformat() if e['fin'] else None,
+                'backgroundColor': Evento.COLORES.get(e['tipo'], '#3b82f6'),
+                'extendedProps': {
+                    'evento_id': e['id'], 'ocurrencia': ocurrencia, 'recurrente': bool(ocurrencia),
+                    'cliente': empresa or 'Personal',
+                    'descripcion': e['descripcion'], 'tipo': tipos.get(e['tipo'], e['tipo']),
+                },
+            })
+        cuerpo = json.dumps(eventos, cls=DjangoJSONEncoder)
+        cache.set(llave, cuerpo, CACHE_AGENDA_SEGUNDOS)
+    return llave, cuerpo
+
+# ==========================================
+# FEED ICS (iCalendar)
+# ==========================================
+
+def _ics_texto(valor):
+    valor = (valor or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+    return valor.replace('\r\n', '\\n').replace('\n', '\\n')
+
+def _ics_fecha(dt):
+    return dt.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+def _ics_fecha_local(dt):
+    return timezone.localtime(dt).strftime('%Y%m%dT%H%M%S')
+
+def _ics_linea(linea):
+    """Pliega líneas a 75 octetos como pide el RFC 5545."""
+    datos = linea.encode('utf-8')
+    if len(datos) <= 75:
+        return linea + '\r\n'
+    partes, actual = [], b''
+    for c in linea:
+        b = c.encode('utf-8')
+        if len(actual) + len(b) > (75 if not partes else 74):
+            partes.append(actual.decode('utf-8'))
+            actual = b''
+        actual += b
+    partes.append(actual.decode('utf-8'))
+    return '\r\n '.join(partes) + '\r\n'
+
+def _clientes_visibles(usuario):
+    if usuario.rol == 'admin':
+        return Cliente.objects.values('id')
+    return Usuario.clientes_asignados.through.objects.filter(usuario_id=usuario.id).values('cliente_id')
+
+def generar_ics(usuario, host, modificada=None):
+    """
+    Generador línea por línea del calendario del usuario. Los querysets se leen
+    con iterator() para no cargar toda la agenda en memoria.
+    """
+    desde = timezone.now() - timedelta(days=ICS_DIAS_PASADOS)
+    sello = _ics_fecha(modificada or timezone.now())
+    tipos = dict(Evento.TIPOS)
+
+    yield _ics_linea('BEGIN:VCALENDAR')
+    yield _ics_linea('VERSION:2.0')
+    yield _ics_linea('PRODID:-//Gestiones Corpad//AppLegal//ES')
+    yield _ics_linea('CALSCALE:GREGORIAN')
+    yield _ics_linea('METHOD:PUBLISH')
+    yield _ics_linea(f'X-WR-CALNAME:{_ics_texto("AppLegal - " + usuario.username)}')
+    yield _ics_linea(f'X-WR-TIMEZONE:{settings.TIME_ZONE}')
+
+    eventos = Evento.objects.filter(
+        Q(recurrencia='', inicio__gte=desde) |
+        (~Q(recurrencia='') & (Q(recurrencia_hasta__isnull=True) | Q(recurrencia_hasta__gte=desde)))
+    )
+    if usuario.rol != 'admin':
+        eventos = eventos.filter(Q(usuario_id=usuario.id) | Q(cliente_id__in=_clientes_visibles(usuario)))
+
+    # Las series se publican una sola vez con RRULE (el cliente las expande); sus excepciones en una consulta
+    excepciones = {}
+    for x in ExcepcionEvento.objects.filter(evento__in=eventos.exclude(recurrencia='')).values():
+        excepciones.setdefault(x['evento_id'], []).append(x)
+
+    for e in eventos.values(*CAMPOS_EVENTO).order_by('inicio').iterator(chunk_size=500):
+        titulo = f"{e['cliente__nombre_empresa']}: {e['titulo']}" if e['cliente__nombre_empresa'] else e['titulo']
+        duracion = (e['fin'] - e['inicio']) if e['fin'] else timedelta(hours=1)
+        uid = f"evento-{e['id']}@{host}"
+
+        yield _ics_linea('BEGIN:VEVENT')
+        yield _ics_linea(f'UID:{uid}')
+        yield _ics_linea(f'DTSTAMP:{sello}')
+        if e['recurrencia']:
+            yield _ics_linea(f"DTSTART;TZID={settings.TIME_ZONE}:{_ics_fecha_local(e['inicio'])}")
+            yield _ics_linea(f"DTEND;TZID={settings.TIME_ZONE}:{_ics_fecha_local(e['inicio'] + duracion)}")
+            yield _ics_linea(f"RRULE:{e['recurrencia']}")
+            for x in excepciones.get(e['id'], []):
+                if x['cancelada']:
+                    yield _ics_linea(f"EXDATE;TZID={settings.TIME_ZONE}:{_ics_fecha_local(x['fecha_original'])}")
+        else:
+            yield _ics_linea(f"DTSTART:{_ics_fecha(e['inicio'])}")
+            yield _ics_linea(f"DTEND:{_ics_fecha(e['inicio'] + duracion)}")
+        yield _ics_linea(f'SUMMARY:{_ics_texto(titulo)}')
+        yield _ics_linea(f"CATEGORIES:{_ics_texto(tipos.get(e['tipo'], e['tipo']))}")
+        if e['descripcion']:
+            yield _ics_linea(f"DESCRIPTION:{_ics_texto(e['descripcion'])}")
+        yield _ics_linea('END:VEVENT')
+
+        # Ocurrencias movidas: mismo UID + RECURRENCE-ID
+        for x in excepciones.get(e['id'], []):
+            if x['cancelada'] or not x['inicio']:
+                continue
+            yield _ics_linea('BEGIN:VEVENT')
+            yield _ics_linea(f'UID:{uid}')
+            yield _ics_linea(f'DTSTAMP:{sello}')
+            yield _ics_linea(f"RECURRENCE-ID;TZID={settings.TIME_ZONE}:{_ics_fecha_local(x['fecha_original'])}")
+            yield _ics_linea(f"DTSTART:{_ics_fecha(x['inicio'])}")
+            yield _ics_linea(f"DTEND:{_ics_fecha(x['fin'] or x['inicio'] + duracion)}")
+            yield _ics_linea(f'SUMMARY:{_ics_texto(titulo)}')
+            yield _ics_linea('END:VEVENT')
+
+    tareas = Tarea.objects.filter(
+        completada=False, fecha_limite__gte=desde.date(), cliente_id__in=_clientes_visibles(usuario)
+    ).values('id', 'titulo', 'fecha_limite', 'prioridad', 'cliente__nombre_empresa').order_by('fecha_limite')
+
+    for t in tareas.iterator(chunk_size=500):
+        yield _ics_linea('BEGIN:VEVENT')
+        yield _ics_linea(f"UID:tarea-{t['id']}@{host}")
+        yield _ics_linea(f'DTSTAMP:{sello}')
+        yield _ics_linea(f"DTSTART;VALUE=DATE:{t['fecha_limite'].strftime('%Y%m%d')}")
+        yield _ics_linea(f"DTEND;VALUE=DATE:{(t['fecha_limite'] + timedelta(days=1)).strftime('%Y%m%d')}")
+        yield _ics_linea(f"SUMMARY:{_ics_texto('Vence: ' + t['titulo'] + ' (' + t['cliente__nombre_empresa'] + ')')}")
+        yield _ics_linea(f"CATEGORIES:Tarea {_ics_texto(t['prioridad'])}")
+        yield _ics_linea('END:VEVENT')
+
+    yield _ics_linea('END:VCALENDAR')
+
+async def agenerar_ics(usuario, host, modificada=None):
+    """
+    Versión async para ASGI (un iterador síncrono se leería completo antes de
+    enviarse). El generador usa el ORM síncrono: avanza en el hilo de
+    sync_to_async, de ICS_LINEAS_POR_BLOQUE líneas por salto.
+    """
+    lineas = generar_ics(usuario, host, modificada)
+    siguiente = sync_to_async(lambda: ''.join(islice(lineas, ICS_LINEAS_POR_BLOQUE)))
+    try:
+        while bloque := await siguiente():
+            yield bloque
+    finally:
+        # Cliente desconectado a medias: los cursores de iterator() se cierran en su hilo
+        await sync_to_async(lineas.close)()
+
+# ==========================================
+# CONFLICTOS Y DISPONIBILIDAD
+# ==========================================
+
+# Eventos sin hora de fin ocupan esta duración
+DURACION_POR_DEFECTO = timedelta(hours=1)
+# Un evento que empezó antes de esta ventana no se considera (audiencias de más de un día no existen)
+DURACION_MAXIMA = timedelta(days=1)
+# Horario en que se buscan huecos libres (hora inicio, hora fin) y días hábiles (0 = lunes)
+HORARIO_LABORAL = getattr(settings, 'AGENDA_HORARIO_LABORAL', (9, 19))
+DIAS_HABILES = getattr(settings, 'AGENDA_DIAS_HABILES', (0, 1, 2, 3, 4))
+# Para series sin fin sólo se revisan conflictos en este horizonte
+HORIZONTE_CONFLICTOS = timedelta(days=365)
+# Hasta dónde busca huecos una consulta de disponibilidad
+HORIZONTE_DISPONIBILIDAD = timedelta(days=getattr(settings, 'AGENDA_DISPONIBILIDAD_DIAS', 90))
+
+
+class IndiceIntervalos:
+    """
+    Índice estático de intervalos [inicio, fin): se ordena una vez (O(n log n))
+    y guarda el máximo 'fin' acumulado para podar la búsqueda. Cada consulta de
+    traslape cuesta O(log n + k).
+    """
+
+    def __init__(self, intervalos):
+        self.intervalos = sorted(intervalos, key=lambda i: i[0])
+        self.inicios = [i[0] for i in self.intervalos]
+        self.fin_maximo = []
+        maximo = None
+        for inicio, fin, _ in self.intervalos:
+            maximo = fin if maximo is None or fin > maximo else maximo
+            self.fin_maximo.append(maximo)
+
+    def traslapes(self, inicio, fin):
+        i = bisect_left(self.inicios, fin) - 1
+        encontrados = []
+        while i >= 0 and self.fin_maximo[i] > inicio:
+            if self.intervalos[i][1] > inicio:
+                encontrados.append(self.intervalos[i])
+            i -= 1
+        encontrados.reverse()
+        return encontrados
+
+def _intervalos(ocurrencias):
+    for o in ocurrencias:
+        yield (o['inicio'], o['fin'] or o['inicio'] + DURACION_POR_DEFECTO, o)
+
+def buscar_conflictos(evento):
+    """
+    Ocurrencias de otros eventos del mismo abogado o del mismo cliente que se
+    traslapan con el evento (o con las ocurrencias de su serie dentro del
+    horizonte). Una consulta de eventos + una de excepciones.
+    """
+    fila = {f: getattr(evento, f) for f in CAMPOS_EVENTO if '__' not in f}
+    fila['cliente__nombre_empresa'] = None
+    if evento.recurrencia:
+        hasta = evento.recurrencia_hasta or evento.inicio + HORIZONTE_CONFLICTOS
+        propias = list(expandir_ocurrencias([fila], evento.inicio, hasta))
+    else:
+        propias = [dict(fila, ocurrencia=None)]
+    if not propias:
+        return []
+
+    propias = list(_intervalos(propias))
+    desde = min(i[0] for i in propias) - DURACION_MAXIMA
+    hasta = max(i[1] for i in propias)
+
+    mismos = Q(usuario_id=evento.usuario_id)
+    if evento.cliente_id:
+        mismos |= Q(cliente_id=evento.cliente_id)
+    otros = Evento.objects.filter(filtro_rango(desde, hasta)).filter(mismos).exclude(id=evento.id).values(*CAMPOS_EVENTO)
+    indice = IndiceIntervalos(_intervalos(expandir_ocurrencias(otros, desde, hasta)))
+
+    conflictos = []
+    for inicio, fin, _ in propias:
+        conflictos.extend(indice.traslapes(inicio, fin))
+    return conflictos
+
+def describir_conflictos(conflictos):
+    return [
+        {
+            'id': o['id'],
+            'titulo': f"{o['cliente__nombre_empresa']}: {o['titulo']}" if o['cliente__nombre_empresa'] else o['titulo'],
+            'inicio': timezone.localtime(inicio).strftime('%d/%m/%Y %H:%M'),
+            'fin': timezone.localtime(fin).strftime('%H:%M'),
+        }
+        for inicio, fin, o in conflictos
+    ]
+
+def _fusionar(intervalos):
+    """Une intervalos ocupados que se traslapan (entrada ya ordenada)."""
+    fusionados = []
+    for inicio, fin in intervalos:
+        if fusionados and inicio <= fusionados[-1][1]:
+            if fin > fusionados[-1][1]:
+                fusionados[-1][1] = fin
+        else:
+            fusionados.append([inicio, fin])
+    return fusionados
+
+def buscar_disponibilidad(usuarios_ids, desde, hasta, duracion, limite=5):
+    """
+    Próximos huecos de 'duracion' en horario laboral en los que todos los
+    abogados indicados están libres. Los ocupados salen de una consulta, se
+    ordenan y fusionan una vez (O(n log n)) y luego se recorren linealmente.
+    ValueError si la duración no está en (0, DURACION_MAXIMA] o el rango excede
+    HORIZONTE_DISPONIBILIDAD.
+    """
+    if not timedelta(0) < duracion <= DURACION_MAXIMA:
+        raise ValueError("La duración debe ser de 1 minuto a 24 horas.")
+    validar_ventana(desde, hasta, HORIZONTE_DISPONIBILIDAD)
+    filas = Evento.objects.filter(filtro_rango(desde - DURACION_MAXIMA, hasta)).filter(usuario_id__in=usuarios_ids).values(*CAMPOS_EVENTO)
+    ocupados = sorted((i[0], i[1]) for i in _intervalos(expandir_ocurrencias(filas, desde - DURACION_MAXIMA, hasta)))
+    ocupados = _fusionar(ocupados)
+
+    huecos = []
+    j = 0
+    dia = timezone.localtime(desde).date()
+    while dia <= timezone.localtime(hasta).date() and len(huecos) < limite:
+        if dia.weekday() in DIAS_HABILES:
+            apertura = timezone.make_aware(datetime.combine(dia, time(HORARIO_LABORAL[0])))
+            cierre = timezone.make_aware(datetime.combine(dia, time(HORARIO_LABORAL[1])))
+            cursor = max(apertura, desde)
+            cierre = min(cierre, hasta)
+
+            while j < len(ocupados) and ocupados[j][1] <= cursor:
+                j += 1
+            k = j
+            while cursor + duracion <= cierre and len(huecos) < limite:
+                if k < len(ocupados) and ocupados[k][0] < cursor + duracion:
+                    # Ocupado: saltar al final del bloque
+                    cursor = max(cursor, ocupados[k][1])
+                    k += 1
+                    continue
+                huecos.append((cursor, cursor + duracion))
+                cursor += duracion
+        dia += timedelta(days=1)
+    return huecos
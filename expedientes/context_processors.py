@@ -41,8 +41,11 @@ def notificaciones_globales(request):
             fecha_vencimiento__lte=hoy + timedelta(days=3)
         ).select_related('cliente')
 
+    # Se evalúan una vez: el conteo y el panel usan las mismas listas (antes COUNT + SELECT por cada una)
+    tareas, eventos, cobros = list(tareas), list(eventos), list(cobros)
+
     # Conteo Total para el "Globito Rojo"
-    total_notif = tareas.count() + eventos.count() + len(cobros)
+    total_notif = len(tareas) + len(eventos) + len(cobros)
 
     return {
         'notif_tareas': tareas,
@@ -0,0 +1,278 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.files.storage import Storage
+from django.core.mail import EmailMessage
+from django.db.backends.signals import connection_created
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+from . import metricas
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 1. MEDICIÓN POR PETICIÓN
+# ==========================================
+
+# Medición de la petición en curso; None fuera de una petición.
+# ContextVar: sync_to_async copia el contexto, así que las consultas de vistas async también cuentan.
+_medicion = ContextVar('diagnostico_medicion', default=None)
+
+
+class Medicion:
+    def __init__(self):
+        self.consultas = 0
+        self.tiempos = {}
+        self._activos = set()
+        # Lista de (sql, params, segundos) sólo cuando la petición se perfila; None = no se guarda
+        self.sql = None
+
+    def sumar(self, nombre, segundos):
+        self.tiempos[nombre] = self.tiempos.get(nombre, 0.0) + segundos
+
+    def tiempo(self, nombre):
+        return self.tiempos.get(nombre, 0.0)
+
+
+@contextmanager
+def medir(nombre):
+    """Acumula en la petición actual el tiempo del bloque. Anidado consigo mismo cuenta una sola vez."""
+    medicion = _medicion.get()
+    if medicion is None or nombre in medicion._activos:
+        yield
+        return
+    medicion._activos.add(nombre)
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicion._activos.discard(nombre)
+        medicion.sumar(nombre, time.perf_counter() - inicio)
+
+def _envoltura_bd(execute, sql, params, many, context):
+    medicion = _medicion.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    medicion.consultas += 1
+    if medicion.sql is None:
+        with medir('bd'):
+            return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        with medir('bd'):
+            return execute(sql, params, many, context)
+    finally:
+        medicion.sql.append((sql, params, time.perf_counter() - inicio))
+
+def _instalar_envoltura(sender, connection, **kwargs):
+    # Cada conexión (una por hilo) lleva la envoltura para siempre; fuera de una petición no hace nada
+    if _envoltura_bd not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_envoltura_bd)
+
+def _medir_metodo(clase, metodo, nombre, histograma, fallos=None, **etiquetas):
+    original = getattr(clase, metodo)
+    if getattr(original, '_medido', False):
+        return
+
+    @wraps(original)
+    def medido(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            with medir(nombre):
+                return original(*args, **kwargs)
+        except Exception:
+            if fallos:
+                fallos.inc(**etiquetas)
+            raise
+        finally:
+            histograma.observar(time.perf_counter() - inicio, **etiquetas)
+    medido._medido = True
+    setattr(clase, metodo, medido)
+
+def instalar():
+    connection_created.connect(_instalar_envoltura, dispatch_uid='diagnostico_bd')
+    # Puntos de entrada comunes a todos los backends: Storage.open/save llaman a
+    # _open/_save de cada storage (local o Cloudinary) y todo correo pasa por send().
+    # Los borrados de archivos ya no ocurren en la petición (BorradorStorage).
+    _medir_metodo(Storage, 'open', 'storage', metricas.storage_segundos, operacion='open')
+    _medir_metodo(Storage, 'save', 'storage', metricas.storage_segundos, operacion='save')
+    _medir_metodo(EmailMessage, 'send', 'correo', metricas.correo_segundos, metricas.correo_fallos)
+
+
+class PlantillaMedida(Template):
+    def render(self, context=None, request=None):
+        with medir('plantillas'):
+            return super().render(context, request)
+
+
+class DjangoTemplatesMedidos(DjangoTemplates):
+    """Backend de plantillas de Django que mide render() y render_to_string()."""
+    def from_string(self, template_code):
+        return PlantillaMedida(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return PlantillaMedida(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+# ==========================================
+# 2. PRESUPUESTOS DE CONSULTAS POR VISTA
+# ==========================================
+
+# {'detalle_cliente': 20, ...}: máximo de consultas por nombre de URL
+PRESUPUESTO_CONSULTAS = getattr(settings, 'PRESUPUESTO_CONSULTAS', {})
+# 'log' avisa en el log; 'error' lanza PresupuestoExcedido (desarrollo y pruebas)
+PRESUPUESTO_MODO = getattr(settings, 'PRESUPUESTO_CONSULTAS_MODO', 'log')
+
+
+class PresupuestoExcedido(Exception):
+    pass
+
+
+def revisar_presupuesto(vista, consultas):
+    limite = PRESUPUESTO_CONSULTAS.get(vista)
+    if limite is None or consultas <= limite:
+        return
+    mensaje = f"{vista} hizo {consultas} consultas (presupuesto {limite})"
+    if PRESUPUESTO_MODO == 'error':
+        raise PresupuestoExcedido(mensaje)
+    logger.warning(mensaje)
+
+# ==========================================
+# 3. PERCENTILES POR VISTA (ventana móvil, por proceso)
+# ==========================================
+
+VENTANA = getattr(settings, 'DIAGNOSTICO_VENTANA', 500)
+
+_muestras = {}
+_candado = threading.Lock()
+
+
+def registrar_muestra(vista, total, medicion):
+    muestra = (total, medicion.consultas, medicion.tiempo('bd'), medicion.tiempo('plantillas'))
+    with _candado:
+        if vista not in _muestras:
+            _muestras[vista] = deque(maxlen=VENTANA)
+        _muestras[vista].append(muestra)
+
+def percentil(valores, p):
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not valores:
+        return 0
+    # ceil y no round(): round() redondea al par y con rangos enteros (p95 de 20) tomaba el siguiente
+    return valores[min(len(valores) - 1, max(0, math.ceil(p * len(valores) / 100) - 1))]
+
+def resumen_vistas():
+    """Una fila por vista con p50/p95/p99 de tiempo total y consultas, de la más lenta a la más rápida."""
+    with _candado:
+        copia = {vista: list(muestras) for vista, muestras in _muestras.items()}
+    filas = []
+    for vista, muestras in copia.items():
+        totales = sorted(m[0] for m in muestras)
+        consultas = sorted(m[1] for m in muestras)
+        filas.append({
+            'vista': vista,
+            'peticiones': len(muestras),
+            'p50': percentil(totales, 50) * 1000,
+            'p95': percentil(totales, 95) * 1000,
+            'p99': percentil(totales, 99) * 1000,
+            'consultas_p50': percentil(consultas, 50),
+            'consultas_max': consultas[-1],
+            'bd_media': sum(m[2] for m in muestras) / len(muestras) * 1000,
+            'plantillas_media': sum(m[3] for m in muestras) / len(muestras) * 1000,
+            'presupuesto': PRESUPUESTO_CONSULTAS.get(vista),
+        })
+    return sorted(filas, key=lambda f: f['p95'], reverse=True)
+
+# ==========================================
+# 4. CABECERA SERVER-TIMING
+# ==========================================
+
+# Los DevTools del navegador muestran el desglose en la pestaña Timing de cada petición.
+# Revela cuánto tardan la BD y el storage: para todos sólo en desarrollo, en producción
+# sólo lo reciben los admins
+SERVER_TIMING = getattr(settings, 'DIAGNOSTICO_SERVER_TIMING', settings.DEBUG)
+
+SPANS = (
+    ('bd', 'Base de datos'), ('plantillas', 'Plantillas'), ('pdf', 'WeasyPrint'),
+    ('storage', 'Almacenamiento'), ('correo', 'Correo'), ('vista', 'Total'),
+)
+
+
+def ve_server_timing(usuario):
+    return SERVER_TIMING or (usuario is not None and usuario.is_authenticated and usuario.rol == 'admin')
+
+def server_timing(medicion):
+    partes = []
+    for nombre, descripcion in SPANS:
+        if nombre not in medicion.tiempos:
+            continue
+        if nombre == 'bd':
+            descripcion = f"{descripcion} ({medicion.consultas} consultas)"
+        partes.append(f'{nombre};desc="{descripcion}";dur={medicion.tiempos[nombre] * 1000:.1f}')
+    return ', '.join(partes)
+
+# ==========================================
+# 5. MIDDLEWARE
+# ==========================================
+
+class DiagnosticoMiddleware:
+    """
+    Mide consultas, tiempo de BD, de plantillas y de vista; aplica presupuestos,
+    guarda percentiles y devuelve el desglose en la cabecera Server-Timing.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        medicion, inicio = Medicion(), time.perf_counter()
+        token = _medicion.set(medicion)
+        try:
+            response = self.get_response(request)
+        finally:
+            _medicion.reset(token)
+        total = time.perf_counter() - inicio
+        # request.user lo pone AuthenticationMiddleware, que va después de éste
+        self._cerrar(request, response, medicion, total, ve_server_timing(getattr(request, 'user', None)))
+        return response
+
+    async def __acall__(self, request):
+        medicion, inicio = Medicion(), time.perf_counter()
+        token = _medicion.set(medicion)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _medicion.reset(token)
+        total = time.perf_counter() - inicio
+        usuario = await request.auser() if not SERVER_TIMING and hasattr(request, 'auser') else None
+        self._cerrar(request, response, medicion, total, ve_server_timing(usuario))
+        return response
+
+    def _cerrar(self, request, response, medicion, total, con_server_timing):
+        medicion.sumar('vista', total)
+        if con_server_timing:
+            response['Server-Timing'] = server_timing(medicion)
+        coincidencia = getattr(request, 'resolver_match', None)
+        vista = coincidencia.view_name if coincidencia else None
+        if not vista:
+            return
+        registrar_muestra(vista, total, medicion)
+        metricas.peticion_segundos.observar(total, vista=vista, metodo=request.method)
+        revisar_presupuesto(vista, medicion.consultas)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from expedientes.auditoria import LOTE_ARCHIVO, RETENCION_DIAS, archivar_bitacora
+
+
+class Command(BaseCommand):
+    help = "Mueve la bitácora más vieja que la retención a archivos JSONL comprimidos y la borra de la tabla."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=RETENCION_DIAS, help="Días que se conservan en la tabla.")
+        parser.add_argument('--lote', type=int, default=LOTE_ARCHIVO, help="Filas por lote.")
+        parser.add_argument('--dry-run', action='store_true', help="Sólo cuenta las filas que se archivarían.")
+
+    def handle(self, *args, **opts):
+        filas, particiones = archivar_bitacora(opts['dias'], opts['lote'], opts['dry_run'])
+        if opts['dry_run']:
+            self.stdout.write(f"Se archivarían {filas} entradas con más de {opts['dias']} días.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Listo: {filas} entradas archivadas en {particiones} particiones."))
@@ -0,0 +1,67 @@
+import json
+import statistics
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand
+
+from expedientes.arranque import LIBRERIAS_PESADAS
+
+# Se mide en un intérprete nuevo: lo mismo que paga un worker de gunicorn al arrancar
+SCRIPT = r'''
+import importlib, json, os, resource, sys, time
+inicio = time.perf_counter()
+import django
+django.setup()
+from django.conf import settings
+importlib.import_module(settings.ROOT_URLCONF)
+for nombre in sys.argv[1:]:
+    importlib.import_module(nombre)
+segundos = time.perf_counter() - inicio
+try:
+    with open('/proc/self/statm') as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+except OSError:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+print(json.dumps({'segundos': segundos, 'rss': rss, 'modulos': len(sys.modules)}))
+'''
+
+
+class Command(BaseCommand):
+    help = "Mide el tiempo de importación y la memoria (RSS) de un worker, con y sin las librerías pesadas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=5, help="Arranques por modo (se reporta la mediana).")
+        parser.add_argument('--json', dest='salida', help="Ruta donde guardar el resultado en JSON.")
+
+    def _arrancar(self, modulos):
+        proceso = subprocess.run([sys.executable, '-c', SCRIPT, *modulos], capture_output=True, text=True)
+        if proceso.returncode != 0:
+            raise RuntimeError(proceso.stderr.strip().splitlines()[-1] if proceso.stderr.strip() else "falló el arranque")
+        return json.loads(proceso.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **opts):
+        # 'perezoso' es el arranque actual; 'completo' lo que pagaba cada worker
+        # cuando las vistas importaban todo al inicio (o lo que hereda con --preload)
+        modos = {'perezoso': [], 'completo': list(LIBRERIAS_PESADAS)}
+        resultado = {}
+        for modo, modulos in modos.items():
+            try:
+                medidas = [self._arrancar(modulos) for _ in range(opts['repeticiones'])]
+            except RuntimeError as e:
+                self.stderr.write(f"{modo}: {e}")
+                continue
+            resultado[modo] = {
+                'segundos': statistics.median(m['segundos'] for m in medidas),
+                'rss_mb': statistics.median(m['rss'] for m in medidas) / 2 ** 20,
+                'modulos': medidas[-1]['modulos'],
+            }
+            r = resultado[modo]
+            self.stdout.write(f"{modo:<10} {r['segundos'] * 1000:8.0f} ms  {r['rss_mb']:7.1f} MB  {r['modulos']:5} módulos")
+
+        if len(resultado) == 2:
+            ahorro = resultado['completo']['rss_mb'] - resultado['perezoso']['rss_mb']
+            self.stdout.write(self.style.SUCCESS(f"Ahorro por worker: {ahorro:.1f} MB"))
+        if opts['salida']:
+            with open(opts['salida'], 'w') as f:
+                json.dump(resultado, f, indent=2)
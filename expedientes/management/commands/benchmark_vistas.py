@@ -0,0 +1,63 @@
+import json
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from expedientes.rendimiento import ESCENARIOS, correr
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Mide latencia (p50/p95/p99), consultas y pico de memoria de las vistas principales con datos sintéticos a varias escalas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', default='50,500,2000', help="Clientes por corrida, separados por coma.")
+        parser.add_argument('--vistas', default='', help=f"Subconjunto de: {', '.join(ESCENARIOS)}.")
+        parser.add_argument('--repeticiones', type=int, default=20, help="Peticiones medidas por vista.")
+        parser.add_argument('--semilla', type=int, default=1, help="Semilla del generador de datos.")
+        parser.add_argument('--json', dest='salida', help="Ruta donde guardar el resultado.")
+        parser.add_argument('--comparar', help="JSON de una corrida anterior para mostrar la diferencia.")
+
+    def handle(self, *args, **opts):
+        tamanos = [int(t) for t in opts['tamanos'].split(',') if t.strip()]
+        vistas = [v.strip() for v in opts['vistas'].split(',') if v.strip()] or list(ESCENARIOS)
+        desconocidas = set(vistas) - set(ESCENARIOS)
+        if desconocidas:
+            raise CommandError(f"Vistas desconocidas: {', '.join(sorted(desconocidas))}")
+        anterior = {}
+        if opts['comparar']:
+            with open(opts['comparar']) as f:
+                anterior = json.load(f)['resultados']
+
+        def reportar(tamano, vista, m):
+            if 'error' in m:
+                self.stdout.write(self.style.ERROR(f"{tamano:>6} {vista:<24} {m['error']}"))
+                return
+            linea = (f"{tamano:>6} {vista:<24} p50 {m['p50_ms']:7.1f}  p95 {m['p95_ms']:7.1f}  p99 {m['p99_ms']:7.1f} ms"
+                     f"  {m['consultas']:4} consultas  {m['pico_memoria_kb']:9,.0f} KB")
+            previo = anterior.get(str(tamano), {}).get(vista, {})
+            if previo.get('p50_ms'):
+                cambio = (m['p50_ms'] / previo['p50_ms'] - 1) * 100
+                linea += f"  ({cambio:+.0f}% p50, {m['consultas'] - previo['consultas']:+} consultas)"
+            self.stdout.write(linea)
+
+        self.stdout.write(f"{'tamaño':>6} {'vista':<24}")
+        resultados = correr(tamanos, vistas, opts['repeticiones'], opts['semilla'], reportar)
+
+        if opts['salida']:
+            with open(opts['salida'], 'w') as f:
+                json.dump({
+                    'commit': _commit(),
+                    'fecha': timezone.now().isoformat(),
+                    'semilla': opts['semilla'],
+                    'repeticiones': opts['repeticiones'],
+                    'resultados': resultados,
+                }, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Resultado guardado en {opts['salida']}"))
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from expedientes.almacenamiento import _hash_contenido
+from expedientes.models import Blob, Documento
+
+
+class Command(BaseCommand):
+    help = "Enlaza los documentos anteriores a la deduplicación con su Blob y borra las copias repetidas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=100, help="Documentos por lote.")
+        parser.add_argument('--dry-run', action='store_true', help="Sólo reporta, no modifica nada.")
+
+    def handle(self, *args, **opts):
+        enlazados = repetidos = ahorro = errores = 0
+        ultimo_id = 0
+        while True:
+            lote = list(Documento.objects.filter(blob__isnull=True, id__gt=ultimo_id).exclude(archivo='').order_by('id')[:opts['lote']])
+            if not lote:
+                break
+            ultimo_id = lote[-1].id
+
+            for doc in lote:
+                storage = doc.archivo.storage
+                try:
+                    with doc.archivo.open('rb') as f:
+                        sha256, tamano = _hash_contenido(f)
+                except Exception as e:
+                    errores += 1
+                    self.stderr.write(f"Documento {doc.id}: {e}")
+                    continue
+
+                blob = Blob.objects.filter(sha256=sha256).first()
+                if opts['dry_run']:
+                    if blob:
+                        repetidos += 1
+                        ahorro += tamano
+                    else:
+                        enlazados += 1
+                    continue
+
+                with transaction.atomic():
+                    if blob is None:
+                        # La primera copia se queda donde está y se vuelve el Blob
+                        blob = Blob.objects.create(sha256=sha256, archivo=doc.archivo.name, tamano=tamano, referencias=1)
+                        Documento.objects.filter(id=doc.id).update(blob=blob)
+                        enlazados += 1
+                        continue
+                    copia = doc.archivo.name
+                    Blob.objects.filter(id=blob.id).update(referencias=F('referencias') + 1)
+                    Documento.objects.filter(id=doc.id).update(blob=blob, archivo=blob.archivo.name)
+                    transaction.on_commit(lambda s=storage, n=copia: s.delete(n))
+                repetidos += 1
+                ahorro += tamano
+
+            self.stdout.write(f"... hasta id {ultimo_id}: {enlazados} enlazados, {repetidos} repetidos")
+
+        verbo = "se liberarían" if opts['dry_run'] else "liberados"
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo: {enlazados} blobs nuevos, {repetidos} copias repetidas ({ahorro / 1024 / 1024:.1f} MB {verbo}), {errores} errores."
+        ))
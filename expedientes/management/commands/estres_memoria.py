@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from expedientes.rendimiento import ESTRES, estresar, pendiente
+from .benchmark_vistas import _commit
+
+ANCHO_BARRA = 40
+
+
+class Command(BaseCommand):
+    help = "Repite las vistas que más memoria usan (PDF, ZIP, DOCX) con entradas crecientes y grafica el pico de memoria (tracemalloc)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', default='5,20,80', help="Valores de n (partidas, anexos, párrafos) separados por coma.")
+        parser.add_argument('--vistas', default='', help=f"Subconjunto de: {', '.join(ESTRES)}.")
+        parser.add_argument('--repeticiones', type=int, default=3, help="Peticiones por tamaño; se reporta la de pico mediano.")
+        parser.add_argument('--sitios', type=int, default=3, help="Sitios de asignación a mostrar del tamaño mayor.")
+        parser.add_argument('--json', dest='salida', help="Ruta donde guardar el resultado.")
+
+    def handle(self, *args, **opts):
+        tamanos = sorted(int(t) for t in opts['tamanos'].split(',') if t.strip())
+        vistas = [v.strip() for v in opts['vistas'].split(',') if v.strip()] or list(ESTRES)
+        desconocidas = set(vistas) - set(ESTRES)
+        if not tamanos:
+            raise CommandError("Indica al menos un tamaño con --tamanos.")
+        if desconocidas:
+            raise CommandError(f"Vistas desconocidas: {', '.join(sorted(desconocidas))}")
+
+        def reportar(vista, n, m):
+            if n == tamanos[0]:
+                self.stdout.write(self.style.MIGRATE_HEADING(f"\n{vista} (n = {ESTRES[vista][0]})"))
+            if 'error' in m:
+                self.stdout.write(self.style.ERROR(f"{n:>6}  {m['error']}"))
+                return
+            self.stdout.write(f"{n:>6}  pico {m['pico_kb']:10,.0f} KB  retenido {m['retenido_kb']:9,.0f} KB"
+                              f"  {m['ms']:8.0f} ms  {m['bytes']:>11,} bytes  [{m['status']}]")
+
+        resultados = estresar(tamanos, vistas, opts['repeticiones'], reportar)
+
+        # Gráfica: una barra por tamaño, escalada al pico mayor de la vista
+        self.stdout.write(self.style.MIGRATE_HEADING("\nCrecimiento del pico de memoria"))
+        for vista, medidas in resultados.items():
+            puntos = [(n, m['pico_kb']) for n, m in medidas.items() if 'error' not in m]
+            if not puntos:
+                continue
+            maximo = max(kb for _, kb in puntos) or 1
+            self.stdout.write(f"\n{vista}: {pendiente(puntos):+,.1f} KB por unidad ({ESTRES[vista][0]})")
+            for n, kb in puntos:
+                self.stdout.write(f"{n:>6} {'█' * max(1, round(kb / maximo * ANCHO_BARRA)):<{ANCHO_BARRA}} {kb:,.0f} KB")
+            for s in medidas[puntos[-1][0]]['sitios'][:opts['sitios']]:
+                self.stdout.write(f"         {s['kb']:9,.0f} KB  {s['archivo']}:{s['linea']}" + (f"  ← {s['origen']}" if s['origen'] else ''))
+
+        if opts['salida']:
+            with open(opts['salida'], 'w') as f:
+                json.dump({
+                    'commit': _commit(),
+                    'fecha': timezone.now().isoformat(),
+                    'repeticiones': opts['repeticiones'],
+                    'resultados': resultados,
+                    'pendientes_kb': {v: pendiente([(n, m['pico_kb']) for n, m in r.items() if 'error' not in m]) for v, r in resultados.items()},
+                }, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Resultado guardado en {opts['salida']}"))
@@ -0,0 +1,37 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expedientes.models import Usuario
+from expedientes.sinteticos import Generador
+
+
+class Command(BaseCommand):
+    help = "Genera un despacho ficticio a escala (usuarios, clientes, drive, bitácora, cotizaciones, cobranza y agenda) con bulk_create."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--semilla', type=int, default=1, help="Misma semilla y fecha de referencia = mismos datos.")
+        parser.add_argument('--usuarios', type=int, default=25, help="Abogados a crear.")
+        parser.add_argument('--clientes', type=int, default=2000, help="Clientes, cada uno con su árbol de carpetas.")
+        parser.add_argument('--documentos', type=int, default=12, help="Documentos por cliente.")
+        parser.add_argument('--bitacora', type=int, default=40, help="Entradas de bitácora por cliente.")
+        parser.add_argument('--anios', type=int, default=3, help="Años de historia que cubre la bitácora.")
+        parser.add_argument('--eventos', type=int, default=120, help="Eventos de agenda por usuario.")
+        parser.add_argument('--prefijo', default='demo', help="Prefijo de usuarios y clientes (no debe existir ya).")
+        parser.add_argument('--referencia', type=date.fromisoformat, default=None, help="Fecha 'hoy' de los datos (AAAA-MM-DD); por omisión hoy.")
+        parser.add_argument('--lote', type=int, default=2000, help="Filas por INSERT.")
+
+    def handle(self, *args, **opts):
+        if Usuario.objects.filter(username__startswith=f"{opts['prefijo']}_").exists():
+            raise CommandError(f"Ya hay datos con el prefijo '{opts['prefijo']}'; usa otro con --prefijo.")
+
+        generador = Generador(
+            semilla=opts['semilla'], usuarios=opts['usuarios'], clientes=opts['clientes'],
+            documentos=opts['documentos'], bitacora=opts['bitacora'], anios=opts['anios'],
+            eventos=opts['eventos'], prefijo=opts['prefijo'], referencia=opts['referencia'], lote=opts['lote'],
+        )
+        conteos, segundos = generador.generar()
+        for modelo, filas in conteos.items():
+            self.stdout.write(f"  {modelo:<28} {filas:>9,}")
+        total = sum(conteos.values())
+        self.stdout.write(self.style.SUCCESS(f"Listo: {total:,} filas en {segundos:.1f} s ({total / max(segundos, 0.001):,.0f} filas/s)."))
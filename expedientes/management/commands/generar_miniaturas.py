@@ -0,0 +1,49 @@
+import uuid
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from expedientes.almacenamiento import EXT_IMAGEN, EXT_PDF, pool_miniaturas, generar_miniatura
+from expedientes.models import Documento
+
+
+class Command(BaseCommand):
+    help = "Genera las miniaturas faltantes (o todas con --todas) de los documentos del Drive."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todas', action='store_true', help="Regenera también las que ya existen.")
+        parser.add_argument('--lote', type=int, default=200, help="Documentos por lote.")
+        parser.add_argument('--cliente', type=uuid.UUID, help="Limita a un cliente (id UUID).")
+
+    def handle(self, *args, **opts):
+        filtro_ext = Q()
+        for ext in EXT_IMAGEN | EXT_PDF:
+            filtro_ext |= Q(archivo__iendswith=f'.{ext}')
+
+        docs = Documento.objects.filter(filtro_ext).order_by('id')
+        if not opts['todas']:
+            docs = docs.filter(miniatura='')
+        if opts['cliente']:
+            docs = docs.filter(cliente_id=opts['cliente'])
+
+        hechas = fallidas = 0
+        ultimo_id = 0
+        while True:
+            # Paginación por llave: no se salta filas aunque el filtro cambie al actualizar
+            ids = list(docs.filter(id__gt=ultimo_id).values_list('id', flat=True)[:opts['lote']])
+            if not ids:
+                break
+            ultimo_id = ids[-1]
+
+            futuros = {pool_miniaturas.submit(generar_miniatura, i): i for i in ids}
+            for futuro in as_completed(futuros):
+                try:
+                    if futuro.result():
+                        hechas += 1
+                except Exception as e:
+                    fallidas += 1
+                    self.stderr.write(f"Documento {futuros[futuro]}: {e}")
+            self.stdout.write(f"... hasta id {ultimo_id}: {hechas} generadas, {fallidas} con error")
+
+        self.stdout.write(self.style.SUCCESS(f"Listo: {hechas} miniaturas generadas, {fallidas} con error."))
@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from expedientes.almacenamiento import _borrar_lote, huella_nombre, listar_storage, marcar_referenciados
+
+
+class Command(BaseCommand):
+    help = (
+        "Recolector de archivos huérfanos: marca todos los nombres referenciados por "
+        "cualquier FileField/ImageField y borra del almacenamiento los que no lo estén "
+        "y sean más viejos que el periodo de gracia."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Sólo reporta lo que se borraría.")
+        parser.add_argument('--gracia', type=int, default=24, help="Horas de gracia (subidas en curso, callbacks pendientes).")
+        parser.add_argument('--prefijo', default='', help="Limita el barrido a una carpeta del almacenamiento.")
+        parser.add_argument('--pagina', type=int, default=1000, help="Archivos por página del listado.")
+        parser.add_argument('--estado', default=os.path.join(tempfile.gettempdir(), 'applegal_limpieza.json'),
+                            help="Archivo donde se guarda el cursor para reanudar.")
+        parser.add_argument('--reanudar', action='store_true', help="Continúa desde el último cursor guardado.")
+        parser.add_argument('--mostrar', type=int, default=20, help="Cuántos huérfanos listar en el reporte.")
+
+    def _leer_estado(self, opts):
+        if not opts['reanudar'] or not os.path.exists(opts['estado']):
+            return None
+        with open(opts['estado']) as f:
+            estado = json.load(f)
+        if estado.get('prefijo') != opts['prefijo']:
+            return None
+        return estado.get('cursor')
+
+    def _guardar_estado(self, opts, cursor):
+        with open(opts['estado'], 'w') as f:
+            json.dump({'prefijo': opts['prefijo'], 'cursor': cursor, 'fecha': timezone.now().isoformat()}, f)
+
+    def handle(self, *args, **opts):
+        limite = timezone.now() - timedelta(hours=opts['gracia'])
+        cursor = self._leer_estado(opts)
+        if cursor:
+            self.stdout.write(f"Reanudando después de: {cursor}")
+
+        # Mark: siempre desde cero (lo referenciado pudo cambiar desde la corrida anterior)
+        vivos = marcar_referenciados()
+        self.stdout.write(f"{len(vivos)} nombres referenciados en la base de datos.")
+
+        revisados = huerfanos = recientes = fallidos = 0
+        ejemplos = []
+        for pagina, cursor in listar_storage(default_storage, opts['prefijo'], cursor, opts['pagina']):
+            candidatos = []
+            for nombre, modificado in pagina:
+                revisados += 1
+                if huella_nombre(nombre) in vivos:
+                    continue
+                if modificado and modificado > limite:
+                    recientes += 1
+                    continue
+                candidatos.append(nombre)
+
+            huerfanos += len(candidatos)
+            ejemplos += candidatos[:max(0, opts['mostrar'] - len(ejemplos))]
+            if candidatos and not opts['dry_run']:
+                for i in range(0, len(candidatos), 100):
+                    fallidos += len(_borrar_lote(default_storage, candidatos[i:i + 100]))
+            if not opts['dry_run']:
+                self._guardar_estado(opts, cursor)
+            self.stdout.write(f"... {revisados} revisados, {huerfanos} huérfanos")
+
+        if not opts['dry_run'] and os.path.exists(opts['estado']):
+            os.remove(opts['estado'])  # Barrido completo: la próxima corrida empieza de cero
+
+        for nombre in ejemplos:
+            self.stdout.write(f"  - {nombre}")
+        verbo = "se borrarían" if opts['dry_run'] else "borrados"
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo: {revisados} archivos revisados, {huerfanos} huérfanos {verbo}, "
+            f"{recientes} dentro del periodo de gracia, {fallidos} fallidos."
+        ))
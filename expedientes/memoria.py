@@ -0,0 +1,240 @@
+import logging
+import threading
+import time
+import tracemalloc
+from collections import deque
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+from . import metricas
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 1. RASTREO CON TRACEMALLOC
+# ==========================================
+
+# Las vistas marcadas con @perfil_memoria se miden siempre con DIAGNOSTICO_MEMORIA=True;
+# si no, sólo cuando un admin agrega '?_memoria=1' o la cabecera 'X-Memoria'.
+MEMORIA_ACTIVA = getattr(settings, 'DIAGNOSTICO_MEMORIA', False)
+MARCOS = getattr(settings, 'DIAGNOSTICO_MEMORIA_MARCOS', 6)  # profundidad de pila por asignación
+INTERVALO_VIGIA = 0.005  # segundos entre lecturas del vigía
+SITIOS = 15
+HISTORIAL = 50  # mediciones por vista
+
+# El rastreo lo arrancan/paran las peticiones medidas; si alguien más lo encendió
+# (python -X tracemalloc, el benchmark) se respeta y no se apaga.
+_activas = 0
+_nuestro = False
+_candado = threading.Lock()
+
+# Lo que tracemalloc se asigna a sí mismo (las instantáneas) no es de la vista. Se
+# descarta en los resultados: Snapshot.filter_traces() recorre cada traza en Python
+# y tarda más que la propia vista
+_AJENOS = (tracemalloc.__file__, '<frozen importlib._bootstrap>', '<unknown>')
+
+
+def _arrancar():
+    global _activas, _nuestro
+    with _candado:
+        if _activas == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(MARCOS)
+            _nuestro = True
+        _activas += 1
+
+def _detener():
+    global _activas, _nuestro
+    with _candado:
+        _activas -= 1
+        if _activas == 0 and _nuestro:
+            tracemalloc.stop()
+            _nuestro = False
+
+
+class Rastreo:
+    """
+    Pico y sitios de asignación de una petición. tracemalloc es global al proceso:
+    cuenta también lo que asignan los hilos de sync_to_async (bien) y las peticiones
+    concurrentes (mal), así que en producción conviene medir en un worker aislado.
+
+    Los sitios salen de una instantánea que un hilo vigía toma cada vez que la
+    petición crece un CRECIMIENTO sobre su máximo anterior: así se ve qué ocupaba
+    memoria cerca del pico (el HTML de WeasyPrint, el buffer del DOCX), no sólo lo
+    que sigue vivo cuando la vista devuelve. La instantánea ocupa memoria rastreada;
+    se descuenta del pico, que se reinicia después de tomarla.
+    """
+    CRECIMIENTO = 1.5
+    MINIMO = 256 * 1024  # bytes; debajo de esto no vale la pena una instantánea
+
+    def __init__(self, vista):
+        self.vista = vista
+        self.pico = 0  # bytes de la petición, sin las instantáneas
+        self.sobrecarga = 0  # bytes de la instantánea viva
+        self.cumbre = None  # (bytes de la petición, instantánea)
+        self._terminado = False
+        self._alto = threading.Event()
+        self._vigia = threading.Thread(target=self._vigilar, name='memoria-vigia', daemon=True)
+
+    def iniciar(self):
+        _arrancar()
+        self.inicial = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        self.base = tracemalloc.get_traced_memory()[0]
+        self.inicio = time.perf_counter()
+        self._vigia.start()
+
+    def _leer(self):
+        actual, pico = tracemalloc.get_traced_memory()
+        self.pico = max(self.pico, pico - self.base - self.sobrecarga)
+        return actual - self.base - self.sobrecarga
+
+    def _vigilar(self):
+        umbral = self.MINIMO
+        while not self._alto.wait(INTERVALO_VIGIA):
+            peticion = self._leer()
+            if peticion > umbral:
+                umbral = peticion * self.CRECIMIENTO
+                self._fotografiar(peticion)
+
+    def _fotografiar(self, peticion):
+        self.cumbre = None
+        self.sobrecarga = 0
+        antes = tracemalloc.get_traced_memory()[0]
+        instantanea = tracemalloc.take_snapshot()
+        self.sobrecarga = max(0, tracemalloc.get_traced_memory()[0] - antes)
+        tracemalloc.reset_peak()
+        self.cumbre = (peticion, instantanea)
+
+    def terminar(self, status=None):
+        if self._terminado:
+            return
+        self._terminado = True
+        self._alto.set()
+        self._vigia.join()
+        try:
+            retenido = self._leer()
+            if self.cumbre is None or retenido >= self.cumbre[0]:
+                self._fotografiar(retenido)
+            diferencias = self.cumbre[1].compare_to(self.inicial, 'traceback')
+        finally:
+            _detener()
+        self.inicial = self.cumbre = None
+        registrar_medida(self.vista, {
+            'pico_kb': self.pico / 1024,
+            'retenido_kb': retenido / 1024,
+            'duracion_ms': (time.perf_counter() - self.inicio) * 1000,
+            'status': status,
+            'sitios': _sitios(diferencias),
+        })
+
+def _del_proyecto(archivo):
+    return archivo.startswith(str(settings.BASE_DIR)) and 'site-packages' not in archivo
+
+def _sitios(diferencias):
+    sitios = []
+    for d in diferencias:
+        if d.size_diff <= 0 or d.traceback[-1].filename in _AJENOS:
+            continue
+        # Además de la línea que asignó, la más cercana a ella que sea del proyecto
+        asigna = d.traceback[-1]
+        propio = next((f for f in reversed(d.traceback) if _del_proyecto(f.filename)), None)
+        sitios.append({
+            'archivo': asigna.filename, 'linea': asigna.lineno,
+            'origen': f"{propio.filename}:{propio.lineno}" if propio and propio != asigna else '',
+            'kb': d.size_diff / 1024, 'bloques': d.count_diff,
+        })
+        if len(sitios) == SITIOS:
+            break
+    return sitios
+
+# ==========================================
+# 2. REGISTRO (ventana por vista, por proceso)
+# ==========================================
+
+_medidas = {}
+
+
+def registrar_medida(vista, medida):
+    with _candado:
+        if vista not in _medidas:
+            _medidas[vista] = deque(maxlen=HISTORIAL)
+        _medidas[vista].append(medida)
+    metricas.memoria_pico_bytes.observar(medida['pico_kb'] * 1024, vista=vista)
+    logger.info("%s: pico %.0f KB, retenido %.0f KB", vista, medida['pico_kb'], medida['retenido_kb'])
+
+def ultima_medida(vista):
+    with _candado:
+        medidas = _medidas.get(vista)
+        return medidas[-1] if medidas else None
+
+def resumen_memoria():
+    """Una fila por vista, de mayor a menor pico, con los sitios de la petición que más memoria usó."""
+    with _candado:
+        copia = {vista: list(medidas) for vista, medidas in _medidas.items()}
+    filas = []
+    for vista, medidas in copia.items():
+        peor = max(medidas, key=lambda m: m['pico_kb'])
+        picos = sorted(m['pico_kb'] for m in medidas)
+        filas.append({
+            'vista': vista,
+            'peticiones': len(medidas),
+            'pico_p50_kb': picos[len(picos) // 2],
+            'pico_max_kb': peor['pico_kb'],
+            'retenido_kb': peor['retenido_kb'],
+            'sitios': peor['sitios'],
+        })
+    return sorted(filas, key=lambda f: f['pico_max_kb'], reverse=True)
+
+# ==========================================
+# 3. DECORADOR
+# ==========================================
+
+def _solicitado(request, usuario):
+    if MEMORIA_ACTIVA:
+        return True
+    pedido = request.headers.get('X-Memoria') or request.GET.get('_memoria')
+    return bool(pedido) and usuario.is_authenticated and usuario.rol == 'admin'
+
+def _cerrar(rastreo, response):
+    if response.streaming:
+        # El ZIP se arma mientras se envía: se mide hasta que el servidor cierra la
+        # respuesta (también si el cliente corta la descarga a la mitad)
+        response._resource_closers.append(lambda: rastreo.terminar(response.status_code))
+    else:
+        rastreo.terminar(response.status_code)
+    return response
+
+def perfil_memoria(vista):
+    """Mide pico y sitios de asignación de la vista (sync o async) cuando está activo."""
+    nombre = vista.__name__
+
+    if iscoroutinefunction(vista):
+        @wraps(vista)
+        async def envoltura(request, *args, **kwargs):
+            if not _solicitado(request, await request.auser()):
+                return await vista(request, *args, **kwargs)
+            rastreo = Rastreo(nombre)
+            rastreo.iniciar()
+            try:
+                response = await vista(request, *args, **kwargs)
+            except BaseException:
+                rastreo.terminar(500)
+                raise
+            return _cerrar(rastreo, response)
+        return envoltura
+
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        if not _solicitado(request, request.user):
+            return vista(request, *args, **kwargs)
+        rastreo = Rastreo(nombre)
+        rastreo.iniciar()
+        try:
+            response = vista(request, *args, **kwargs)
+        except BaseException:
+            rastreo.terminar(500)
+            raise
+        return _cerrar(rastreo, response)
+    return envoltura
@@ -0,0 +1,297 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import request_started
+
+# ==========================================
+# 1. REGISTRO (contadores e histogramas)
+# ==========================================
+
+# Cada proceso que atiende peticiones guarda sus valores en memoria y los vuelca
+# cada pocos segundos a <dir>/<pid>-<arranque>.json; /metrics suma los archivos de
+# todos los workers. Los de procesos terminados se pliegan en ACUMULADO y se borran:
+# los contadores nunca bajan y cada lectura abre un archivo por worker vivo.
+DIR_METRICAS = getattr(settings, 'METRICAS_DIR', os.path.join(tempfile.gettempdir(), 'applegal_metricas'))
+INTERVALO_VOLCADO = getattr(settings, 'METRICAS_INTERVALO', 5)
+# /metrics acepta 'Authorization: Bearer <token>' (Prometheus) o la sesión de un admin
+TOKEN_METRICAS = getattr(settings, 'METRICAS_TOKEN', '')
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_BYTES = (10_000, 100_000, 1_000_000, 10_000_000, 100_000_000, 1_000_000_000)
+
+_candado = threading.Lock()
+_valores = {}    # (nombre, etiquetas) -> float (contador) o [buckets..., suma, cuenta] (histograma)
+_metricas = {}   # nombre -> Contador / Histograma
+_archivo = None
+_ultimo_volcado = 0.0
+_sirve = False  # comandos (migrate, shell, generar_miniaturas) no dejan archivo
+
+
+def _etiquetas(etiquetas):
+    return tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda):
+        self.nombre, self.ayuda = nombre, ayuda
+        _metricas[nombre] = self
+
+    def inc(self, cantidad=1, **etiquetas):
+        llave = (self.nombre, _etiquetas(etiquetas))
+        with _candado:
+            _valores[llave] = _valores.get(llave, 0) + cantidad
+        _volcar_si_toca()
+
+
+class Histograma:
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, buckets=BUCKETS_SEGUNDOS):
+        self.nombre, self.ayuda, self.buckets = nombre, ayuda, tuple(buckets)
+        _metricas[nombre] = self
+
+    def observar(self, valor, **etiquetas):
+        llave = (self.nombre, _etiquetas(etiquetas))
+        with _candado:
+            celdas = _valores.get(llave)
+            if celdas is None:
+                celdas = _valores[llave] = [0] * (len(self.buckets) + 2)
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    celdas[i] += 1
+            celdas[-2] += valor
+            celdas[-1] += 1
+        _volcar_si_toca()
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+# ==========================================
+# 2. VOLCADO Y AGREGACIÓN ENTRE PROCESOS
+# ==========================================
+
+def _ruta_proceso():
+    global _archivo
+    if _archivo is None or not _archivo.startswith(os.path.join(DIR_METRICAS, f"{os.getpid()}-")):
+        # Tras un fork el hijo hereda la variable: el pid en el nombre la invalida
+        _archivo = os.path.join(DIR_METRICAS, f"{os.getpid()}-{time.time_ns()}.json")
+    return _archivo
+
+def volcar():
+    global _ultimo_volcado
+    with _candado:
+        datos = [[nombre, list(etiquetas), valor] for (nombre, etiquetas), valor in _valores.items()]
+        _ultimo_volcado = time.monotonic()
+    if not datos:
+        return
+    os.makedirs(DIR_METRICAS, exist_ok=True)
+    ruta = _ruta_proceso()
+    temporal = f"{ruta}.{threading.get_ident()}.tmp"
+    with open(temporal, 'w') as f:
+        json.dump(datos, f)
+    os.replace(temporal, ruta)
+
+def _volcar_si_toca():
+    if _sirve and time.monotonic() - _ultimo_volcado >= INTERVALO_VOLCADO:
+        try:
+            volcar()
+        except OSError:
+            pass
+
+def _al_salir():
+    if _sirve:
+        volcar()
+
+def _marcar_servidor(**kwargs):
+    global _sirve
+    _sirve = True
+
+atexit.register(_al_salir)
+request_started.connect(_marcar_servidor, dispatch_uid='metricas_servidor')
+
+ACUMULADO = 'acumulado.json'  # {'plegados': [archivos ya sumados], 'valores': [...]}
+_EXCLUSIVO = '.plegando'
+EXCLUSIVO_VENCE = 60  # segundos; un proceso que murió plegando no bloquea para siempre
+
+
+def _leer(nombre):
+    try:
+        with open(os.path.join(DIR_METRICAS, nombre)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _escribir(nombre, datos):
+    ruta = os.path.join(DIR_METRICAS, nombre)
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporal, 'w') as f:
+        json.dump(datos, f)
+    os.replace(temporal, ruta)
+
+def _sumar(total, datos):
+    for nombre, etiquetas, valor in datos:
+        llave = (nombre, tuple(tuple(e) for e in etiquetas))
+        if isinstance(valor, list):
+            previo = total.setdefault(llave, [0] * len(valor))
+            total[llave] = [a + b for a, b in zip(previo, valor)]
+        else:
+            total[llave] = total.get(llave, 0) + valor
+    return total
+
+def _vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # existe, pero de otro usuario
+    return True
+
+def _terminados(nombres):
+    """Archivos de procesos que ya no existen (o cuyo pid reusó un proceso más nuevo)."""
+    if os.name != 'posix':
+        return []  # en Windows os.kill(pid, 0) terminaría el proceso
+    procesos = {}
+    for nombre in nombres:
+        pid, _, arranque = nombre[:-len('.json')].partition('-')
+        if pid.isdigit() and arranque.isdigit():
+            procesos[nombre] = (int(pid), int(arranque))
+    ultimo = {}
+    for pid, arranque in procesos.values():
+        ultimo[pid] = max(ultimo.get(pid, 0), arranque)
+    return [n for n, (pid, arranque) in procesos.items() if arranque < ultimo[pid] or not _vivo(pid)]
+
+@contextmanager
+def _exclusivo():
+    ruta = os.path.join(DIR_METRICAS, _EXCLUSIVO)
+    try:
+        if time.time() - os.path.getmtime(ruta) > EXCLUSIVO_VENCE:
+            os.remove(ruta)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(ruta, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        yield False  # otro worker está plegando; lo hará él
+        return
+    try:
+        yield True
+    finally:
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+def _plegar(muertos):
+    with _exclusivo() as propio:
+        if not propio:
+            return
+        acumulado = _leer(ACUMULADO) or {'plegados': [], 'valores': []}
+        # Restos de un plegado que se cortó después de escribir ACUMULADO
+        for nombre in acumulado['plegados']:
+            try:
+                os.remove(os.path.join(DIR_METRICAS, nombre))
+            except OSError:
+                pass
+        total = _sumar({}, acumulado['valores'])
+        plegados = []
+        for nombre in muertos:
+            if nombre in acumulado['plegados']:
+                continue
+            datos = _leer(nombre)
+            if datos is not None:
+                _sumar(total, datos)
+                plegados.append(nombre)
+        # ACUMULADO confirma el plegado: lista lo que ya contiene para que nadie lo sume
+        # dos veces aunque los originales sigan ahí un momento (o para siempre, si esto muere)
+        _escribir(ACUMULADO, {
+            'plegados': plegados,
+            'valores': [[nombre, list(etiquetas), valor] for (nombre, etiquetas), valor in total.items()],
+        })
+        for nombre in plegados:
+            try:
+                os.remove(os.path.join(DIR_METRICAS, nombre))
+            except OSError:
+                pass
+
+def agregado():
+    """Suma de los valores de todos los procesos (vivos y terminados)."""
+    volcar()
+    try:
+        nombres = [n for n in os.listdir(DIR_METRICAS) if n.endswith('.json') and n != ACUMULADO]
+    except FileNotFoundError:
+        return {}
+    muertos = _terminados(nombres)
+    if muertos:
+        _plegar(muertos)
+    # Los archivos antes que ACUMULADO: si otro worker pliega entre ambas lecturas, lo
+    # leído aparece en 'plegados' y se descarta en lugar de contarse dos veces
+    leidos = {n: _leer(n) for n in nombres}
+    acumulado = _leer(ACUMULADO) or {'plegados': [], 'valores': []}
+    total = _sumar({}, acumulado['valores'])
+    for nombre, datos in leidos.items():
+        if datos is not None and nombre not in acumulado['plegados']:
+            _sumar(total, datos)
+    return total
+
+# ==========================================
+# 3. FORMATO DE TEXTO DE PROMETHEUS
+# ==========================================
+
+def _escapar(valor):
+    return valor.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def _serie(nombre, etiquetas, valor):
+    if etiquetas:
+        texto = ','.join(f'{k}="{_escapar(v)}"' for k, v in etiquetas)
+        return f"{nombre}{{{texto}}} {valor}"
+    return f"{nombre} {valor}"
+
+def exposicion():
+    valores = agregado()
+    lineas = []
+    for nombre, metrica in sorted(_metricas.items()):
+        lineas.append(f"# HELP {nombre} {metrica.ayuda}")
+        lineas.append(f"# TYPE {nombre} {metrica.tipo}")
+        series = sorted((etiquetas, valor) for (n, etiquetas), valor in valores.items() if n == nombre)
+        for etiquetas, valor in series:
+            if metrica.tipo == 'counter':
+                lineas.append(_serie(nombre, etiquetas, valor))
+                continue
+            for limite, cuenta in zip(metrica.buckets, valor):
+                lineas.append(_serie(f"{nombre}_bucket", etiquetas + (('le', repr(float(limite))),), cuenta))
+            lineas.append(_serie(f"{nombre}_bucket", etiquetas + (('le', '+Inf'),), valor[-1]))
+            lineas.append(_serie(f"{nombre}_sum", etiquetas, valor[-2]))
+            lineas.append(_serie(f"{nombre}_count", etiquetas, valor[-1]))
+    return '\n'.join(lineas) + '\n'
+
+# ==========================================
+# 4. MÉTRICAS DE LA APLICACIÓN
+# ==========================================
+
+peticion_segundos = Histograma('applegal_peticion_segundos', "Duración de la petición por vista.")
+pdf_segundos = Histograma('applegal_pdf_segundos', "Tiempo de render de WeasyPrint.")
+pdf_bytes = Histograma('applegal_pdf_bytes', "Tamaño de los PDF generados.", BUCKETS_BYTES)
+zip_segundos = Histograma('applegal_zip_segundos', "Duración de las exportaciones ZIP.")
+zip_bytes = Histograma('applegal_zip_bytes', "Bytes enviados por exportación ZIP.", BUCKETS_BYTES)
+correo_segundos = Histograma('applegal_correo_segundos', "Latencia del envío de correo.")
+correo_fallos = Contador('applegal_correo_fallos_total', "Envíos de correo que lanzaron una excepción.")
+storage_segundos = Histograma('applegal_storage_segundos', "Latencia de operaciones del almacenamiento.")
+mammoth_segundos = Histograma('applegal_mammoth_segundos', "Conversión de DOCX a HTML con mammoth.")
+memoria_pico_bytes = Histograma('applegal_memoria_pico_bytes', "Pico de memoria de Python (tracemalloc) de las vistas medidas.", BUCKETS_BYTES)
+cache_aciertos = Contador('applegal_cache_aciertos_total', "Lecturas de caché encontradas, por nivel (local o compartida).")
+cache_fallos = Contador('applegal_cache_fallos_total', "Lecturas de caché que no encontraron la llave en ningún nivel.")
+cache_llamadas = Contador('applegal_cache_llamadas_total', "Llamadas a consultas y fragmentos cacheados, por resultado.")
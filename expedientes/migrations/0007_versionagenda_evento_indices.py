@@ -0,0 +1,38 @@
+# Generated by Django 6.0.1 on 2026-10-19 10:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def crear_versiones(apps, schema_editor):
+    Usuario = apps.get_model('expedientes', 'Usuario')
+    VersionAgenda = apps.get_model('expedientes', 'VersionAgenda')
+    VersionAgenda.objects.bulk_create([VersionAgenda(usuario_id=pk) for pk in Usuario.objects.values_list('pk', flat=True)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expedientes', '0006_cotizacion_porcentaje_iva_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionAgenda',
+            fields=[
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='version_agenda', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('modificada', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(crear_versiones, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='evento',
+            index=models.Index(fields=['usuario', 'inicio'], name='evento_usuario_inicio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='evento',
+            index=models.Index(fields=['cliente', 'inicio'], name='evento_cliente_inicio_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.1 on 2026-10-19 11:40
+
+import uuid
+
+from django.db import migrations, models
+
+
+def generar_tokens(apps, schema_editor):
+    Usuario = apps.get_model('expedientes', 'Usuario')
+    for usuario in Usuario.objects.only('id'):
+        usuario.token_calendario = uuid.uuid4()
+        usuario.save(update_fields=['token_calendario'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expedientes', '0007_versionagenda_evento_indices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usuario',
+            name='token_calendario',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(generar_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='usuario',
+            name='token_calendario',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0.1 on 2026-10-19 12:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expedientes', '0008_usuario_token_calendario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evento',
+            name='recurrencia',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='evento',
+            name='recurrencia_hasta',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='ExcepcionEvento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_original', models.DateTimeField()),
+                ('cancelada', models.BooleanField(default=False)),
+                ('inicio', models.DateTimeField(blank=True, null=True)),
+                ('fin', models.DateTimeField(blank=True, null=True)),
+                ('evento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='excepciones', to='expedientes.evento')),
+            ],
+            options={
+                'unique_together': {('evento', 'fecha_original')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-19 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expedientes', '0009_evento_recurrencia_excepcionevento'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documento',
+            name='miniatura',
+            field=models.FileField(blank=True, editable=False, max_length=255, upload_to=''),
+        ),
+    ]
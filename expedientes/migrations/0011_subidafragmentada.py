@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-19 10:41
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expedientes', '0010_documento_miniatura'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubidaFragmentada',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('nombre_archivo', models.CharField(max_length=255)),
+                ('tamano', models.BigIntegerField()),
+                ('tamano_fragmento', models.PositiveIntegerField()),
+                ('huella', models.CharField(blank=True, max_length=255)),
+                ('creada_el', models.DateTimeField(auto_now_add=True)),
+                ('carpeta', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='expedientes.carpeta')),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='expedientes.cliente')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subidas', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.1 on 2026-10-19 11:20
+
+import django.db.models.deletion
+import expedientes.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expedientes', '0011_subidafragmentada'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('archivo', models.FileField(max_length=255, upload_to='')),
+                ('tamano', models.BigIntegerField()),
+                ('referencias', models.PositiveIntegerField(default=0)),
+                ('creado_el', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='documento',
+            name='archivo',
+            field=expedientes.models.CampoArchivoDeduplicado(max_length=255, upload_to='drive_legal/%Y/%m/%d/'),
+        ),
+        migrations.AddField(
+            model_name='documento',
+            name='blob',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='documentos', to='expedientes.blob'),
+        ),
+    ]
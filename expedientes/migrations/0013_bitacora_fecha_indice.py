@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-19 12:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expedientes', '0012_blob_documento_deduplicado'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bitacora',
+            name='fecha',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='bitacora',
+            index=models.Index(fields=['cliente', '-fecha', '-id'], name='bitacora_cliente_fecha_idx'),
+        ),
+    ]
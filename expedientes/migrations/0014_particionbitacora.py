@@ -0,0 +1,39 @@
+# Generated by Django 6.0.1 on 2026-10-19 12:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expedientes', '0013_bitacora_fecha_indice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParticionBitacora',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField()),
+                ('archivo', models.FileField(max_length=255, upload_to='')),
+                ('filas', models.PositiveIntegerField()),
+                ('desde', models.DateTimeField()),
+                ('hasta', models.DateTimeField()),
+                ('creada_el', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='bitacora',
+            index=models.Index(fields=['fecha'], name='bitacora_fecha_idx'),
+        ),
+        migrations.AddField(
+            model_name='particionbitacora',
+            name='cliente',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bitacora_archivada', to='expedientes.cliente'),
+        ),
+        migrations.AddIndex(
+            model_name='particionbitacora',
+            index=models.Index(fields=['cliente', '-hasta'], name='particion_cliente_hasta_idx'),
+        ),
+    ]
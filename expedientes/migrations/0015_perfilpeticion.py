@@ -0,0 +1,33 @@
+# Generated by Django 6.0.1 on 2026-10-19 19:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expedientes', '0014_particionbitacora'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerfilPeticion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metodo', models.CharField(max_length=10)),
+                ('ruta', models.CharField(max_length=500)),
+                ('vista', models.CharField(blank=True, max_length=100)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('duracion_ms', models.FloatField()),
+                ('consultas', models.PositiveIntegerField()),
+                ('formato', models.CharField(choices=[('pstats', 'cProfile (pstats)'), ('speedscope', 'Muestreo (speedscope)')], max_length=20)),
+                ('perfil', models.FileField(max_length=255, upload_to='')),
+                ('sql', models.FileField(max_length=255, upload_to='')),
+                ('resumen', models.TextField(blank=True)),
+                ('creado_el', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('usuario', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -1,10 +1,13 @@
 import uuid
 from decimal import Decimal
+from itertools import islice
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models.fields.files import FieldFile
 from django.core.validators import FileExtensionValidator
 from django.utils import timezone
-from django.db.models.signals import post_save
+from django.db.models import F, Prefetch, Q
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.conf import settings
 
@@ -41,6 +44,9 @@ class Usuario(AbstractUser):
 
     clientes_asignados = models.ManyToManyField('Cliente', blank=True, related_name='abogados_asignados')
 
+    # Token secreto del feed ICS (los calendarios del teléfono no manejan sesión)
+    token_calendario = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+
     def save(self, *args, **kwargs):
         if self.rol == 'admin':
             self.is_staff = True
@@ -49,6 +55,17 @@ class Usuario(AbstractUser):
                 setattr(self, field, True)
         super().save(*args, **kwargs)
 
+class VersionAgenda(models.Model):
+    """
+    Se incrementa cada vez que cambia algo visible en la agenda del usuario
+    (llaves de caché / ETag del ICS). Vive en su propia tabla y sólo lo toca
+    invalidar_agenda con un UPDATE F() + 1: un save() de un Usuario leído antes
+    (editar_usuario, mi_perfil) no lo puede regresar a un valor viejo.
+    """
+    usuario = models.OneToOneField(Usuario, on_delete=models.CASCADE, primary_key=True, related_name='version_agenda')
+    version = models.PositiveIntegerField(default=0)
+    modificada = models.DateTimeField(null=True, blank=True)
+
 # ==========================================
 # 2. CLIENTES
 # ==========================================
@@ -81,41 +98,64 @@ class Carpeta(models.Model):
     es_expediente = models.BooleanField(default=False)
     creada_el = models.DateTimeField(auto_now_add=True)
 
+    # Documentos que exige cada trámite; se buscan por nombre sin importar mayúsculas
+    REQUISITOS = {
+        'LICENCIA': [
+            'CONSTANCIA DE SITUACIÓN FISCAL', 'ACTA CONSTITUTIVA', 'PODER NOTARIAL',
+            'INE DEL REPRESENTANTE LEGAL', 'CONTRATO DE ARRENDAMIENTO', 
+            'LICENCIA DE USO DE SUELO', 'VISTO BUENO Y PAGO DE DERECHOS 2025'
+        ],
+        'PROTECCIÓN CIVIL': [
+            'CONSTANCIA DE SITUACIÓN FISCAL', 'ACTA CONSTITUTIVA', 'PODER NOTARIAL',
+            'INE DEL REPRESENTANTE LEGAL', 'CONTRATO DE ARRENDAMIENTO', 
+            'LICENCIA DE USO DE SUELO', 'RESPONSIVA Y DICTAMEN DE EXTINTORES',
+            'RESPONSIVA DE ALERTAMIENTO SISMICO', 'DICTAMEN DE INSTALACIONES ELÉCTRICAS',
+            'DICTAMEN ESTRUCTURAL', 'DICTAMEN DE GAS', 'DICTAMEN DE PROTECCIÓN CIVIL 2025'
+        ],
+        'FUNCIONAMIENTO': [
+            'CONSTANCIA DE SITUACIÓN FISCAL', 'ACTA CONSTITUTIVA', 'PODER NOTARIAL',
+            'INE DEL REPRESENTANTE LEGAL', 'CONTRATO DE ARRENDAMIENTO', 
+            'LICENCIA DE USO DE SUELO', 'RECIBO DE PAGO PREDIAL Y AGUA',
+            'AVISO DE FUNCIONAMIENTO (COFEPRIS)', 'DICTAMEN DE GIRO', 
+            'IMPACTO ESTATAL', 'VISTO BUENO EN MEDIO AMBIENTE', 
+            'DICTAMEN DE PROTECCIÓN CIVIL', 'LICENCIA DE FUNCIONAMIENTO 2025'
+        ]
+    }
+
     def __str__(self):
         return f"{self.nombre} - {self.cliente.nombre_empresa}"
 
+    @classmethod
+    def prefetch_cumplimiento(cls):
+        """
+        Prefetch para listas de carpetas: trae en una sola consulta los documentos
+        de todas que pueden cumplir un requisito (carpeta.documentos_requisito).
+        """
+        nombres = {req for lista in cls.REQUISITOS.values() for req in lista}
+        filtro = Q()
+        for nombre in nombres:
+            filtro |= Q(nombre_archivo__iexact=nombre)
+        return Prefetch('documentos', queryset=Documento.objects.filter(filtro).order_by('id'), to_attr='documentos_requisito')
+
     def obtener_detalle_cumplimiento(self):
-        requisitos = {
-            'LICENCIA': [
-                'CONSTANCIA DE SITUACIÓN FISCAL', 'ACTA CONSTITUTIVA', 'PODER NOTARIAL',
-                'INE DEL REPRESENTANTE LEGAL', 'CONTRATO DE ARRENDAMIENTO', 
-                'LICENCIA DE USO DE SUELO', 'VISTO BUENO Y PAGO DE DERECHOS 2025'
-            ],
-            'PROTECCIÓN CIVIL': [
-                'CONSTANCIA DE SITUACIÓN FISCAL', 'ACTA CONSTITUTIVA', 'PODER NOTARIAL',
-                'INE DEL REPRESENTANTE LEGAL', 'CONTRATO DE ARRENDAMIENTO', 
-                'LICENCIA DE USO DE SUELO', 'RESPONSIVA Y DICTAMEN DE EXTINTORES',
-                'RESPONSIVA DE ALERTAMIENTO SISMICO', 'DICTAMEN DE INSTALACIONES ELÉCTRICAS',
-                'DICTAMEN ESTRUCTURAL', 'DICTAMEN DE GAS', 'DICTAMEN DE PROTECCIÓN CIVIL 2025'
-            ],
-            'FUNCIONAMIENTO': [
-                'CONSTANCIA DE SITUACIÓN FISCAL', 'ACTA CONSTITUTIVA', 'PODER NOTARIAL',
-                'INE DEL REPRESENTANTE LEGAL', 'CONTRATO DE ARRENDAMIENTO', 
-                'LICENCIA DE USO DE SUELO', 'RECIBO DE PAGO PREDIAL Y AGUA',
-                'AVISO DE FUNCIONAMIENTO (COFEPRIS)', 'DICTAMEN DE GIRO', 
-                'IMPACTO ESTATAL', 'VISTO BUENO EN MEDIO AMBIENTE', 
-                'DICTAMEN DE PROTECCIÓN CIVIL', 'LICENCIA DE FUNCIONAMIENTO 2025'
-            ]
-        }
-
-        nombre_key = self.nombre.upper()
-        if nombre_key not in requisitos:
+        lista_req = self.REQUISITOS.get(self.nombre.upper())
+        if lista_req is None:
             return None
 
-        lista_req = requisitos[nombre_key]
+        documentos = getattr(self, 'documentos_requisito', None)
+        if documentos is None:
+            filtro = Q()
+            for req in lista_req:
+                filtro |= Q(nombre_archivo__iexact=req)
+            documentos = self.documentos.filter(filtro).order_by('id')
+        # El primero subido gana, igual que antes con .first() por requisito
+        por_nombre = {}
+        for doc in documentos:
+            por_nombre.setdefault(doc.nombre_archivo.upper(), doc)
+
         detalle = []
         for req in lista_req:
-            doc = self.documentos.filter(nombre_archivo__iexact=req).first()
+            doc = por_nombre.get(req.upper())
             if doc:
                 detalle.append({'nombre': req, 'estado': 'ok', 'doc': doc})
             else:
@@ -143,14 +183,76 @@ class Expediente(models.Model):
     prioridad = models.IntegerField(choices=((1, 'Baja'), (2, 'Media'), (3, 'Crítica')), default=2)
     creado_el = models.DateTimeField(auto_now_add=True)
 
+class Blob(models.Model):
+    """Contenido único en el almacenamiento, compartido por todos los Documentos idénticos."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    archivo = models.FileField(max_length=255)
+    tamano = models.BigIntegerField()
+    referencias = models.PositiveIntegerField(default=0)
+    creado_el = models.DateTimeField(auto_now_add=True)
+
+class ArchivoDeduplicado(FieldFile):
+    """
+    Al guardar, el contenido se direcciona por su SHA-256: si ya existe un Blob
+    idéntico sólo se suma una referencia y no se vuelve a subir nada. La
+    referencia y el INSERT del Documento van en la misma transacción: si el
+    INSERT falla la referencia se revierte con él. Con save=False la
+    transacción es del que llama (Documento.save, que corre esto en pre_save).
+    """
+    def save(self, name, content, save=True):
+        from .almacenamiento import guardar_blob
+        with transaction.atomic():
+            blob = guardar_blob(self.storage, name, content)
+            self.instance.blob = blob
+            self.name = blob.archivo.name
+            setattr(self.instance, self.field.attname, self.name)
+            self._committed = True
+            if save:
+                self.instance.save()
+
+class CampoArchivoDeduplicado(models.FileField):
+    attr_class = ArchivoDeduplicado
+
 class Documento(models.Model):
     cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name='documentos_cliente')
     carpeta = models.ForeignKey(Carpeta, on_delete=models.CASCADE, related_name='documentos', null=True, blank=True)
-    archivo = models.FileField(upload_to='drive_legal/%Y/%m/%d/')
+    archivo = CampoArchivoDeduplicado(upload_to='drive_legal/%Y/%m/%d/', max_length=255)
+    # Vacío en documentos anteriores a la deduplicación o subidos directo al almacenamiento
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, editable=False, related_name='documentos')
+    # WebP generado en segundo plano (ver almacenamiento.generar_miniatura)
+    miniatura = models.FileField(max_length=255, blank=True, editable=False)
     nombre_archivo = models.CharField(max_length=255)
     fecha_subida = models.DateTimeField(auto_now_add=True)
     subido_por = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True)
 
+    def save(self, *args, **kwargs):
+        # Documento.objects.create(archivo=f) sube el archivo en pre_save: su referencia
+        # al Blob se confirma o se revierte junto con el INSERT
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+class SubidaFragmentada(models.Model):
+    """Subida en curso por fragmentos; el Documento se crea hasta que se finaliza."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='subidas')
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE)
+    carpeta = models.ForeignKey(Carpeta, on_delete=models.CASCADE, null=True, blank=True)
+    nombre_archivo = models.CharField(max_length=255)
+    tamano = models.BigIntegerField()
+    tamano_fragmento = models.PositiveIntegerField()
+    # Identifica el mismo archivo local al reanudar (nombre, tamaño, fecha de modificación)
+    huella = models.CharField(max_length=255, blank=True)
+    creada_el = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def total_fragmentos(self):
+        return max(1, -(-self.tamano // self.tamano_fragmento))
+
+    def tamano_esperado(self, n):
+        if n == self.total_fragmentos - 1:
+            return self.tamano - n * self.tamano_fragmento
+        return self.tamano_fragmento
+
 # ==========================================
 # 4. GESTIÓN
 # ==========================================
@@ -167,7 +269,27 @@ class Bitacora(models.Model):
     cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE)
     accion = models.CharField(max_length=50)
     descripcion = models.TextField()
-    fecha = models.DateTimeField(auto_now_add=True)
+    # default en lugar de auto_now_add: la bitácora diferida guarda la hora real del evento
+    fecha = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['cliente', '-fecha', '-id'], name='bitacora_cliente_fecha_idx'),
+            models.Index(fields=['fecha'], name='bitacora_fecha_idx'),  # barrido de retención
+        ]
+
+class ParticionBitacora(models.Model):
+    """Catálogo de la bitácora archivada: un JSONL comprimido por cliente y mes (puede haber varias partes)."""
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name='bitacora_archivada')
+    mes = models.DateField()
+    archivo = models.FileField(max_length=255)
+    filas = models.PositiveIntegerField()
+    desde = models.DateTimeField()
+    hasta = models.DateTimeField()
+    creada_el = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['cliente', '-hasta'], name='particion_cliente_hasta_idx')]
 
 class Plantilla(models.Model):
     nombre = models.CharField(max_length=100)
@@ -336,6 +458,9 @@ class Pago(models.Model):
 # ==========================================
 class Evento(models.Model):
     TIPOS = (('audiencia', 'Audiencia'), ('vencimiento', 'Vencimiento'), ('reunion', 'Reunión'), ('tramite', 'Trámite'), ('personal', 'Personal'))
+    COLORES = {'audiencia': '#ef4444', 'vencimiento': '#f59e0b', 'reunion': '#3b82f6', 'tramite': '#10b981', 'personal': '#6b7280'}
+    # Tope de COUNT en el formulario y de ocurrencias que save() recorre para hallar la última
+    MAX_OCURRENCIAS = 500
     usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE)
     cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, null=True, blank=True, related_name='eventos')
     titulo = models.CharField(max_length=200)
@@ -345,14 +470,80 @@ class Evento(models.Model):
     descripcion = models.TextField(blank=True)
     completado = models.BooleanField(default=False)
 
+    # Recurrencia estilo RRULE (RFC 5545), ej. "FREQ=WEEKLY;COUNT=10". Vacío = evento único.
+    recurrencia = models.CharField(max_length=255, blank=True, default='')
+    # Inicio de la última ocurrencia (None = serie sin fin). Permite filtrar series por rango sin expandirlas.
+    recurrencia_hasta = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['usuario', 'inicio'], name='evento_usuario_inicio_idx'),
+            models.Index(fields=['cliente', 'inicio'], name='evento_cliente_inicio_idx'),
+        ]
+
     @property
     def color_hex(self):
-        colores = {'audiencia': '#ef4444', 'vencimiento': '#f59e0b', 'reunion': '#3b82f6', 'tramite': '#10b981', 'personal': '#6b7280'}
-        return colores.get(self.tipo, '#3b82f6')
+        return self.COLORES.get(self.tipo, '#3b82f6')
+
+    @property
+    def es_recurrente(self):
+        return bool(self.recurrencia)
+
+    def regla(self):
+        from dateutil.rrule import rrulestr
+        return rrulestr(self.recurrencia, dtstart=timezone.localtime(self.inicio))
+
+    def save(self, *args, **kwargs):
+        self.recurrencia_hasta = None
+        if self.recurrencia:
+            # dateutil trabaja sin microsegundos; así las ocurrencias coinciden con sus excepciones
+            self.inicio = self.inicio.replace(microsecond=0)
+            if 'COUNT=' in self.recurrencia or 'UNTIL=' in self.recurrencia:
+                # Una serie más larga que el tope se guarda como sin fin: siempre entra al
+                # filtro por rango y se expande sólo dentro de la ventana pedida
+                ocurrencias = list(islice(self.regla(), self.MAX_OCURRENCIAS + 1))
+                if len(ocurrencias) <= self.MAX_OCURRENCIAS:
+                    self.recurrencia_hasta = ocurrencias[-1] if ocurrencias else None
+        super().save(*args, **kwargs)
+
+class ExcepcionEvento(models.Model):
+    """Ocurrencia de una serie que se movió o se canceló (sin duplicar la serie completa)."""
+    evento = models.ForeignKey(Evento, on_delete=models.CASCADE, related_name='excepciones')
+    fecha_original = models.DateTimeField()
+    cancelada = models.BooleanField(default=False)
+    inicio = models.DateTimeField(null=True, blank=True)
+    fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('evento', 'fecha_original')
+
+# ==========================================
+# 8. DIAGNÓSTICO
+# ==========================================
+class PerfilPeticion(models.Model):
+    """Una petición perfilada a pedido de un admin (ver perfilador.py); los archivos viven en el almacenamiento."""
+    FORMATOS = (('pstats', 'cProfile (pstats)'), ('speedscope', 'Muestreo (speedscope)'))
+    usuario = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True)
+    metodo = models.CharField(max_length=10)
+    ruta = models.CharField(max_length=500)
+    vista = models.CharField(max_length=100, blank=True)
+    status = models.PositiveSmallIntegerField()
+    duracion_ms = models.FloatField()
+    consultas = models.PositiveIntegerField()
+    formato = models.CharField(max_length=20, choices=FORMATOS)
+    perfil = models.FileField(max_length=255)
+    sql = models.FileField(max_length=255)
+    resumen = models.TextField(blank=True)
+    creado_el = models.DateTimeField(auto_now_add=True, db_index=True)
 
 # ==========================================
-# 8. SIGNALS
+# 9. SIGNALS
 # ==========================================
+@receiver(post_save, sender=Usuario)
+def crear_version_agenda(sender, instance, created, **kwargs):
+    if created:
+        VersionAgenda.objects.get_or_create(usuario=instance)
+
 @receiver(post_save, sender=Cliente)
 def crear_carpetas_base(sender, instance, created, **kwargs):
     if created:
@@ -362,4 +553,65 @@ def crear_carpetas_base(sender, instance, created, **kwargs):
                 nombre=nombre,
                 cliente=instance,
                 defaults={'es_expediente': False}
-            )
\ No newline at end of file
+            )
+
+def _subir_version_agenda(usuarios):
+    # La fila nace con el usuario; si faltara no hay nada cacheado con ella y se crea en 0 al leerla
+    VersionAgenda.objects.filter(usuario__in=usuarios.values('id')).update(version=F('version') + 1, modificada=timezone.now())
+
+def invalidar_agenda(usuario_id=None, cliente_id=None):
+    """Sube la versión de agenda de todos los que pueden ver el cambio (dueño, abogados del cliente y admins)."""
+    filtro = Q(rol='admin')
+    if usuario_id:
+        filtro |= Q(id=usuario_id)
+    if cliente_id:
+        filtro |= Q(clientes_asignados=cliente_id)
+    _subir_version_agenda(Usuario.objects.filter(filtro))
+
+@receiver(post_save, sender=Evento)
+@receiver(post_delete, sender=Evento)
+def evento_modificado(sender, instance, **kwargs):
+    invalidar_agenda(usuario_id=instance.usuario_id, cliente_id=instance.cliente_id)
+
+@receiver(post_save, sender=ExcepcionEvento)
+@receiver(post_delete, sender=ExcepcionEvento)
+def excepcion_modificada(sender, instance, **kwargs):
+    evento = Evento.objects.filter(id=instance.evento_id).values('usuario_id', 'cliente_id').first()
+    if evento:
+        invalidar_agenda(**evento)
+
+@receiver(post_save, sender=Tarea)
+@receiver(post_delete, sender=Tarea)
+def tarea_modificada(sender, instance, **kwargs):
+    # Las fechas límite también se publican en el feed ICS
+    invalidar_agenda(cliente_id=instance.cliente_id)
+
+@receiver(post_save, sender=Cliente)
+def cliente_modificado(sender, instance, created, **kwargs):
+    # El nombre de la empresa aparece en el título de sus eventos
+    if not created:
+        invalidar_agenda(cliente_id=instance.id)
+
+@receiver(post_save, sender=Documento)
+def documento_guardado(sender, instance, created, update_fields=None, **kwargs):
+    # Mover de carpeta también guarda el documento; sólo un archivo nuevo necesita miniatura
+    if created or 'archivo' in (update_fields or ()):
+        from .almacenamiento import programar_miniatura
+        programar_miniatura(instance)
+
+@receiver(post_delete, sender=Documento)
+def documento_eliminado(sender, instance, **kwargs):
+    # Cubre también borrados en cascada y por queryset, que antes dejaban el archivo huérfano
+    from .almacenamiento import liberar_archivos
+    liberar_archivos(instance)
+
+@receiver(m2m_changed, sender=Usuario.clientes_asignados.through)
+def asignacion_modificada(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        _subir_version_agenda(Usuario.objects.filter(id=instance.id))
+    elif action == 'pre_clear':
+        _subir_version_agenda(Usuario.objects.filter(clientes_asignados=instance))
+    else:
+        _subir_version_agenda(Usuario.objects.filter(id__in=pk_set))
@@ -0,0 +1,51 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import metricas
+from .diagnostico import medir
+
+# ==========================================
+# 1. RENDER CON WEASYPRINT
+# ==========================================
+
+def _escribir_pdf(html, base_url):
+    # Importación perezosa: los workers que nunca generan PDFs no cargan WeasyPrint
+    import weasyprint
+    return weasyprint.HTML(string=html, base_url=base_url).write_pdf()
+
+def escribir_pdf(html, base_url=None, destino=None):
+    """Renderiza el HTML a PDF; con destino (p. ej. un HttpResponse) escribe ahí, si no devuelve los bytes."""
+    with medir('pdf'), metricas.pdf_segundos.medir():
+        datos = _escribir_pdf(html, base_url)
+    metricas.pdf_bytes.observar(len(datos))
+    if destino is None:
+        return datos
+    destino.write(datos)
+
+# ==========================================
+# 2. PDF FUERA DEL EVENT LOOP
+# ==========================================
+
+# WeasyPrint es CPU puro: con PDF_PROCESOS > 0 se usa un pool de procesos
+# (paralelismo real, más memoria); por defecto, unos pocos hilos dedicados.
+PDF_PROCESOS = getattr(settings, 'PDF_PROCESOS', 0)
+PDF_HILOS = getattr(settings, 'PDF_HILOS', 2)
+
+_pool_pdf = None
+
+def pool_pdf():
+    global _pool_pdf
+    if _pool_pdf is None:
+        _pool_pdf = (ProcessPoolExecutor(PDF_PROCESOS) if PDF_PROCESOS
+                     else ThreadPoolExecutor(PDF_HILOS, thread_name_prefix='pdf'))
+    return _pool_pdf
+
+async def renderizar_pdf(html, base_url=None):
+    """Devuelve los bytes del PDF sin bloquear el loop mientras WeasyPrint trabaja."""
+    loop = asyncio.get_running_loop()
+    with medir('pdf'), metricas.pdf_segundos.medir():
+        datos = await loop.run_in_executor(pool_pdf(), _escribir_pdf, html, base_url)
+    metricas.pdf_bytes.observar(len(datos))
+    return datos
@@ -0,0 +1,302 @@
+import cProfile
+import io
+import json
+import logging
+import marshal
+import pstats
+import selectors
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .diagnostico import Medicion, _medicion
+from .models import PerfilPeticion
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 1. PERFILADORES
+# ==========================================
+
+# Un admin pide el perfil de UNA petición con la cabecera 'X-Perfilar: 1' o '?_perfilar=1';
+# 'muestreo' en lugar de 1 usa el muestreador (menos sobrecarga, salida para speedscope).
+MODOS = ('cprofile', 'muestreo')
+INTERVALO_MUESTREO = getattr(settings, 'PERFILADOR_INTERVALO', 0.001)  # segundos
+PERFILES_MAXIMOS = getattr(settings, 'PERFILADOR_MAXIMOS', 200)  # los más viejos se borran
+MAX_SQL = 5000
+
+
+class PerfiladorCProfile:
+    """Determinista: cada llamada de Python del hilo de la vista. Archivo .prof para pstats/snakeviz."""
+    formato, extension = 'pstats', 'prof'
+
+    def __init__(self):
+        self.perfil = cProfile.Profile()
+
+    def iniciar(self, hilos=()):
+        # Desde 3.12 cProfile usa sys.monitoring (todo el proceso) y lanza ValueError si
+        # otra herramienta ya lo ocupa; antes sólo ve el hilo que lo activa
+        self.perfil.enable()
+
+    def detener(self):
+        self.perfil.disable()
+
+    def archivo(self):
+        # Mismo contenido que Profile.dump_stats(), sin pasar por un archivo temporal
+        self.perfil.create_stats()
+        return marshal.dumps(self.perfil.stats)
+
+    def resumen(self):
+        salida = io.StringIO()
+        pstats.Stats(self.perfil, stream=salida).sort_stats('cumulative').print_stats(40)
+        return salida.getvalue()
+
+
+class PerfiladorMuestreo:
+    """
+    Un hilo toma la pila del hilo de la vista cada INTERVALO_MUESTREO; cada
+    muestra pesa el tiempo real transcurrido desde la anterior. Una vista async
+    corre en el event loop y su sync_to_async en el hilo de la petición: se
+    muestrean los dos y se descarta el que está esperando al otro.
+    """
+    formato, extension = 'speedscope', 'speedscope.json'
+    # Hoja de la pila de un hilo ocioso: el loop en select(), el hilo de la petición
+    # bloqueado en async_to_sync
+    OCIOSOS = (selectors.__file__, threading.__file__)
+
+    def __init__(self):
+        self.objetivos = ()
+        self.pilas = Counter()
+        self._alto = threading.Event()
+        self._hilo = threading.Thread(target=self._muestrear, name='perfilador-muestreo', daemon=True)
+
+    def _muestrear(self):
+        anterior = time.perf_counter()
+        while not self._alto.wait(INTERVALO_MUESTREO):
+            frames = sys._current_frames()
+            ahora = time.perf_counter()
+            for objetivo in self.objetivos:
+                frame = frames.get(objetivo)
+                if frame is None or (len(self.objetivos) > 1 and frame.f_code.co_filename in self.OCIOSOS):
+                    continue
+                pila = []
+                while frame is not None:
+                    codigo = frame.f_code
+                    pila.append((codigo.co_name, codigo.co_filename, codigo.co_firstlineno))
+                    frame = frame.f_back
+                self.pilas[tuple(reversed(pila))] += ahora - anterior
+                break
+            anterior = ahora
+
+    def iniciar(self, hilos=()):
+        self.objetivos = (threading.get_ident(), *hilos)
+        # El muestreador necesita el GIL para tomar cada muestra: con el intervalo de
+        # cambio por defecto (5 ms) el código puro Python casi no se vería. Un solo
+        # perfil a la vez (PerfiladorMiddleware) evita restaurarlo fuera de orden
+        self._intervalo_previo = sys.getswitchinterval()
+        sys.setswitchinterval(INTERVALO_MUESTREO)
+        self._hilo.start()
+
+    def detener(self):
+        self._alto.set()
+        self._hilo.join()
+        sys.setswitchinterval(self._intervalo_previo)
+
+    def archivo(self):
+        # Formato 'sampled' de https://www.speedscope.app/file-format-schema.json
+        frames, indices, muestras, pesos = [], {}, [], []
+        for pila, segundos in self.pilas.items():
+            fila = []
+            for frame in pila:
+                if frame not in indices:
+                    indices[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+                fila.append(indices[frame])
+            muestras.append(fila)
+            pesos.append(segundos)
+        return json.dumps({
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled', 'name': 'AppLegal', 'unit': 'seconds',
+                'startValue': 0, 'endValue': sum(pesos), 'samples': muestras, 'weights': pesos,
+            }],
+            'exporter': 'applegal-perfilador',
+        }).encode('utf-8')
+
+    def resumen(self):
+        total = sum(self.pilas.values())
+        propio = Counter()
+        for pila, segundos in self.pilas.items():
+            propio[pila[-1]] += segundos
+        lineas = [f"{total * 1000:.1f} ms muestreados cada {INTERVALO_MUESTREO * 1000:.1f} ms (tiempo propio por función)", '']
+        for (nombre, archivo, linea), segundos in propio.most_common(40):
+            lineas.append(f"{segundos * 100 / (total or 1):5.1f}%  {segundos * 1000:8.1f} ms  {nombre}  {archivo}:{linea}")
+        return '\n'.join(lineas)
+
+
+PERFILADORES = {'cprofile': PerfiladorCProfile, 'muestreo': PerfiladorMuestreo}
+
+def modo_solicitado(request, usuario):
+    valor = request.headers.get('X-Perfilar') or request.GET.get('_perfilar')
+    if not valor or not usuario.is_authenticated or usuario.rol != 'admin':
+        return None
+    return valor if valor in MODOS else 'cprofile'
+
+# ==========================================
+# 2. ALMACENAMIENTO DE PERFILES
+# ==========================================
+
+def _sql_json(sql):
+    filas = [{'sql': s, 'params': repr(p)[:1000], 'ms': round(t * 1000, 3)} for s, p, t in sql[:MAX_SQL]]
+    return json.dumps(filas, ensure_ascii=False).encode('utf-8')
+
+def guardar_perfil(request, response, perfilador, sql, duracion, usuario):
+    storage = PerfilPeticion._meta.get_field('perfil').storage
+    llave = f"diagnostico/perfiles/{timezone.now():%Y/%m/%d}/{uuid.uuid4().hex}"
+    coincidencia = getattr(request, 'resolver_match', None)
+    perfil = PerfilPeticion.objects.create(
+        usuario=usuario, metodo=request.method, ruta=request.get_full_path()[:500],
+        vista=coincidencia.view_name if coincidencia else '', status=response.status_code,
+        duracion_ms=duracion * 1000, consultas=len(sql), formato=perfilador.formato,
+        perfil=storage.save(f"{llave}.{perfilador.extension}", ContentFile(perfilador.archivo())),
+        sql=storage.save(f"{llave}.sql.json", ContentFile(_sql_json(sql))),
+        resumen=perfilador.resumen(),
+    )
+    _podar(storage)
+    return perfil
+
+def _podar(storage):
+    viejos = list(PerfilPeticion.objects.order_by('-creado_el', '-id').values_list('id', 'perfil', 'sql')[PERFILES_MAXIMOS:])
+    if not viejos:
+        return
+    from .almacenamiento import borrador
+    with transaction.atomic():
+        PerfilPeticion.objects.filter(id__in=[v[0] for v in viejos]).delete()
+        transaction.on_commit(lambda: borrador.encolar(storage, [n for v in viejos for n in v[1:]]))
+
+# ==========================================
+# 3. MIDDLEWARE
+# ==========================================
+
+# Un perfil a la vez por proceso: dos cProfile no conviven en 3.12 y el muestreador
+# cambia el switchinterval de todo el intérprete. Si está ocupado se atiende sin perfilar
+_ocupado = threading.Lock()
+
+
+class PerfiladorMiddleware:
+    """
+    Perfila la petición cuando un admin lo pide y guarda el perfil con el SQL
+    capturado; la respuesta trae la URL del resultado en 'X-Perfil'. Va después
+    de AuthenticationMiddleware: necesita saber quién pide.
+
+    El perfilador se enciende en process_view, que llama él mismo a la vista en
+    el hilo donde corre: bajo ASGI las vistas sync van a un hilo de sync_to_async
+    y un perfil tomado desde el event loop no vería nada de ellas. Por eso ningún
+    middleware con process_view debe ir después de éste. En respuestas en flujo
+    (ZIP, descargas) cubre hasta que la vista devuelve, no el envío del cuerpo.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _preparar(self, request, modo):
+        if not _ocupado.acquire(blocking=False):
+            logger.info("Perfil no tomado para %s: hay otro en curso", request.path)
+            return None
+        medicion = _medicion.get()
+        token = None
+        if medicion is None:
+            # Sin DiagnosticoMiddleware el perfilador instala su propia medición para el SQL
+            medicion = Medicion()
+            token = _medicion.set(medicion)
+        medicion.sql = []
+        request._perfilador = PERFILADORES[modo]()
+        request._perfilado = False
+        return medicion, token
+
+    def _terminar(self, request, medicion, token):
+        _ocupado.release()
+        sql, medicion.sql = medicion.sql, None
+        if token is not None:
+            _medicion.reset(token)
+        del request._perfilador
+        return sql
+
+    def process_view(self, request, vista, args, kwargs):
+        # Sync: bajo ASGI Django la corre con sync_to_async en el mismo hilo que la vista
+        perfilador = getattr(request, '_perfilador', None)
+        if perfilador is None:
+            return None
+        if iscoroutinefunction(vista):
+            # La vista async vuelve al event loop; este hilo queda esperándola y atiende su sync_to_async
+            return async_to_sync(self._perfilar_async)(request, perfilador, vista, args, kwargs, threading.get_ident())
+        try:
+            perfilador.iniciar()
+        except ValueError:
+            logger.warning("Perfil no tomado para %s: otro perfilador está activo", request.path)
+            return None
+        request._perfilado = True
+        try:
+            return vista(request, *args, **kwargs)
+        finally:
+            perfilador.detener()
+
+    async def _perfilar_async(self, request, perfilador, vista, args, kwargs, hilo):
+        try:
+            perfilador.iniciar(hilos=(hilo,))
+        except ValueError:
+            logger.warning("Perfil no tomado para %s: otro perfilador está activo", request.path)
+            return await vista(request, *args, **kwargs)
+        request._perfilado = True
+        try:
+            return await vista(request, *args, **kwargs)
+        finally:
+            perfilador.detener()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        modo = modo_solicitado(request, request.user)
+        preparado = self._preparar(request, modo) if modo else None
+        if not preparado:
+            return self.get_response(request)
+        perfilador, inicio = request._perfilador, time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            sql = self._terminar(request, *preparado)
+        # Sin vista (404 de la URL) o sin perfilador libre no hay perfil que guardar
+        if request._perfilado:
+            perfil = guardar_perfil(request, response, perfilador, sql, time.perf_counter() - inicio, request.user)
+            response['X-Perfil'] = reverse('detalle_perfil', args=[perfil.id])
+        return response
+
+    async def __acall__(self, request):
+        usuario = await request.auser()
+        modo = modo_solicitado(request, usuario)
+        preparado = self._preparar(request, modo) if modo else None
+        if not preparado:
+            return await self.get_response(request)
+        perfilador, inicio = request._perfilador, time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            sql = self._terminar(request, *preparado)
+        if request._perfilado:
+            perfil = await sync_to_async(guardar_perfil)(request, response, perfilador, sql, time.perf_counter() - inicio, usuario)
+            response['X-Perfil'] = reverse('detalle_perfil', args=[perfil.id])
+        return response
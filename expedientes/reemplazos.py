@@ -0,0 +1,145 @@
+import re
+from bisect import bisect_right
+
+from docx.oxml.ns import qn
+from docx.parts.hdrftr import FooterPart, HeaderPart
+
+W_P = qn('w:p')
+W_T = qn('w:t')
+XML_SPACE = qn('xml:space')
+
+
+# ==========================================
+# 1. COMPILACIÓN DE PATRONES
+# ==========================================
+
+def _trie_a_regex(trie):
+    """
+    Convierte un trie {caracter: subtrie, '': True} en una expresión regular
+    factorizada por prefijos. Así el motor de 're' sólo prueba las ramas cuyo
+    primer carácter coincide, en lugar de cientos de alternativas por posición.
+    Se recorre en postorden con una pila: cada carácter de un texto original es
+    un nivel del trie y una cláusula completa pasaba el límite de recursión.
+    """
+    patrones = {}  # id(nodo) -> patrón de su subtrie
+    pila = [(trie, False)]
+    while pila:
+        nodo, listo = pila.pop()
+        if not listo:
+            pila.append((nodo, True))
+            pila.extend((hijo, False) for c, hijo in nodo.items() if c != '')
+            continue
+
+        ramas = [re.escape(c) + patrones.pop(id(hijo)) for c, hijo in sorted(nodo.items()) if c != '']
+        if not ramas:
+            patrones[id(nodo)] = ''
+            continue
+        cuerpo = ramas[0] if len(ramas) == 1 else '(?:' + '|'.join(ramas) + ')'
+        if '' in nodo:
+            # Opcional y codicioso: primero intenta la coincidencia más larga
+            if len(ramas) == 1 and len(cuerpo) > 1:
+                cuerpo = '(?:' + cuerpo + ')'
+            cuerpo += '?'
+        patrones[id(nodo)] = cuerpo
+    return patrones[id(trie)]
+
+def compilar_reemplazos(lista):
+    """
+    Recibe la lista del diseñador [{'texto_original': ..., 'variable': ...}]
+    y devuelve (patron, mapa) donde 'patron' encuentra cualquier texto original
+    en una sola pasada y 'mapa' traduce cada coincidencia a '{{ variable }}'.
+    """
+    mapa = {}
+    for item in lista:
+        original = item.get('texto_original', '')
+        variable = item.get('variable', '')
+        if original and variable and original not in mapa:
+            mapa[original] = "{{ " + variable + " }}"
+
+    if not mapa:
+        return None, mapa
+
+    trie = {}
+    for original in mapa:
+        nodo = trie
+        for c in original:
+            nodo = nodo.setdefault(c, {})
+        nodo[''] = True
+
+    return re.compile(_trie_a_regex(trie)), mapa
+
+# ==========================================
+# 2. RECORRIDO DEL DOCUMENTO
+# ==========================================
+
+def _partes_del_documento(doc):
+    """Cuerpo + encabezados y pies (cada parte XML se visita una sola vez)."""
+    yield doc.element.body
+    for parte in doc.part.package.iter_parts():
+        if isinstance(parte, (HeaderPart, FooterPart)):
+            yield parte.element
+
+def _textos_del_parrafo(p):
+    """Nodos <w:t> que pertenecen directamente al párrafo (no a cuadros de texto anidados)."""
+    textos = []
+    for t in p.iter(W_T):
+        padre = t.getparent()
+        while padre is not None and padre.tag != W_P:
+            padre = padre.getparent()
+        if padre is p:
+            textos.append(t)
+    return textos
+
+def _reemplazar_en_parrafo(p, patron, mapa):
+    textos = _textos_del_parrafo(p)
+    if not textos:
+        return 0
+
+    valores = [t.text or '' for t in textos]
+    completo = ''.join(valores)
+    coincidencias = list(patron.finditer(completo))
+    if not coincidencias:
+        return 0
+
+    # Posición inicial de cada nodo dentro del texto completo del párrafo
+    inicios = []
+    pos = 0
+    for v in valores:
+        inicios.append(pos)
+        pos += len(v)
+
+    # De derecha a izquierda para que los offsets previos sigan siendo válidos
+    for m in reversed(coincidencias):
+        ini, fin = m.span()
+        variable = mapa[m.group(0)]
+        i = bisect_right(inicios, ini) - 1
+        while i < len(textos) and inicios[i] < fin:
+            actual = textos[i].text or ''
+            local_ini = max(ini - inicios[i], 0)
+            local_fin = min(fin - inicios[i], len(valores[i]))
+            # El primer run conserva su formato y recibe la variable completa
+            actual = actual[:local_ini] + variable + actual[local_fin:]
+            variable = ''
+            textos[i].text = actual
+            if actual[:1].isspace() or actual[-1:].isspace():
+                textos[i].set(XML_SPACE, 'preserve')
+            i += 1
+
+    return len(coincidencias)
+
+def aplicar_reemplazos(doc, lista):
+    """
+    Sustituye todos los textos originales por sus variables Jinja en cuerpo,
+    tablas (incluidas anidadas), encabezados y pies de página, recorriendo el
+    documento una sola vez y trabajando a nivel de run para no perder formato.
+    Devuelve el número total de sustituciones.
+    """
+    patron, mapa = compilar_reemplazos(lista)
+    if patron is None:
+        return 0
+
+    total = 0
+    for raiz in _partes_del_documento(doc):
+        for p in raiz.iter(W_P):
+            total += _reemplazar_en_parrafo(p, patron, mapa)
+    return total
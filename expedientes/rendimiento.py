@@ -0,0 +1,301 @@
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from . import memoria
+from .cache import caches_aisladas
+from .diagnostico import percentil
+from .models import (
+    Carpeta, Cliente, Cotizacion, Documento, ItemCotizacion, Plantilla, Servicio, Usuario, VariableEstandar,
+)
+from .sinteticos import Generador
+
+# ==========================================
+# 1. BASE AISLADA
+# ==========================================
+
+@contextmanager
+def base_aislada():
+    """
+    Base de pruebas nueva (la misma que usa manage.py test), MEDIA_ROOT temporal y
+    cachés propias: las mediciones nunca tocan los datos, archivos ni caché reales.
+    """
+    setup_test_environment()
+    media = tempfile.mkdtemp(prefix='applegal_bench_')
+    nombre_original = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(MEDIA_ROOT=media, CACHES=caches_aisladas()):
+            yield
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(media, ignore_errors=True)
+
+# ==========================================
+# 2. DATOS Y ESCENARIOS
+# ==========================================
+
+def _plantilla_docx(clausulas=20):
+    from docx import Document
+    doc = Document()
+    doc.add_heading("CONTRATO DE PRESTACIÓN DE SERVICIOS", 1)
+    doc.add_paragraph("Celebran {{ cliente_empresa }}, representada por {{ cliente_contacto }}, y el despacho, el {{ fecha }}.")
+    for i in range(clausulas):
+        doc.add_paragraph(f"CLÁUSULA {i + 1}. El cliente {{{{ cliente_empresa }}}} se obliga a lo pactado en el anexo {{{{ anexo_{i % 5} }}}}.")
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def preparar(clientes, semilla=1):
+    """Siembra un despacho de 'clientes' clientes y devuelve los ids que usan los escenarios."""
+    Generador(semilla=semilla, usuarios=max(5, clientes // 80), clientes=clientes).generar()
+    admin = Usuario.objects.create_user('benchmark', password='benchmark', rol='admin')
+    VariableEstandar.objects.bulk_create([
+        VariableEstandar(clave='cliente_empresa', descripcion="Razón social", origen='sistema', campo_bd='cliente.nombre_empresa'),
+        VariableEstandar(clave='cliente_contacto', descripcion="Contacto", origen='sistema', campo_bd='cliente.nombre_contacto'),
+        VariableEstandar(clave='fecha', descripcion="Fecha", tipo='fecha', origen='sistema', campo_bd='fecha_actual'),
+    ])
+    plantilla = Plantilla(nombre="Contrato de servicios")
+    plantilla.archivo.save('contrato_benchmark.docx', ContentFile(_plantilla_docx()))
+
+    cliente = Cliente.objects.order_by('nombre_empresa').first()
+    return {
+        'admin': admin,
+        'cliente': cliente.id,
+        'carpeta': Carpeta.objects.get(cliente=cliente, nombre='LICENCIA', padre=None).id,
+        'cotizacion': Cotizacion.objects.order_by('id').values_list('id', flat=True).first(),
+        'plantilla': plantilla.id,
+        'busqueda': cliente.nombre_empresa.split()[2][:4],
+        'hoy': timezone.localdate(),
+    }
+
+# nombre -> función(datos) que devuelve (url, parámetros GET)
+ESCENARIOS = {
+    'dashboard': lambda d: (reverse('dashboard'), {}),
+    'detalle_cliente': lambda d: (reverse('detalle_cliente', args=[d['cliente']]), {}),
+    'panel_finanzas': lambda d: (reverse('panel_finanzas'), {}),
+    'lista_cotizaciones': lambda d: (reverse('lista_cotizaciones'), {}),
+    'api_eventos': lambda d: (reverse('api_eventos'), {
+        'start': (d['hoy'] - timedelta(days=35)).isoformat(), 'end': (d['hoy'] + timedelta(days=7)).isoformat(),
+    }),
+    'buscar_cliente_api': lambda d: (reverse('buscar_cliente_api'), {'q': d['busqueda']}),
+    'generar_pdf_cotizacion': lambda d: (reverse('pdf_cotizacion', args=[d['cotizacion']]), {}),
+    'descargar_carpeta_zip': lambda d: (reverse('descargar_carpeta_zip', args=[d['carpeta']]), {}),
+    'generador_contratos': lambda d: (reverse('generador_contratos', args=[d['cliente']]), {'plantilla_id': d['plantilla']}),
+}
+
+# ==========================================
+# 3. MEDICIÓN
+# ==========================================
+
+def _pedir(cliente, url, params):
+    response = cliente.get(url, params)
+    # Las descargas en flujo sólo trabajan mientras se consumen
+    cuerpo = b''.join(response.streaming_content) if response.streaming else response.content
+    return response.status_code, len(cuerpo)
+
+def medir_escenario(cliente, url, params, repeticiones=20, calentamiento=2):
+    """Latencias (ms), consultas de la última petición y pico de memoria de Python (tracemalloc)."""
+    for _ in range(calentamiento):
+        _pedir(cliente, url, params)
+
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        _pedir(cliente, url, params)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+
+    # Con DEBUG el registro de consultas es un deque acotado: lleno, CaptureQueriesContext cuenta 0
+    reset_queries()
+    with CaptureQueriesContext(connection) as consultas:
+        status, tamano = _pedir(cliente, url, params)
+
+    # tracemalloc aparte: multiplica el tiempo de cada petición y ensuciaría las latencias
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        _pedir(cliente, url, params)
+        pico = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    tiempos.sort()
+    return {
+        'status': status,
+        'bytes': tamano,
+        'p50_ms': percentil(tiempos, 50),
+        'p95_ms': percentil(tiempos, 95),
+        'p99_ms': percentil(tiempos, 99),
+        'media_ms': statistics.fmean(tiempos),
+        'consultas': len(consultas),
+        'pico_memoria_kb': pico / 1024,
+    }
+
+def correr(tamanos, vistas=None, repeticiones=20, semilla=1, al_medir=None):
+    """{tamaño: {vista: medición}}; cada tamaño parte de la base vacía."""
+    resultados = {}
+    with base_aislada():
+        for tamano in tamanos:
+            # flush y no una base nueva por tamaño: la SQLite en memoria sobrevive mientras
+            # algún hilo (los de las vistas async) conserve su conexión
+            call_command('flush', interactive=False, verbosity=0)
+            datos = preparar(tamano, semilla)
+            cliente = Client()
+            cliente.force_login(datos['admin'])
+            resultados[tamano] = {}
+            for nombre in vistas or ESCENARIOS:
+                url, params = ESCENARIOS[nombre](datos)
+                try:
+                    medicion = medir_escenario(cliente, url, params, repeticiones)
+                except Exception as e:
+                    medicion = {'error': f"{type(e).__name__}: {e}"}
+                resultados[tamano][nombre] = medicion
+                if al_medir:
+                    al_medir(tamano, nombre, medicion)
+    return resultados
+
+# ==========================================
+# 4. ESTRÉS DE MEMORIA
+# ==========================================
+
+# Vistas que cargan todo en memoria (WeasyPrint, ZIP, mammoth, docxtpl): cada escenario
+# crece su entrada con n y devuelve una función que arma (método, url, datos) por petición.
+TAMANO_ANEXO = 128 * 1024  # bytes aleatorios: el ZIP no los puede comprimir
+
+
+def _cotizacion(datos, partidas, empresa):
+    servicio = Servicio.objects.order_by('id').first()
+    cot = Cotizacion.objects.create(titulo=f"Estrés {partidas} partidas", prospecto_empresa=empresa,
+                                    prospecto_nombre="Contacto Estrés", prospecto_email="estres@example.com",
+                                    prospecto_telefono="5550000000", creado_por=datos['admin'])
+    ItemCotizacion.objects.bulk_create([
+        ItemCotizacion(cotizacion=cot, servicio=servicio, cantidad=1 + i % 3, precio_unitario=servicio.precio_base,
+                       subtotal=(1 + i % 3) * servicio.precio_base,
+                       descripcion_personalizada=f"Partida {i + 1}: gestión y seguimiento del trámite ante la autoridad. " * 3)
+        for i in range(partidas)
+    ])
+    cot.calcular_totales()
+    return cot
+
+def _anexos(datos, n):
+    cliente = Cliente.objects.get(id=datos['cliente'])
+    carpeta = Carpeta.objects.create(cliente=cliente, nombre=f"Estrés {n} anexos")
+    rng = random.Random(n)
+    ids = []
+    for i in range(n):
+        doc = Documento(cliente=cliente, carpeta=carpeta, nombre_archivo=f"anexo_{i + 1}.pdf", subido_por=datos['admin'])
+        doc.archivo.save(doc.nombre_archivo, ContentFile(rng.randbytes(TAMANO_ANEXO)))
+        ids.append(doc.id)
+    return carpeta, ids
+
+def _estres_pdf(datos, n):
+    cot = _cotizacion(datos, n, "Estrés PDF")
+    return lambda: ('get', reverse('pdf_cotizacion', args=[cot.id]), {})
+
+def _estres_convertir(datos, n):
+    # Cada petición convierte una cotización nueva (y crea su cliente)
+    def peticion():
+        cot = _cotizacion(datos, n, f"Estrés Conversión {Cotizacion.objects.count()}")
+        return 'get', reverse('convertir_cliente', args=[cot.id]), {}
+    return peticion
+
+def _estres_zip(datos, n):
+    carpeta, _ = _anexos(datos, n)
+    return lambda: ('get', reverse('descargar_carpeta_zip', args=[carpeta.id]), {})
+
+def _estres_masivas(datos, n):
+    _, ids = _anexos(datos, n)
+    return lambda: ('post', reverse('acciones_masivas_drive'), {'accion': 'descargar', 'doc_ids': ids})
+
+def _estres_preview(datos, n):
+    doc = Documento(cliente_id=datos['cliente'], nombre_archivo=f"estres_{n}.docx", subido_por=datos['admin'])
+    doc.archivo.save(doc.nombre_archivo, ContentFile(_plantilla_docx(n * 10)))
+    return lambda: ('get', reverse('preview_archivo', args=[doc.id]), {})
+
+def _estres_contratos(datos, n):
+    plantilla = Plantilla(nombre=f"Contrato {n * 10} cláusulas")
+    plantilla.archivo.save(f"estres_{n}.docx", ContentFile(_plantilla_docx(n * 10)))
+    campos = {'plantilla_id': plantilla.id, 'nombre_archivo_salida': f"Estrés {n}"}
+    campos.update({f"anexo_{i}": f"Anexo {i} del contrato" for i in range(5)})
+    return lambda: ('post', reverse('generador_contratos', args=[datos['cliente']]), campos)
+
+# nombre de la vista -> (unidad de n, escenario)
+ESTRES = {
+    'generar_pdf_cotizacion': ("partidas", _estres_pdf),
+    'convertir_a_cliente': ("partidas", _estres_convertir),
+    'descargar_carpeta_zip': (f"anexos de {TAMANO_ANEXO // 1024} KB", _estres_zip),
+    'acciones_masivas_drive': (f"anexos de {TAMANO_ANEXO // 1024} KB", _estres_masivas),
+    'preview_archivo': ("×10 párrafos", _estres_preview),
+    'generador_contratos': ("×10 cláusulas", _estres_contratos),
+}
+
+def _medir_memoria(cliente, vista, peticion):
+    metodo, url, campos = peticion()
+    inicio = time.perf_counter()
+    response = getattr(cliente, metodo)(url, campos, HTTP_REFERER='/')
+    # El ZIP se mide hasta que se consume y se cierra la respuesta; los trozos no se
+    # guardan, o el pico sería el del ZIP completo en la memoria de este comando
+    tamano = sum(len(trozo) for trozo in response.streaming_content) if response.streaming else len(response.content)
+    response.close()
+    medida = memoria.ultima_medida(vista)
+    return {
+        'status': response.status_code,
+        'bytes': tamano,
+        'ms': (time.perf_counter() - inicio) * 1000,
+        'pico_kb': medida['pico_kb'],
+        'retenido_kb': medida['retenido_kb'],
+        'sitios': medida['sitios'][:5],
+    }
+
+def pendiente(puntos):
+    """KB de pico por unidad de n (mínimos cuadrados); crecimiento lineal = la vista lo carga todo en memoria."""
+    if len(puntos) < 2:
+        return 0.0
+    return statistics.linear_regression([n for n, _ in puntos], [kb for _, kb in puntos]).slope
+
+def estresar(tamanos, vistas=None, repeticiones=3, al_medir=None):
+    """{vista: {n: medición}}; por cada n se queda con la repetición de pico mediano."""
+    resultados = {}
+    activa, memoria.MEMORIA_ACTIVA = memoria.MEMORIA_ACTIVA, True
+    try:
+        with base_aislada():
+            datos = preparar(20)
+            cliente = Client()
+            cliente.force_login(datos['admin'])
+            for vista in vistas or ESTRES:
+                _, escenario = ESTRES[vista]
+                resultados[vista] = {}
+                # Calentamiento: la primera petición importa WeasyPrint, mammoth o docxtpl.
+                # Si falla, el error sale en la medición del primer tamaño
+                try:
+                    _medir_memoria(cliente, vista, escenario(datos, min(tamanos)))
+                except Exception:
+                    pass
+                for n in tamanos:
+                    peticion = escenario(datos, n)
+                    try:
+                        medidas = sorted((_medir_memoria(cliente, vista, peticion) for _ in range(repeticiones)),
+                                         key=lambda m: m['pico_kb'])
+                        medicion = medidas[len(medidas) // 2]
+                    except Exception as e:
+                        medicion = {'error': f"{type(e).__name__}: {e}"}
+                    resultados[vista][n] = medicion
+                    if al_medir:
+                        al_medir(vista, n, medicion)
+    finally:
+        memoria.MEMORIA_ACTIVA = activa
+    return resultados
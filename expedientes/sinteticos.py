@@ -0,0 +1,312 @@
+import random
+import time
+import uuid
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .almacenamiento import guardar_blob
+from .cache import subir_version
+from .models import (
+    Bitacora, Blob, Carpeta, Cliente, Cotizacion, CuentaPorCobrar, Documento, Evento,
+    Expediente, ItemCotizacion, Pago, Servicio, Tarea, Usuario,
+)
+
+# ==========================================
+# 1. CATÁLOGOS
+# ==========================================
+
+# Misma estructura que crea la señal crear_carpetas_base (bulk_create no dispara señales)
+CARPETAS_BASE = ['LICENCIA', 'FUNCIONAMIENTO', 'PROTECCIÓN CIVIL', 'Cotizaciones']
+SUBCARPETAS = ['Oficios', 'Pagos de derechos']
+
+# Nombres de requisitos: los documentos así nombrados cuentan en el semáforo de cumplimiento
+REQUISITOS = [
+    'CONSTANCIA DE SITUACIÓN FISCAL', 'ACTA CONSTITUTIVA', 'PODER NOTARIAL',
+    'INE DEL REPRESENTANTE LEGAL', 'CONTRATO DE ARRENDAMIENTO', 'LICENCIA DE USO DE SUELO',
+    'VISTO BUENO Y PAGO DE DERECHOS 2025', 'RESPONSIVA Y DICTAMEN DE EXTINTORES',
+    'DICTAMEN ESTRUCTURAL', 'DICTAMEN DE GAS', 'RECIBO DE PAGO PREDIAL Y AGUA', 'DICTAMEN DE GIRO',
+]
+OTROS_DOCUMENTOS = ['Oficio de prevención', 'Acuse de ingreso', 'Comprobante de pago', 'Fotografías del inmueble', 'Plano arquitectónico', 'Minuta de reunión']
+
+GIROS = ['Restaurante', 'Farmacia', 'Gimnasio', 'Hotel', 'Clínica', 'Escuela', 'Bodega', 'Gasolinera', 'Cafetería', 'Taller', 'Oficinas', 'Tienda']
+APELLIDOS = ['García', 'Hernández', 'López', 'Martínez', 'González', 'Pérez', 'Rodríguez', 'Sánchez', 'Ramírez', 'Cruz', 'Flores', 'Morales']
+NOMBRES = ['Ana', 'Luis', 'María', 'Jorge', 'Sofía', 'Carlos', 'Lucía', 'Miguel', 'Elena', 'Ricardo', 'Paola', 'Andrés']
+SOCIEDADES = ['S.A. de C.V.', 'S. de R.L. de C.V.', 'S.A.P.I. de C.V.', 'S.C.']
+
+SERVICIOS = [
+    ('Licencia de funcionamiento', '8500.00'), ('Dictamen de protección civil', '12000.00'),
+    ('Uso de suelo', '6500.00'), ('Aviso COFEPRIS', '4200.00'), ('Visto bueno ambiental', '9800.00'),
+    ('Asesoría mensual', '3500.00'), ('Gestoría de trámite', '2500.00'), ('Programa interno de PC', '15000.00'),
+]
+
+ACCIONES = [
+    ('SUBIDA', "Subió {doc}"), ('DESCARGA', "Descargó {doc}"), ('EDICION', "Editó datos del cliente"),
+    ('MOVIMIENTO', "Movió {doc} a {carpeta}"), ('ELIMINACION', "Eliminó {doc}"), ('CONTRATO', "Generó contrato de servicios"),
+]
+TAREAS = ['Ingresar solicitud', 'Dar seguimiento a oficio', 'Solicitar documentación', 'Pagar derechos', 'Agendar inspección', 'Revisar dictamen']
+TIPOS_EVENTO = ['audiencia', 'vencimiento', 'reunion', 'tramite', 'personal']
+METODOS_PAGO = ['transferencia', 'efectivo', 'tarjeta', 'cheque']
+ARCHIVOS_MUESTRA = 8
+
+CENTAVO = Decimal('0.01')
+
+# ==========================================
+# 2. GENERADOR
+# ==========================================
+
+class Generador:
+    """
+    Despacho ficticio completo a partir de una semilla: con la misma semilla,
+    escala y fecha de referencia produce exactamente las mismas filas.
+    Todo se inserta con bulk_create por lotes, sin pasar por save() ni señales;
+    los campos que calculan save() y las señales se calculan aquí, y al final se
+    sube la versión de caché de cada modelo insertado.
+    """
+    def __init__(self, semilla=1, usuarios=25, clientes=2000, documentos=12, bitacora=40, anios=3,
+                 eventos=120, prefijo='demo', referencia=None, lote=2000):
+        # El prefijo entra en la semilla: dos despachos en la misma base no repiten UUIDs
+        self.rng = random.Random(f"{prefijo}:{semilla}")
+        self.semilla, self.prefijo, self.lote = semilla, prefijo, lote
+        self.n_usuarios, self.n_clientes, self.n_documentos = usuarios, clientes, documentos
+        self.n_bitacora, self.anios, self.n_eventos = bitacora, anios, eventos
+        hoy = referencia or timezone.localdate()
+        self.referencia = timezone.make_aware(datetime.combine(hoy, dt_time(9)))
+        self.conteos = {}
+        self.insertados = set()
+
+    def _uuid(self):
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def _fecha(self, dias_min, dias_max):
+        segundos = self.rng.randint(dias_min * 86400, dias_max * 86400)
+        return self.referencia + timedelta(seconds=segundos)
+
+    def _insertar(self, modelo, objetos):
+        creados = modelo.objects.bulk_create(objetos, batch_size=self.lote)
+        self.insertados.add(modelo)
+        self.conteos[modelo.__name__] = self.conteos.get(modelo.__name__, 0) + len(creados)
+        return creados
+
+    def generar(self):
+        inicio = time.perf_counter()
+        with transaction.atomic():
+            usuarios = self._usuarios()
+            clientes = self._clientes(usuarios)
+            carpetas = self._carpetas(clientes)
+            self._documentos(clientes, carpetas, usuarios)
+            self._bitacora(clientes, usuarios)
+            self._cotizaciones(clientes, usuarios)
+            self._agenda(clientes, usuarios)
+            # Sin señales no se invalidan cachear_consulta/cachear_fragmento (ej. buscar_cliente_api)
+            for modelo in self.insertados:
+                subir_version(modelo)
+        return self.conteos, time.perf_counter() - inicio
+
+    def _usuarios(self):
+        # Un solo hash para todos: PBKDF2 por usuario tardaría más que el resto de la carga
+        clave = make_password(self.prefijo, salt=f"sintetico{self.semilla}")
+        usuarios = []
+        for i in range(self.n_usuarios):
+            senior = i % 4 == 0
+            usuarios.append(Usuario(
+                id=self._uuid(), token_calendario=self._uuid(), password=clave,
+                username=f"{self.prefijo}_abogado{i:03d}", email=f"{self.prefijo}.abogado{i:03d}@example.com",
+                first_name=self.rng.choice(NOMBRES), last_name=self.rng.choice(APELLIDOS),
+                rol='analista_sr' if senior else 'analista_jr',
+                can_create_client=senior, can_edit_client=True, can_upload_files=True,
+                access_cotizaciones=senior, access_finanzas=senior, access_contratos=True, access_agenda=True,
+            ))
+        return self._insertar(Usuario, usuarios)
+
+    def _clientes(self, usuarios):
+        clientes = []
+        for i in range(self.n_clientes):
+            contacto = f"{self.rng.choice(NOMBRES)} {self.rng.choice(APELLIDOS)}"
+            clientes.append(Cliente(
+                id=self._uuid(),
+                nombre_empresa=f"{self.prefijo.upper()} {self.rng.choice(GIROS)} {self.rng.choice(APELLIDOS)} {i:05d} {self.rng.choice(SOCIEDADES)}",
+                nombre_contacto=contacto, telefono=f"55{self.rng.randint(10000000, 99999999)}",
+                email=f"contacto{i:05d}@{self.prefijo}.example.com",
+                datos_extra={'rfc': f"{self.prefijo[:3].upper()}{i:06d}XX0", 'giro': self.rng.choice(GIROS)},
+            ))
+        clientes = self._insertar(Cliente, clientes)
+
+        Asignacion = Usuario.clientes_asignados.through
+        if usuarios:
+            self._insertar(Asignacion, [
+                Asignacion(usuario_id=u.id, cliente_id=c.id)
+                for c in clientes for u in self.rng.sample(usuarios, min(len(usuarios), self.rng.randint(1, 3)))
+            ])
+        return clientes
+
+    def _carpetas(self, clientes):
+        """Devuelve {cliente_id: [carpetas donde caen documentos]}."""
+        base = self._insertar(Carpeta, [Carpeta(nombre=n, cliente_id=c.id) for c in clientes for n in CARPETAS_BASE])
+        hijas = [Carpeta(nombre=n, cliente_id=p.cliente_id, padre_id=p.id) for p in base if p.nombre != 'Cotizaciones' for n in SUBCARPETAS]
+
+        # Uno de cada tres clientes tiene un expediente abierto con su carpeta propia
+        con_expediente = [c for c in clientes if self.rng.random() < 0.33]
+        expedientes = [(c, f"{self.prefijo.upper()}-{self.rng.randint(1, 999):03d}/{self.referencia.year - self.rng.randint(0, self.anios)}-{i}") for i, c in enumerate(con_expediente)]
+        hijas += [Carpeta(nombre=f"EXP {num}: Juicio de nulidad", cliente_id=c.id, es_expediente=True) for c, num in expedientes]
+        hijas = self._insertar(Carpeta, hijas)
+        carpeta_exp = {c.cliente_id: c for c in hijas if c.es_expediente}
+        self._insertar(Expediente, [
+            Expediente(cliente_id=c.id, num_expediente=num, titulo="Juicio de nulidad", carpeta=carpeta_exp[c.id],
+                       estado=self.rng.choice(['abierto', 'abierto', 'pausado', 'finalizado']), prioridad=self.rng.randint(1, 3))
+            for c, num in expedientes
+        ])
+
+        destinos = {}
+        for c in base + hijas:
+            if c.nombre != 'Cotizaciones':
+                destinos.setdefault(c.cliente_id, []).append(c)
+        return destinos
+
+    def _blobs(self):
+        """Unos pocos archivos reales y pequeños que comparten todos los documentos (deduplicados)."""
+        storage = Documento._meta.get_field('archivo').storage
+        return [
+            guardar_blob(storage, f"muestra_{i}.txt", ContentFile(f"Documento de muestra {i} ({self.prefijo}, semilla {self.semilla})\n".encode()))
+            for i in range(ARCHIVOS_MUESTRA)
+        ]
+
+    def _documentos(self, clientes, carpetas, usuarios):
+        if not self.n_documentos:
+            return
+        blobs = self._blobs()
+        documentos, referencias = [], {b.id: 0 for b in blobs}
+        for c in clientes:
+            destinos = carpetas[c.id]
+            # Los requisitos van a la carpeta del trámite (ahí los busca el semáforo); lo demás, a cualquiera
+            tramites = [d for d in destinos if d.padre_id is None and not d.es_expediente]
+            for nombre in self.rng.sample(REQUISITOS + OTROS_DOCUMENTOS, min(self.n_documentos, len(REQUISITOS) + len(OTROS_DOCUMENTOS))):
+                blob = self.rng.choice(blobs)
+                referencias[blob.id] += 1
+                documentos.append(Documento(
+                    cliente_id=c.id, carpeta=self.rng.choice(tramites if nombre in REQUISITOS else destinos), blob=blob, archivo=blob.archivo.name,
+                    nombre_archivo=nombre, subido_por=self.rng.choice(usuarios) if usuarios else None,
+                ))
+        self._insertar(Documento, documentos)
+        # guardar_blob ya sumó una referencia por blob
+        for blob_id, n in referencias.items():
+            Blob.objects.filter(id=blob_id).update(referencias=F('referencias') + n - 1)
+
+    def _bitacora(self, clientes, usuarios):
+        dias = self.anios * 365
+        entradas = []
+        for c in clientes:
+            for _ in range(self.n_bitacora):
+                accion, plantilla = self.rng.choice(ACCIONES)
+                entradas.append(Bitacora(
+                    usuario=self.rng.choice(usuarios) if usuarios else None, cliente_id=c.id, accion=accion,
+                    descripcion=plantilla.format(doc=self.rng.choice(REQUISITOS), carpeta=self.rng.choice(CARPETAS_BASE)),
+                    fecha=self._fecha(-dias, 0),
+                ))
+            if len(entradas) >= self.lote * 10:
+                self._insertar(Bitacora, entradas)
+                entradas = []
+        self._insertar(Bitacora, entradas)
+
+    def _servicios(self):
+        return [Servicio.objects.get_or_create(nombre=nombre, defaults={'precio_base': Decimal(precio)})[0] for nombre, precio in SERVICIOS]
+
+    def _cotizaciones(self, clientes, usuarios):
+        servicios = self._servicios()
+        cotizaciones, partidas = [], []
+        for c in clientes:
+            for _ in range(self.rng.randint(0, 3)):
+                estado = self.rng.choice(['borrador', 'enviada', 'aceptada', 'aceptada', 'rechazada'])
+                items = []
+                for servicio in self.rng.sample(servicios, self.rng.randint(1, 4)):
+                    cantidad = self.rng.randint(1, 3)
+                    items.append(ItemCotizacion(servicio=servicio, cantidad=cantidad, precio_unitario=servicio.precio_base,
+                                                subtotal=servicio.precio_base * cantidad))
+                cotizacion = Cotizacion(
+                    folio=self._uuid(), titulo=f"Regularización {self.referencia.year}",
+                    prospecto_empresa=c.nombre_empresa, prospecto_nombre=c.nombre_contacto, prospecto_email=c.email,
+                    porcentaje_descuento=Decimal(self.rng.choice([0, 0, 5, 10])), porcentaje_iva=Decimal('16.00'), aplica_iva=self.rng.random() < 0.7,
+                    creado_por=self.rng.choice(usuarios) if usuarios else None, estado=estado,
+                    validez_hasta=self._fecha(-90, 30).date(), cliente_convertido=c if estado == 'aceptada' else None,
+                )
+                self._totales(cotizacion, items)
+                cotizaciones.append(cotizacion)
+                partidas.append(items)
+        cotizaciones = self._insertar(Cotizacion, cotizaciones)
+        for cotizacion, items in zip(cotizaciones, partidas):
+            for item in items:
+                item.cotizacion = cotizacion
+        self._insertar(ItemCotizacion, [item for items in partidas for item in items])
+        self._cobranza([c for c in cotizaciones if c.estado == 'aceptada'], usuarios)
+
+    @staticmethod
+    def _totales(cotizacion, items):
+        """Mismo cálculo que Cotizacion.calcular_totales, sin ir a la base."""
+        cotizacion.subtotal = sum((i.subtotal for i in items), Decimal('0.00'))
+        cotizacion.descuento = (cotizacion.subtotal * cotizacion.porcentaje_descuento / 100).quantize(CENTAVO)
+        base = cotizacion.subtotal - cotizacion.descuento
+        cotizacion.monto_iva = (base * cotizacion.porcentaje_iva / 100).quantize(CENTAVO) if cotizacion.aplica_iva else Decimal('0.00')
+        cotizacion.total = base
+        cotizacion.total_con_iva = base + cotizacion.monto_iva
+
+    def _cobranza(self, aceptadas, usuarios):
+        cuentas, abonos = [], []
+        for cotizacion in aceptadas:
+            total = cotizacion.total_con_iva
+            # Entre cero y tres abonos; el último puede liquidar la cuenta
+            montos, restante = [], total
+            for _ in range(self.rng.randint(0, 3)):
+                monto = min(restante, (total * Decimal(self.rng.choice([25, 30, 40, 50])) / 100).quantize(CENTAVO))
+                if monto <= 0:
+                    break
+                montos.append(monto)
+                restante -= monto
+            pagado = total - restante
+            cuentas.append(CuentaPorCobrar(
+                cliente_id=cotizacion.cliente_convertido_id, cotizacion=cotizacion,
+                concepto=f"Cotización {str(cotizacion.folio)[:8]}", monto_total=total, monto_pagado=pagado,
+                saldo_pendiente=restante, fecha_vencimiento=self._fecha(-120, 60).date(),
+                estado='pagado' if restante <= 0 else ('parcial' if pagado > 0 else 'pendiente'),
+            ))
+            abonos.append(montos)
+        cuentas = self._insertar(CuentaPorCobrar, cuentas)
+        self._insertar(Pago, [
+            Pago(cuenta=cuenta, monto=monto, fecha_pago=self._fecha(-180, 0).date(), metodo=self.rng.choice(METODOS_PAGO),
+                 referencia=f"REF{self.rng.randint(100000, 999999)}", registrado_por=self.rng.choice(usuarios) if usuarios else None)
+            for cuenta, montos in zip(cuentas, abonos) for monto in montos
+        ])
+
+    def _agenda(self, clientes, usuarios):
+        tareas = [
+            Tarea(cliente_id=c.id, titulo=self.rng.choice(TAREAS), fecha_limite=self._fecha(-60, 90).date(),
+                  completada=self.rng.random() < 0.4, prioridad=self.rng.choice(['baja', 'media', 'alta']))
+            for c in clientes for _ in range(self.rng.randint(0, 4))
+        ]
+        self._insertar(Tarea, tareas)
+
+        eventos = []
+        for u in usuarios:
+            for _ in range(self.n_eventos):
+                inicio = self._fecha(-180, 180).replace(minute=0, second=0, microsecond=0)
+                evento = Evento(
+                    usuario=u, cliente_id=self.rng.choice(clientes).id if clientes and self.rng.random() < 0.8 else None,
+                    titulo=self.rng.choice(TAREAS), inicio=inicio, fin=inicio + timedelta(hours=1),
+                    tipo=self.rng.choice(TIPOS_EVENTO), completado=inicio < self.referencia and self.rng.random() < 0.7,
+                )
+                if self.rng.random() < 0.05:
+                    # Serie semanal finita; recurrencia_hasta como lo calcula Evento.save()
+                    evento.recurrencia = f"FREQ=WEEKLY;COUNT={self.rng.randint(4, 12)}"
+                    for ultima in evento.regla():
+                        evento.recurrencia_hasta = ultima
+                eventos.append(evento)
+        self._insertar(Evento, eventos)
+
+
+def generar_despacho(**opciones):
+    """Atajo: genera el despacho y devuelve ({modelo: filas}, segundos)."""
+    return Generador(**opciones).generar()
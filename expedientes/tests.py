@@ -1,3 +1,604 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, connection
+from django.db.models.signals import post_delete
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import almacenamiento, auditoria, calendario, reemplazos
+from .cache import cachear_consulta, caches_aisladas, versionar, versiones
+from .models import (
+    Bitacora, Blob, Carpeta, Cliente, Documento, Evento, ExcepcionEvento, ParticionBitacora, SubidaFragmentada, Usuario,
+)
+from .sinteticos import Generador
+
+# Tope de consultas por vista; además, el número debe ser el mismo con pocos y con muchos datos
+PRESUPUESTO = {
+    'dashboard': 11,
+    'detalle_cliente': 14,
+    'detalle_carpeta': 15,
+    'panel_finanzas': 7,
+    'lista_cotizaciones': 6,
+    'agenda_legal': 7,
+    'api_eventos': 5,  # sesión, usuario, VersionAgenda, eventos, excepciones
+}
+
+
+class MediaTemporalTestCase(TestCase):
+    """MEDIA_ROOT propio de la clase: se crea al empezar y se borra al terminar (importar el módulo no toca el disco)."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media = tempfile.mkdtemp(prefix='applegal_pruebas_')
+        cls.addClassCleanup(shutil.rmtree, cls.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=cls.media)
+        ajustes.enable()
+        cls.addClassCleanup(ajustes.disable)
+        super().setUpClass()
+
+
+@override_settings(CACHES=caches_aisladas())
+class ConsultasConstantesTests(MediaTemporalTestCase):
+    """
+    Siembra un despacho chico, mide, lo hace crecer y vuelve a medir. Un N+1
+    (una consulta por fila en la vista, la plantilla o el context processor)
+    cambia el conteo entre ambas medidas y hace fallar la prueba.
+    """
+
+    def setUp(self):
+        self.admin = Usuario.objects.create_user('admin_pruebas', password='x', rol='admin')
+        self.client.force_login(self.admin)
+
+    def sembrar(self, prefijo, clientes, documentos, eventos):
+        Generador(semilla=7, usuarios=3, clientes=clientes, documentos=documentos, bitacora=10,
+                  eventos=eventos, prefijo=prefijo).generar()
+        # bulk_create no pasa por las señales que invalidan la caché de la agenda
+        cache.clear()
+        return Cliente.objects.filter(nombre_empresa__startswith=prefijo.upper()).order_by('nombre_empresa').first()
+
+    def consultas(self, url, params=None):
+        with CaptureQueriesContext(connection) as capturadas:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200, url)
+        return len(capturadas)
+
+    def assertConstante(self, nombre, url_chico, url_grande, params=None):
+        chico = self.consultas(url_chico, params)
+        self.sembrar_grande()
+        grande = self.consultas(url_grande(), params)
+        self.assertEqual(chico, grande, f"{nombre}: {chico} consultas con pocos datos, {grande} con muchos")
+        self.assertLessEqual(grande, PRESUPUESTO[nombre], f"{nombre} excede su presupuesto")
+
+    def sembrar_chico(self):
+        self.chico = self.sembrar('chico', clientes=4, documentos=3, eventos=30)
+
+    def sembrar_grande(self):
+        self.grande = self.sembrar('grande', clientes=25, documentos=18, eventos=40)
+
+    def test_dashboard(self):
+        self.sembrar_chico()
+        self.assertConstante('dashboard', reverse('dashboard'), lambda: reverse('dashboard'))
+
+    def test_dashboard_abogado(self):
+        # Otra rama: mis_clientes son los asignados y el context processor filtra por ellos
+        self.sembrar_chico()
+        abogado = Usuario.objects.filter(username__startswith='chico_').first()
+        self.client.force_login(abogado)
+        chico = self.consultas(reverse('dashboard'))
+        self.sembrar_grande()
+        abogado.clientes_asignados.add(*Cliente.objects.filter(nombre_empresa__startswith='GRANDE'))
+        grande = self.consultas(reverse('dashboard'))
+        self.assertEqual(chico, grande)
+        self.assertLessEqual(grande, PRESUPUESTO['dashboard'], "dashboard (abogado) excede su presupuesto")
+
+    def test_detalle_cliente(self):
+        self.sembrar_chico()
+        self.assertConstante('detalle_cliente', reverse('detalle_cliente', args=[self.chico.id]),
+                             lambda: reverse('detalle_cliente', args=[self.grande.id]))
+
+    def test_detalle_carpeta(self):
+        self.sembrar_chico()
+
+        def url(cliente):
+            carpeta = Carpeta.objects.get(cliente=cliente, nombre='LICENCIA')
+            return reverse('detalle_carpeta', args=[cliente.id, carpeta.id])
+        self.assertConstante('detalle_carpeta', url(self.chico), lambda: url(self.grande))
+
+    def test_panel_finanzas(self):
+        self.sembrar_chico()
+        self.assertConstante('panel_finanzas', reverse('panel_finanzas'), lambda: reverse('panel_finanzas'))
+
+    def test_lista_cotizaciones(self):
+        self.sembrar_chico()
+        self.assertConstante('lista_cotizaciones', reverse('lista_cotizaciones'), lambda: reverse('lista_cotizaciones'))
+
+    def test_agenda_legal(self):
+        self.sembrar_chico()
+        self.assertConstante('agenda_legal', reverse('agenda_legal'), lambda: reverse('agenda_legal'))
+
+    def test_api_eventos(self):
+        self.sembrar_chico()
+        hoy = timezone.localdate()
+        rango = {'start': (hoy - timedelta(days=35)).isoformat(), 'end': (hoy + timedelta(days=35)).isoformat()}
+        self.assertConstante('api_eventos', reverse('api_eventos'), lambda: reverse('api_eventos'), rango)
+
+
+class ReferenciasBlobTests(MediaTemporalTestCase):
+    """Conteo de referencias de la deduplicación (almacenamiento.guardar_blob / liberar_filas)."""
+
+    def setUp(self):
+        self.cliente = Cliente.objects.create(nombre_empresa='Blobs SA', nombre_contacto='Ana', email='ana@blobs.mx')
+
+    def subir(self, contenido, nombre='acta.pdf'):
+        doc = Documento(cliente=self.cliente, nombre_archivo=nombre)
+        doc.archivo.save(nombre, ContentFile(contenido))
+        return doc
+
+    def archivos_blob(self):
+        raiz = os.path.join(self.media, 'drive_legal', 'blobs')
+        return {n for _, _, nombres in os.walk(raiz) for n in nombres}
+
+    def test_mismo_contenido_suma_referencia(self):
+        antes = self.archivos_blob()
+        a, b = self.subir(b'contenido'), self.subir(b'contenido', 'copia.pdf')
+        self.assertEqual(a.blob_id, b.blob_id)
+        self.assertEqual(a.archivo.name, b.archivo.name)
+        self.assertEqual(Blob.objects.get().referencias, 2)
+        self.assertEqual(len(self.archivos_blob() - antes), 1)
+
+    def test_create_con_archivo_suma_referencia(self):
+        self.subir(b'contenido')
+        doc = Documento.objects.create(cliente=self.cliente, nombre_archivo='otro.pdf', archivo=ContentFile(b'contenido', name='otro.pdf'))
+        self.assertEqual(doc.blob.referencias, 2)
+
+    def test_liberar_hasta_cero(self):
+        a, b = self.subir(b'contenido'), self.subir(b'contenido')
+        nombre = a.archivo.name
+        with mock.patch.object(almacenamiento.borrador, 'encolar') as encolar, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(almacenamiento.eliminar_documentos(Documento.objects.filter(id=a.id)), 1)
+        self.assertEqual(Blob.objects.get().referencias, 1)
+        encolar.assert_not_called()
+
+        with mock.patch.object(almacenamiento.borrador, 'encolar') as encolar, self.captureOnCommitCallbacks(execute=True):
+            almacenamiento.eliminar_documentos(Documento.objects.filter(id=b.id))
+        self.assertFalse(Blob.objects.exists())
+        encolar.assert_called_once()
+        self.assertIn(nombre, encolar.call_args.args[1])
+
+    def test_eliminar_en_bloque_emite_senales_y_libera_una_vez(self):
+        docs = [self.subir(b'contenido', f"copia_{i}.pdf") for i in range(3)]
+        borrados = []
+
+        def receptor(sender, instance, **kwargs):
+            borrados.append(instance.pk)
+        post_delete.connect(receptor, sender=Documento)
+        self.addCleanup(post_delete.disconnect, receptor, sender=Documento)
+        almacenamiento.eliminar_documentos(Documento.objects.filter(id__in=[d.id for d in docs[:2]]))
+        self.assertCountEqual(borrados, [d.id for d in docs[:2]])
+        self.assertEqual(Blob.objects.get().referencias, 1)
+
+    def test_insert_fallido_no_deja_referencia(self):
+        self.subir(b'contenido')
+        for contenido in (b'contenido', b'nuevo'):
+            doc = Documento(cliente_id=None, nombre_archivo='falla.pdf')
+            with self.assertRaises(IntegrityError):
+                doc.archivo.save('falla.pdf', ContentFile(contenido))
+        self.assertEqual(Blob.objects.get().referencias, 1)
+
+    def test_subida_simultanea_del_mismo_contenido(self):
+        # El otro proceso crea el Blob entre nuestro UPDATE (que no encontró nada) y nuestro INSERT
+        original, llamadas = almacenamiento._sumar_referencia, []
+
+        def sumar_tarde(sha256):
+            llamadas.append(sha256)
+            return None if len(llamadas) == 1 else original(sha256)
+
+        antes = self.archivos_blob()
+        self.subir(b'contenido')
+        with mock.patch.object(almacenamiento, '_sumar_referencia', sumar_tarde):
+            doc = self.subir(b'contenido', 'carrera.pdf')
+        self.assertEqual(len(llamadas), 2)
+        self.assertEqual(doc.blob.referencias, 2)
+        # La copia que subió el perdedor se borra en el acto
+        self.assertEqual(len(self.archivos_blob() - antes), 1)
+
+
+class SubidaFragmentadaTests(MediaTemporalTestCase):
+    """Protocolo por fragmentos: verificación por fragmento, reanudación y armado final."""
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user('subidas', password='x')
+        self.cliente = Cliente.objects.create(nombre_empresa='Subidas SA', nombre_contacto='Ana', email='ana@subidas.mx')
+        self.dir_fragmentos = tempfile.mkdtemp(prefix='applegal_fragmentos_')
+        self.addCleanup(shutil.rmtree, self.dir_fragmentos, ignore_errors=True)
+        for nombre, valor in (('DIR_FRAGMENTOS', self.dir_fragmentos), ('TAMANO_FRAGMENTO', 4)):
+            parche = mock.patch.object(almacenamiento, nombre, valor)
+            parche.start()
+            self.addCleanup(parche.stop)
+        self.contenido = b'0123456789'  # 3 fragmentos: 4 + 4 + 2
+
+    def iniciar(self):
+        return almacenamiento.iniciar_subida(self.usuario, self.cliente, None, 'escritura.pdf', len(self.contenido), huella='escritura-10-1700000000')
+
+    def enviar(self, subida, n, datos=None, sha256=None):
+        datos = self.contenido[n * 4:(n + 1) * 4] if datos is None else datos
+        sha256 = hashlib.sha256(datos).hexdigest() if sha256 is None else sha256
+        return almacenamiento.guardar_fragmento(subida, n, BytesIO(datos), len(datos), sha256)
+
+    def test_reanudar_devuelve_la_misma_subida_y_sus_fragmentos(self):
+        subida = self.iniciar()
+        self.assertEqual(subida.total_fragmentos, 3)
+        self.enviar(subida, 0)
+        self.enviar(subida, 2)
+        reanudada = self.iniciar()
+        self.assertEqual(reanudada.id, subida.id)
+        self.assertEqual(almacenamiento.fragmentos_recibidos(reanudada), [0, 2])
+
+    def test_fragmento_invalido_no_cuenta_como_recibido(self):
+        subida = self.iniciar()
+        with self.assertRaises(almacenamiento.ErrorSubida):
+            self.enviar(subida, 0, sha256=hashlib.sha256(b'otro').hexdigest())
+        with self.assertRaises(almacenamiento.ErrorSubida):
+            self.enviar(subida, 1, datos=b'012')
+        with self.assertRaises(almacenamiento.ErrorSubida):
+            self.enviar(subida, 3, datos=b'')
+        self.assertEqual(almacenamiento.fragmentos_recibidos(subida), [])
+        # Ni el fragmento ni su temporal quedan en disco
+        self.assertEqual(os.listdir(almacenamiento._dir_subida(subida)), [])
+
+    def test_reenviar_un_fragmento_lo_reemplaza(self):
+        subida = self.iniciar()
+        self.enviar(subida, 0, datos=b'xxxx')
+        self.enviar(subida, 0)
+        self.assertEqual(almacenamiento.fragmentos_recibidos(subida), [0])
+
+    def test_finalizar(self):
+        subida = self.iniciar()
+        self.enviar(subida, 0)
+        with self.assertRaises(almacenamiento.ErrorSubida) as error:
+            almacenamiento.finalizar_subida(subida, self.usuario)
+        self.assertEqual(error.exception.status, 409)
+
+        self.enviar(subida, 1)
+        self.enviar(subida, 2)
+        doc = almacenamiento.finalizar_subida(subida, self.usuario)
+        with doc.archivo.open('rb') as f:
+            self.assertEqual(f.read(), self.contenido)
+        self.assertFalse(SubidaFragmentada.objects.filter(id=subida.id).exists())
+        self.assertFalse(os.path.exists(almacenamiento._dir_subida(subida)))
+
+
+class HistorialBitacoraTests(MediaTemporalTestCase):
+    """Paginación por llave (fecha, id) que sigue sin saltos ni repetidos de las filas vivas al archivo."""
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user('historial', password='x')
+        self.cliente = Cliente.objects.create(nombre_empresa='Historial SA', nombre_contacto='Ana', email='ana@historial.mx')
+        ahora = timezone.now().replace(microsecond=0)
+        # Pares con la misma fecha: el id desempata; la mitad queda fuera de la retención
+        fechas = [ahora - timedelta(days=d) for d in (1, 1, 5, 40, 40, 41, 70, 70, 100)]
+        Bitacora.objects.bulk_create([
+            Bitacora(usuario=self.usuario, cliente=self.cliente, accion='edicion', descripcion=f"cambio {i}", fecha=f)
+            for i, f in enumerate(fechas)
+        ])
+        self.esperado = list(Bitacora.objects.order_by('-fecha', '-id').values_list('id', flat=True))
+
+    def recorrer(self, limite):
+        ids, cursor = [], None
+        while True:
+            filas, cursor = auditoria.historial_cliente(self.cliente.id, antes=cursor, limite=limite)
+            ids += [f.id for f in filas]
+            if cursor is None:
+                return ids
+
+    def test_archivar(self):
+        self.assertEqual(auditoria.archivar_bitacora(dias=30, dry_run=True), (6, 0))
+        filas, particiones = auditoria.archivar_bitacora(dias=30, lote=4)
+        self.assertEqual(filas, 6)
+        self.assertEqual(Bitacora.objects.count(), 3)
+        self.assertEqual(ParticionBitacora.objects.count(), particiones)
+        self.assertEqual(sum(ParticionBitacora.objects.values_list('filas', flat=True)), 6)
+
+    def test_cursor_entre_vivas_y_archivadas(self):
+        auditoria.archivar_bitacora(dias=30, lote=4)
+        for limite in (1, 2, 3, 4, 20):
+            with self.subTest(limite=limite):
+                self.assertEqual(self.recorrer(limite), self.esperado)
+
+    def test_cursor_invalido_empieza_desde_el_principio(self):
+        filas, _ = auditoria.historial_cliente(self.cliente.id, antes='basura', limite=2)
+        self.assertEqual([f.id for f in filas], self.esperado[:2])
+
+
+class RangoTests(TestCase):
+    """almacenamiento.parsear_rango: (inicio, fin) inclusivo, None = completo (200), False = 416."""
+
+    def test_parsear_rango(self):
+        casos = [
+            (None, 10, None),
+            ('', 10, None),
+            ('bytes=2-5', 10, (2, 5)),
+            ('bytes = 2-5', 10, (2, 5)),
+            ('bytes=2-', 10, (2, 9)),
+            ('bytes=2-50', 10, (2, 9)),
+            ('bytes=9-9', 10, (9, 9)),
+            ('bytes=-3', 10, (7, 9)),
+            ('bytes=-30', 10, (0, 9)),
+            ('bytes=10-', 10, False),
+            ('bytes=10-20', 10, False),
+            ('bytes=-0', 10, False),
+            ('bytes=5-3', 10, None),
+            ('bytes=50-3', 10, None),
+            ('bytes=-', 10, None),
+            ('bytes=0-1,4-5', 10, None),
+            ('items=0-1', 10, None),
+            ('bytes=-5', 0, False),
+            ('bytes=0-', 0, False),
+        ]
+        for cabecera, tamano, esperado in casos:
+            with self.subTest(cabecera=cabecera, tamano=tamano):
+                self.assertEqual(almacenamiento.parsear_rango(cabecera, tamano), esperado)
+
+
+class DescargaDocumentoTests(MediaTemporalTestCase):
+    """Rangos, validadores (ETag / Last-Modified), If-Range y 304 de descargar_documento."""
+
+    def setUp(self):
+        self.admin = Usuario.objects.create_user('descargas', password='x', rol='admin')
+        self.client.force_login(self.admin)
+        cliente = Cliente.objects.create(nombre_empresa='Descargas SA', nombre_contacto='Ana', email='ana@descargas.mx')
+        self.doc = Documento(cliente=cliente, nombre_archivo='acta.pdf')
+        self.doc.archivo.save('acta.pdf', ContentFile(b'0123456789'))
+        self.url = reverse('descargar_documento', args=[self.doc.id])
+
+    def descargar(self, **cabeceras):
+        response = self.client.get(self.url, headers=cabeceras)
+        cuerpo = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, cuerpo
+
+    def test_completo_con_validadores(self):
+        response, cuerpo = self.descargar()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cuerpo, b'0123456789')
+        self.assertEqual(response['ETag'], f'"{self.doc.blob.sha256}"')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('Last-Modified', response)
+
+    def test_no_modificado(self):
+        response, _ = self.descargar()
+        self.assertEqual(self.descargar(**{'If-None-Match': response['ETag']})[0].status_code, 304)
+        self.assertEqual(self.descargar(**{'If-Modified-Since': response['Last-Modified']})[0].status_code, 304)
+        self.assertEqual(self.descargar(**{'If-None-Match': '"otro"'})[0].status_code, 200)
+
+    def test_rango(self):
+        response, cuerpo = self.descargar(Range='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(cuerpo, b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+
+    def test_rango_invalido_se_ignora(self):
+        response, cuerpo = self.descargar(Range='bytes=5-3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cuerpo, b'0123456789')
+
+    def test_rango_no_satisfacible(self):
+        response, _ = self.descargar(Range='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_if_range(self):
+        completo, _ = self.descargar()
+        for validador in (completo['ETag'], completo['Last-Modified']):
+            with self.subTest(validador=validador):
+                response, cuerpo = self.descargar(Range='bytes=2-5', **{'If-Range': validador})
+                self.assertEqual((response.status_code, cuerpo), (206, b'2345'))
+        # El archivo cambió desde la copia parcial: completo, aunque el rango ya no sea satisfacible
+        for rango in ('bytes=2-5', 'bytes=20-'):
+            with self.subTest(rango=rango):
+                response, cuerpo = self.descargar(Range=rango, **{'If-Range': '"viejo"'})
+                self.assertEqual((response.status_code, cuerpo), (200, b'0123456789'))
+
+
+class FeedIcsTests(TestCase):
+    """Feed ICS por token: validadores condicionales y regeneración del enlace."""
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user('agenda', password='x', access_agenda=True)
+
+    def feed(self, token, **cabeceras):
+        return self.client.get(reverse('feed_ics', args=[token]), headers=cabeceras)
+
+    def test_etag(self):
+        response = self.feed(self.usuario.token_calendario)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'BEGIN:VCALENDAR'))
+        self.assertEqual(self.feed(self.usuario.token_calendario, **{'If-None-Match': response['ETag']}).status_code, 304)
+
+    def test_regenerar_enlace(self):
+        viejo = self.usuario.token_calendario
+        self.client.force_login(self.usuario)
+        self.client.get(reverse('regenerar_enlace_ics'))
+        self.usuario.refresh_from_db()
+        self.assertEqual(self.usuario.token_calendario, viejo)
+
+        self.assertRedirects(self.client.post(reverse('regenerar_enlace_ics')), reverse('agenda_legal'))
+        self.usuario.refresh_from_db()
+        self.assertNotEqual(self.usuario.token_calendario, viejo)
+        self.assertEqual(self.feed(viejo).status_code, 404)
+        self.assertEqual(self.feed(self.usuario.token_calendario).status_code, 200)
+
+
+class ReemplazosTests(TestCase):
+    """Motor del diseñador de plantillas: un patrón para todos los textos, a nivel de run."""
+
+    LISTA = [
+        {'texto_original': 'Juan Pérez', 'variable': 'nombre_cliente'},
+        {'texto_original': 'Juan', 'variable': 'nombre'},
+        {'texto_original': 'Monterrey', 'variable': 'ciudad'},
+    ]
+
+    def documento(self):
+        from docx import Document
+        doc = Document()
+        p = doc.add_paragraph()
+        for texto in ('Contrato con Ju', 'an Pé', 'rez en Monte', 'rrey.'):
+            p.add_run(texto)
+        p.runs[1].bold = True
+        celda = doc.add_table(rows=1, cols=1).cell(0, 0)
+        celda.paragraphs[0].add_run('Firma: Juan')
+        seccion = doc.sections[0]
+        seccion.header.paragraphs[0].add_run('Expediente de Juan Pérez')
+        seccion.footer.paragraphs[0].add_run('Monterrey, N.L.')
+        return doc
+
+    def test_compilar_prefiere_la_coincidencia_mas_larga(self):
+        patron, mapa = reemplazos.compilar_reemplazos(self.LISTA + [{'texto_original': '', 'variable': 'x'}])
+        self.assertEqual(patron.sub(lambda m: mapa[m.group(0)], 'Juan Pérez y Juan'), '{{ nombre_cliente }} y {{ nombre }}')
+        self.assertEqual(reemplazos.compilar_reemplazos([]), (None, {}))
+
+    def test_texto_muy_largo_no_agota_la_recursion(self):
+        clausula = 'x' * 5000
+        patron, _ = reemplazos.compilar_reemplazos([{'texto_original': clausula, 'variable': 'clausula'}])
+        self.assertTrue(patron.fullmatch(clausula))
+
+    def test_reemplaza_entre_runs_tablas_encabezados_y_pies(self):
+        doc = self.documento()
+        self.assertEqual(reemplazos.aplicar_reemplazos(doc, self.LISTA), 5)
+        parrafo = doc.paragraphs[0]
+        self.assertEqual(parrafo.text, 'Contrato con {{ nombre_cliente }} en {{ ciudad }}.')
+        # La variable queda completa en el primer run de la coincidencia, con su formato
+        self.assertEqual([r.text for r in parrafo.runs], ['Contrato con {{ nombre_cliente }}', '', ' en {{ ciudad }}', '.'])
+        self.assertEqual(doc.tables[0].cell(0, 0).text, 'Firma: {{ nombre }}')
+        self.assertEqual(doc.sections[0].header.paragraphs[0].text, 'Expediente de {{ nombre_cliente }}')
+        self.assertEqual(doc.sections[0].footer.paragraphs[0].text, '{{ ciudad }}, N.L.')
+
+
+class AgendaRecurrenteTests(TestCase):
+    """Series RRULE: expansión acotada a la ventana, excepciones y desplazamiento de la serie."""
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user('recurrente', password='x', rol='admin')
+        self.lunes = timezone.localtime().replace(hour=10, minute=0, second=0, microsecond=0)
+        self.serie = Evento.objects.create(usuario=self.usuario, titulo='Revisión', inicio=self.lunes,
+                                           fin=self.lunes + timedelta(hours=1), recurrencia='FREQ=WEEKLY;COUNT=6')
+        self.ocurrencias = list(self.serie.regla())
+
+    def expandir(self, desde, hasta):
+        filas = calendario.consulta_eventos(self.usuario, desde, hasta)
+        return sorted((o['inicio'], o['ocurrencia']) for o in calendario.expandir_ocurrencias(filas, desde, hasta))
+
+    def test_expande_solo_la_ventana(self):
+        self.assertEqual(self.serie.recurrencia_hasta, self.ocurrencias[-1])
+        todas = self.expandir(self.lunes - timedelta(days=1), self.lunes + timedelta(days=60))
+        self.assertEqual([i for i, _ in todas], self.ocurrencias)
+        ventana = self.expandir(self.ocurrencias[2] - timedelta(hours=1), self.ocurrencias[3] + timedelta(hours=1))
+        self.assertEqual([i for i, _ in ventana], self.ocurrencias[2:4])
+
+    def test_serie_sin_fin_tiene_tope(self):
+        Evento.objects.create(usuario=self.usuario, titulo='Cada hora', inicio=self.lunes, recurrencia='FREQ=HOURLY')
+        desde, hasta = self.lunes, self.lunes + timedelta(days=30)
+        filas = [f for f in calendario.consulta_eventos(self.usuario, desde, hasta) if f['titulo'] == 'Cada hora']
+        self.assertEqual(len(list(calendario.expandir_ocurrencias(filas, desde, hasta))), Evento.MAX_OCURRENCIAS)
+
+    def test_excepciones(self):
+        movida = self.ocurrencias[4] + timedelta(days=1, hours=2)
+        calendario.cancelar_ocurrencia(self.serie, self.ocurrencias[1])
+        calendario.mover_ocurrencia(self.serie, self.ocurrencias[4], movida, movida + timedelta(hours=1))
+        todas = self.expandir(self.lunes - timedelta(days=1), self.lunes + timedelta(days=60))
+        esperado = [(o, o) for o in self.ocurrencias if o not in (self.ocurrencias[1], self.ocurrencias[4])]
+        self.assertEqual(todas, sorted(esperado + [(movida, self.ocurrencias[4])]))
+        # La ocurrencia movida aparece en la ventana de su nueva fecha aunque la original quede fuera
+        solo_movida = self.expandir(movida - timedelta(minutes=1), movida + timedelta(minutes=1))
+        self.assertEqual(solo_movida, [(movida, self.ocurrencias[4])])
+
+    def test_mover_serie_con_excepciones_contiguas(self):
+        # Desplazar una semana lleva la excepción de la 2a ocurrencia a la fecha de la 3a, que también la tiene
+        semana = timedelta(weeks=1)
+        movida = self.ocurrencias[2] + timedelta(hours=3)
+        calendario.cancelar_ocurrencia(self.serie, self.ocurrencias[1])
+        calendario.mover_ocurrencia(self.serie, self.ocurrencias[2], movida)
+        calendario.mover_serie(self.serie, self.ocurrencias[0], self.ocurrencias[0] + semana)
+
+        self.serie.refresh_from_db()
+        self.assertEqual(self.serie.inicio, self.ocurrencias[0] + semana)
+        self.assertEqual(self.serie.fin, self.ocurrencias[0] + semana + timedelta(hours=1))
+        excepciones = list(ExcepcionEvento.objects.filter(evento=self.serie).order_by('fecha_original').values_list('fecha_original', 'cancelada', 'inicio'))
+        self.assertEqual(excepciones, [(self.ocurrencias[2], True, None), (self.ocurrencias[3], False, movida + semana)])
+        todas = self.expandir(self.lunes, self.lunes + timedelta(days=70))
+        self.assertNotIn(self.ocurrencias[2], [i for i, _ in todas])
+        self.assertIn((movida + semana, self.ocurrencias[3]), todas)
+
+    def test_api_rechaza_ventanas_invalidas(self):
+        self.client.force_login(self.usuario)
+        hoy = timezone.localdate()
+        for rango in ({'start': hoy.isoformat(), 'end': (hoy + timedelta(days=1000)).isoformat()},
+                      {'start': hoy.isoformat(), 'end': (hoy - timedelta(days=1)).isoformat()},
+                      {'start': 'ayer', 'end': hoy.isoformat()}, {}):
+            with self.subTest(rango=rango):
+                self.assertEqual(self.client.get(reverse('api_eventos'), rango).status_code, 400)
+
+
+@override_settings(CACHES=caches_aisladas())
+class VersionesCacheTests(TestCase):
+    """Versión por modelo: la cambian save, delete y m2m, y otra vez al confirmar la transacción."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        versionar(Cliente, Usuario)
+
+    def setUp(self):
+        cache.clear()
+        self.cliente = Cliente.objects.create(nombre_empresa='Versiones SA', nombre_contacto='Ana', email='ana@versiones.mx')
+        self.usuario = Usuario.objects.create_user('versiones', password='x')
+
+    def cambia(self, accion, *modelos):
+        antes = versiones(*modelos)
+        with self.captureOnCommitCallbacks(execute=True):
+            accion()
+        for modelo, a, d in zip(modelos, antes, versiones(*modelos)):
+            self.assertNotEqual(a, d, f"{modelo.__name__} conservó su versión")
+
+    def test_save_y_delete(self):
+        self.cliente.nombre_contacto = 'Beatriz'
+        self.cambia(self.cliente.save, Cliente)
+        self.cambia(self.cliente.delete, Cliente)
+
+    def test_m2m_en_ambos_sentidos(self):
+        self.cambia(lambda: self.usuario.clientes_asignados.add(self.cliente), Cliente, Usuario)
+        self.cambia(lambda: self.cliente.abogados_asignados.remove(self.usuario), Cliente, Usuario)
+
+    def test_se_vuelve_a_cambiar_al_confirmar(self):
+        # Entre el cambio y el commit otro worker puede cachear los datos viejos con la versión nueva
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.cliente.save()
+        antes_del_commit = versiones(Cliente)
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(versiones(Cliente), antes_del_commit)
+
+    def test_cachear_consulta(self):
+        llamadas = []
+
+        @cachear_consulta(Cliente, espacio='pruebas.contar_clientes')
+        def contar():
+            llamadas.append(1)
+            return Cliente.objects.count()
+
+        self.assertEqual((contar(), contar()), (1, 1))
+        self.assertEqual(len(llamadas), 1)
+        Cliente.objects.create(nombre_empresa='Otra SA', nombre_contacto='Eva', email='eva@otra.mx')
+        self.assertEqual(contar(), 2)
+        self.assertEqual(len(llamadas), 2)
@@ -0,0 +1,33 @@
+# Vistas por dominio. Las librerías pesadas (weasyprint, docxtpl, mammoth, python-docx, qrcode)
+# se importan dentro de las vistas que las usan: un worker sólo las carga si atiende esas rutas.
+from .usuarios import (
+    signout, registro, mi_perfil, gestion_usuarios, autorizar_usuario, editar_usuario,
+    eliminar_usuario,
+)
+from .clientes import (
+    dashboard, nuevo_cliente, eliminar_cliente, detalle_cliente, historial_cliente_api,
+    editar_cliente, gestionar_tarea, toggle_tarea, editar_tarea, eliminar_tarea,
+    enviar_recordatorio_documentacion,
+)
+from .drive import (
+    configurar_campos, eliminar_campo_dinamico, crear_carpeta, eliminar_carpeta, crear_expediente,
+    subir_archivo_drive, iniciar_subida_api, subir_fragmento_api, finalizar_subida_api,
+    firmar_subida_api, recibir_subida_local, confirmar_subida_api, eliminar_archivo_drive,
+    descargar_carpeta_zip, acciones_masivas_drive, descargar_documento, preview_archivo,
+    subir_archivo_requisito, mover_archivo_drive,
+)
+from .contratos import (
+    generador_contratos, visor_docx, subir_plantilla, diseñador_plantillas, previsualizar_word_raw,
+    crear_variable_api, api_convertir_html, eliminar_plantilla,
+)
+from .cotizaciones import (
+    gestion_servicios, guardar_servicio, eliminar_servicio, lista_cotizaciones, nueva_cotizacion,
+    detalle_cotizacion, generar_pdf_cotizacion, convertir_a_cliente, enviar_cotizacion_email,
+    eliminar_cotizacion, generador_qr, buscar_cliente_api,
+)
+from .finanzas import panel_finanzas, registrar_pago, recibo_pago_pdf, generar_orden_cobro
+from .agenda import (
+    agenda_legal, api_eventos, feed_ics, regenerar_enlace_ics, mover_evento_api, crear_evento, disponibilidad_api,
+    eliminar_evento,
+)
+from .diagnostico import panel_diagnostico, detalle_perfil, descargar_perfil, metricas_prometheus
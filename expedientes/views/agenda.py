@@ -0,0 +1,165 @@
+import json
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.contrib.auth.decorators import login_required
+from django.contrib import messages
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, Http404
+from django.views.decorators.csrf import csrf_exempt
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag, http_date
+
+from ..asincrono import servido_por_asgi
+from ..models import Usuario, Cliente, Evento
+from ..calendario import (
+    eventos_json, generar_ics, agenerar_ics, parsear_fecha, construir_recurrencia, mover_ocurrencia, mover_serie,
+    cancelar_ocurrencia, buscar_conflictos, describir_conflictos, buscar_disponibilidad, version_agenda,
+)
+
+# ==========================================
+# 1. AGENDA
+# ==========================================
+
+@login_required
+def agenda_legal(request):
+    if not request.user.access_agenda: return redirect('dashboard')
+    hoy = timezone.now()
+    proximas = Evento.objects.filter(tipo='audiencia', inicio__gte=hoy, usuario=request.user).select_related('cliente').order_by('inicio')[:5]
+    clientes = Cliente.objects.all() if request.user.rol == 'admin' else request.user.clientes_asignados.all()
+    url_ics = request.build_absolute_uri(reverse('feed_ics', args=[request.user.token_calendario]))
+    return render(request, 'agenda/calendario.html', {'clientes': clientes, 'proximas_audiencias': proximas, 'url_ics': url_ics})
+
+@login_required
+def regenerar_enlace_ics(request):
+    # Teléfono perdido o enlace compartido por error: el token viejo deja de servir en el acto
+    if request.method == 'POST' and request.user.access_agenda:
+        request.user.token_calendario = uuid.uuid4()
+        request.user.save(update_fields=['token_calendario'])
+        messages.success(request, "Enlace regenerado. Vuelve a suscribirte con el nuevo en tus calendarios.")
+    return redirect('agenda_legal')
+
+@login_required
+async def api_eventos(request):
+    usuario = await request.auser()
+    if not usuario.access_agenda: return JsonResponse([], safe=False)
+    start, end = request.GET.get('start'), request.GET.get('end')
+    try:
+        llave, cuerpo = await sync_to_async(eventos_json)(usuario, start, end)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'msg': str(e)}, status=400)
+
+    # FullCalendar repite los mismos rangos: si nada cambió respondemos 304 sin cuerpo
+    etag = quote_etag(llave)
+    no_modificado = get_conditional_response(request, etag=etag)
+    if no_modificado is not None: return no_modificado
+
+    response = HttpResponse(cuerpo, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def feed_ics(request, token):
+    # Sin login: el token secreto identifica al usuario (Google Calendar / iPhone no mandan sesión)
+    usuario = get_object_or_404(Usuario, token_calendario=token, is_active=True)
+    if not usuario.access_agenda: raise Http404
+
+    # El contador por usuario sólo cambia si algo de su agenda cambió: el resto de los sondeos son 304
+    version = version_agenda(usuario)
+    etag = quote_etag(f"ics-{usuario.id}-{version.version}")
+    modificada = version.modificada or usuario.date_joined
+    no_modificado = get_conditional_response(request, etag=etag, last_modified=int(modificada.timestamp()))
+    if no_modificado is not None: return no_modificado
+
+    lineas = agenerar_ics if servido_por_asgi(request) else generar_ics
+    response = StreamingHttpResponse(lineas(usuario, request.get_host(), modificada), content_type='text/calendar; charset=utf-8')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modificada.timestamp())
+    response['Content-Disposition'] = 'inline; filename="agenda.ics"'
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+@csrf_exempt
+@login_required
+def mover_evento_api(request):
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body); evento = get_object_or_404(Evento, id=data.get('id'))
+            if request.user.rol != 'admin' and evento.usuario != request.user: return JsonResponse({'status': 'error', 'msg': 'Sin permiso'})
+            inicio = parsear_fecha(data.get('start'))
+            fin = parsear_fecha(data.get('end')) if data.get('end') else None
+
+            if evento.es_recurrente and data.get('ocurrencia'):
+                # Una ocurrencia (excepción) o la serie completa
+                ocurrencia = parsear_fecha(data.get('ocurrencia'))
+                if data.get('alcance') == 'serie':
+                    mover_serie(evento, ocurrencia, inicio, fin)
+                    revisar = evento
+                else:
+                    mover_ocurrencia(evento, ocurrencia, inicio, fin)
+                    # Sólo importa la nueva posición de esa ocurrencia
+                    revisar = Evento(id=evento.id, usuario_id=evento.usuario_id, cliente_id=evento.cliente_id, titulo=evento.titulo,
+                                     inicio=inicio, fin=fin or (evento.fin - evento.inicio + inicio if evento.fin else None))
+                return JsonResponse({'status': 'ok', 'conflictos': describir_conflictos(buscar_conflictos(revisar))})
+
+            evento.inicio = inicio
+            if fin: evento.fin = fin
+            evento.save()
+            return JsonResponse({'status': 'ok', 'conflictos': describir_conflictos(buscar_conflictos(evento))})
+        except Exception as e: return JsonResponse({'status': 'error', 'msg': str(e)})
+    return JsonResponse({'status': 'error'})
+
+@login_required
+def crear_evento(request):
+    if request.method == 'POST':
+        inicio = timezone.make_aware(timezone.datetime.strptime(f"{request.POST.get('fecha')} {request.POST.get('hora')}", "%Y-%m-%d %H:%M"))
+        cliente = get_object_or_404(Cliente, id=request.POST.get('cliente_id')) if request.POST.get('cliente_id') else None
+
+        # Repetición opcional: se guarda una sola fila con su regla (no copias)
+        recurrencia = construir_recurrencia(request.POST.get('repetir'), request.POST.get('repeticiones'), request.POST.get('repetir_hasta'))
+
+        evento = Evento.objects.create(usuario=request.user, titulo=request.POST.get('titulo'), inicio=inicio, tipo=request.POST.get('tipo'), cliente=cliente, descripcion=request.POST.get('descripcion'), recurrencia=recurrencia)
+        messages.success(request, "Evento agendado.")
+
+        # No se bloquea, pero se avisa si choca con la agenda del abogado o del cliente
+        conflictos = describir_conflictos(buscar_conflictos(evento))
+        if conflictos:
+            detalle = ", ".join(f"{c['titulo']} ({c['inicio']})" for c in conflictos[:3])
+            extra = f" y {len(conflictos) - 3} más" if len(conflictos) > 3 else ""
+            messages.warning(request, f"⚠️ Se empalma con: {detalle}{extra}.")
+    return redirect('agenda_legal')
+
+@login_required
+async def disponibilidad_api(request):
+    """Próximos huecos libres en común para uno o varios abogados (?usuarios=<id>&usuarios=<id>)."""
+    usuario = await request.auser()
+    if not usuario.access_agenda: return JsonResponse({'status': 'error', 'msg': 'Sin permiso'}, status=403)
+    try:
+        # Se validan aquí: un id mal formado llegaría al ORM como ValidationError (500)
+        usuarios_ids = [uuid.UUID(i) for i in request.GET.getlist('usuarios')] or [usuario.id]
+        desde = parsear_fecha(request.GET.get('desde')) if request.GET.get('desde') else timezone.now()
+        hasta = parsear_fecha(request.GET.get('hasta')) if request.GET.get('hasta') else desde + timedelta(days=14)
+        duracion = timedelta(minutes=int(request.GET.get('duracion', 60)))
+        limite = min(int(request.GET.get('limite', 5)), 50)
+        huecos = await sync_to_async(buscar_disponibilidad)(usuarios_ids, desde, hasta, duracion, limite)
+    except (ValueError, OverflowError) as e:
+        return JsonResponse({'status': 'error', 'msg': str(e)}, status=400)
+
+    return JsonResponse({'status': 'ok', 'huecos': [{'inicio': timezone.localtime(i).isoformat(), 'fin': timezone.localtime(f).isoformat()} for i, f in huecos]})
+
+@login_required
+def eliminar_evento(request, evento_id):
+    evento = get_object_or_404(Evento, id=evento_id)
+    if request.user.rol == 'admin' or evento.usuario == request.user:
+        # En series, ?ocurrencia= cancela sólo esa fecha
+        if evento.es_recurrente and request.GET.get('ocurrencia'):
+            try: ocurrencia = parsear_fecha(request.GET.get('ocurrencia'))
+            except ValueError as e: return JsonResponse({'status': 'error', 'msg': str(e)}, status=400)
+            cancelar_ocurrencia(evento, ocurrencia)
+        else:
+            evento.delete()
+        return JsonResponse({'status': 'ok'})
+    return JsonResponse({'status': 'error'}, status=403)
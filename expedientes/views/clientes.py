@@ -0,0 +1,279 @@
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.contrib.auth.decorators import login_required
+from django.contrib import messages
+from django.db.models import Count, Prefetch, Q
+from django.http import JsonResponse
+from django.utils import timezone
+from django.core.mail import EmailMessage
+from django.conf import settings
+
+from ..models import Usuario, Cliente, Carpeta, Expediente, Documento, Tarea, CampoAdicional, Evento
+from ..auditoria import registrar, historial_cliente, historial_json
+from ..almacenamiento import SUBIDAS_DIRECTAS
+from ..asincrono import enviar_correo
+
+# ==========================================
+# 1. DASHBOARD Y CLIENTES
+# ==========================================
+
+@login_required
+def dashboard(request):
+    if request.user.rol == 'admin':
+        mis_clientes = Cliente.objects.all()
+    else:
+        mis_clientes = request.user.clientes_asignados.all()
+
+    stats = {
+        'total_clientes': mis_clientes.count(),
+        'expedientes_activos': Expediente.objects.filter(cliente__in=mis_clientes, estado='abierto').count(),
+        'tareas_pendientes': Tarea.objects.filter(cliente__in=mis_clientes, completada=False).count(),
+        'docs_subidos': Documento.objects.filter(cliente__in=mis_clientes).count()
+    }
+    
+    hoy = timezone.now().date()
+    tareas_criticas = Tarea.objects.filter(cliente__in=mis_clientes, completada=False, fecha_limite__lte=hoy)
+    
+    clientes = mis_clientes.annotate(
+        num_expedientes=Count('expedientes', distinct=True),
+        urgencias=Count('tareas', filter=Q(tareas__prioridad='alta', tareas__completada=False), distinct=True)
+    ).order_by('-urgencias', '-fecha_registro')
+
+    pendientes = 0
+    if request.user.rol == 'admin':
+        pendientes = Usuario.objects.filter(is_active=False).count()
+
+    return render(request, 'dashboard.html', {
+        'clientes': clientes,
+        'stats': stats,
+        'usuarios_pendientes_conteo': pendientes,
+        'now': timezone.now(),
+        'alertas': {'tareas': tareas_criticas} 
+    })
+
+@login_required
+def nuevo_cliente(request):
+    if not (request.user.rol == 'admin' or request.user.can_create_client):
+        return redirect('dashboard')
+    if request.method == 'POST':
+        c = Cliente.objects.create(
+            nombre_empresa=request.POST.get('nombre_empresa'),
+            nombre_contacto=request.POST.get('nombre_contacto'),
+            email=request.POST.get('email'),
+            telefono=request.POST.get('telefono'),
+            logo=request.FILES.get('logo')
+        )
+        if request.user.rol != 'admin':
+            request.user.clientes_asignados.add(c)
+        return redirect('dashboard')
+    return render(request, 'nuevo_cliente.html')
+
+@login_required
+def eliminar_cliente(request, cliente_id):
+    if request.user.rol != 'admin' and not request.user.can_delete_client:
+        return redirect('dashboard')
+    cliente = get_object_or_404(Cliente, id=cliente_id)
+    cliente.delete()
+    messages.success(request, "Cliente eliminado.")
+    return redirect('dashboard')
+
+@login_required
+def detalle_cliente(request, cliente_id, carpeta_id=None):
+    # Las listas de la página se cargan aquí con sus relaciones: el número de consultas no crece con los datos
+    cliente = get_object_or_404(Cliente.objects.prefetch_related(
+        'tareas', Prefetch('eventos', queryset=Evento.objects.select_related('usuario')),
+    ), id=cliente_id)
+    
+    if request.user.rol != 'admin' and cliente not in request.user.clientes_asignados.all():
+        messages.error(request, "⛔ Acceso Denegado.")
+        return redirect('dashboard')
+
+    carpeta_actual = None
+    breadcrumbs = []
+    
+    if carpeta_id:
+        carpeta_actual = get_object_or_404(Carpeta, id=carpeta_id, cliente=cliente)
+        crumb = carpeta_actual
+        while crumb:
+            breadcrumbs.insert(0, crumb)
+            crumb = crumb.padre
+
+    if carpeta_actual:
+        carpetas = cliente.carpetas_drive.filter(padre=carpeta_actual)
+        documentos = cliente.documentos_cliente.filter(carpeta=carpeta_actual)
+    else:
+        carpetas = cliente.carpetas_drive.filter(padre__isnull=True)
+        documentos = cliente.documentos_cliente.filter(carpeta__isnull=True)
+    carpetas = carpetas.prefetch_related(Carpeta.prefetch_cumplimiento())
+
+    stats_cliente = {
+        'total_docs': cliente.documentos_cliente.count(),
+        'expedientes_activos': cliente.expedientes.filter(estado='abierto').count(),
+    }
+    
+    todas_carpetas = cliente.carpetas_drive.all()
+
+    return render(request, 'detalle_cliente.html', {
+        'cliente': cliente,
+        'carpeta_actual': carpeta_actual,
+        'breadcrumbs': breadcrumbs,
+        'carpetas': carpetas,
+        'documentos': documentos,
+        'stats_cliente': stats_cliente,
+        'todas_carpetas': todas_carpetas,
+        'subida_directa': SUBIDAS_DIRECTAS,
+    })
+
+@login_required
+def historial_cliente_api(request, cliente_id):
+    cliente = get_object_or_404(Cliente, id=cliente_id)
+    if request.user.rol != 'admin' and not request.user.clientes_asignados.filter(id=cliente.id).exists():
+        return JsonResponse({'status': 'error', 'msg': 'Sin permiso'}, status=403)
+    filas, siguiente = historial_cliente(cliente.id, request.GET.get('antes'))
+    return JsonResponse({'items': historial_json(filas), 'siguiente': siguiente})
+
+@login_required
+def editar_cliente(request, cliente_id):
+    cliente = get_object_or_404(Cliente, id=cliente_id)
+    if request.user.rol != 'admin' and cliente not in request.user.clientes_asignados.all():
+        return redirect('dashboard')
+
+    campos_dinamicos = CampoAdicional.objects.all()
+
+    if request.method == 'POST':
+        cliente.nombre_empresa = request.POST.get('nombre_empresa')
+        cliente.nombre_contacto = request.POST.get('nombre_contacto')
+        cliente.email = request.POST.get('email')
+        cliente.telefono = request.POST.get('telefono')
+        
+        if request.FILES.get('logo'):
+            cliente.logo = request.FILES['logo']
+
+        datos_nuevos = cliente.datos_extra or {}
+        for campo in campos_dinamicos:
+            valor = request.POST.get(f"custom_{campo.id}")
+            if valor:
+                datos_nuevos[campo.nombre] = valor
+        
+        cliente.datos_extra = datos_nuevos
+        cliente.save()
+        registrar(request.user, cliente, 'edicion', "Actualizó datos.")
+        messages.success(request, "Cliente actualizado.")
+        return redirect('detalle_cliente', cliente_id=cliente.id)
+
+    return render(request, 'clientes/editar.html', {
+        'c': cliente,
+        'campos_dinamicos': campos_dinamicos,
+        'datos_existentes': cliente.datos_extra
+    })
+
+# ==========================================
+# 2. TAREAS
+# ==========================================
+
+@login_required
+def gestionar_tarea(request, cliente_id):
+    if request.method == 'POST':
+        Tarea.objects.create(
+            cliente_id=cliente_id, titulo=request.POST.get('titulo'),
+            fecha_limite=request.POST.get('fecha_limite'), prioridad=request.POST.get('prioridad')
+        )
+    return redirect('detalle_cliente', cliente_id=cliente_id)
+
+@login_required
+def toggle_tarea(request, tarea_id):
+    t = get_object_or_404(Tarea, id=tarea_id)
+    t.completada = not t.completada
+    t.save()
+    return redirect('detalle_cliente', cliente_id=t.cliente.id)
+
+@login_required
+def editar_tarea(request, tarea_id):
+    t = get_object_or_404(Tarea, id=tarea_id)
+    if request.method == 'POST':
+        t.titulo = request.POST.get('titulo')
+        t.fecha_limite = request.POST.get('fecha_limite')
+        t.prioridad = request.POST.get('prioridad')
+        t.save()
+    return redirect('detalle_cliente', cliente_id=t.cliente.id)
+
+@login_required
+def eliminar_tarea(request, tarea_id):
+    t = get_object_or_404(Tarea, id=tarea_id)
+    c_id = t.cliente.id
+    t.delete()
+    return redirect('detalle_cliente', cliente_id=c_id)
+
+# ==========================================
+# 3. RECORDATORIOS DE DOCUMENTACIÓN
+# ==========================================
+def _faltantes_por_carpeta(cliente):
+    faltantes_por_carpeta = {}
+    for carpeta in cliente.carpetas_drive.all():
+        detalle = carpeta.obtener_detalle_cumplimiento()
+        if detalle:
+            # Filtramos solo los que tienen estado 'missing'
+            items_rojos = [item['nombre'] for item in detalle if item['estado'] == 'missing']
+            if items_rojos:
+                faltantes_por_carpeta[carpeta.nombre] = items_rojos
+    return faltantes_por_carpeta
+
+async def enviar_recordatorio_documentacion(request, cliente_id):
+    cliente = await aget_object_or_404(Cliente, id=cliente_id)
+    
+    # 1. Escaneamos qué falta (Solo lo que está en Rojo)
+    faltantes_por_carpeta = await sync_to_async(_faltantes_por_carpeta)(cliente)
+    total_faltantes = sum(len(items) for items in faltantes_por_carpeta.values())
+    
+    # 2. Si no falta nada, avisamos y no enviamos correo
+    if total_faltantes == 0:
+        messages.success(request, "¡Este cliente ya tiene toda su documentación completa! No es necesario enviar recordatorios.")
+        return redirect('detalle_cliente', cliente_id=cliente.id)
+
+    # 3. Redacción del Correo Formal
+    asunto = f"Pendientes de Documentación - {cliente.nombre_empresa} - AppLegal"
+    
+    mensaje = f"""
+Estimado(a) {cliente.nombre_contacto},
+
+Esperamos que este correo le encuentre bien.
+
+Le escribimos para darle seguimiento a su expediente de regularización. Para poder avanzar con los trámites ante las autoridades correspondientes, hemos detectado que aún tenemos algunos documentos pendientes de recibir.
+
+A continuación, le compartimos el listado de los requisitos faltantes organizados por carpeta:
+------------------------------------------------------------
+"""
+
+    for nombre_carpeta, documentos in faltantes_por_carpeta.items():
+        mensaje += f"\n📂 {nombre_carpeta}:\n"
+        for doc in documentos:
+            mensaje += f"   [ ] {doc}\n"
+
+    mensaje += f"""
+------------------------------------------------------------
+
+Le agradeceríamos mucho si pudiera compartirnos estos archivos a la brevedad posible, ya sea subiéndolos directamente a la plataforma o respondiendo a este correo.
+
+Si tiene alguna duda sobre algún requisito en específico, quedamos totalmente a sus órdenes para apoyarle.
+
+Atentamente,
+
+Gestiones Cordpad
+"""
+
+    # 4. Envío del Correo
+    try:
+        if cliente.email:
+            await enviar_correo(EmailMessage(
+                asunto,
+                mensaje,
+                settings.DEFAULT_FROM_EMAIL, # Asegúrate de tener esto configurado en settings.py
+                [cliente.email],
+            ))
+            messages.success(request, f"✅ Se envió el recordatorio a {cliente.email} con {total_faltantes} documentos faltantes.")
+        else:
+            messages.warning(request, "⚠️ El cliente no tiene un correo electrónico registrado.")
+    except Exception as e:
+        messages.error(request, f"❌ Error al enviar el correo: {str(e)}")
+
+    return redirect('detalle_cliente', cliente_id=cliente.id)
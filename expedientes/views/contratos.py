@@ -0,0 +1,208 @@
+import json
+from io import BytesIO
+
+from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib.auth.decorators import login_required
+from django.contrib import messages
+from django.http import JsonResponse, HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from ..models import Cliente, Carpeta, Documento, Plantilla, VariableEstandar
+from .. import metricas
+from ..auditoria import registrar
+from ..pdf import escribir_pdf
+from ..memoria import perfil_memoria
+
+# ==========================================
+# 1. CONTRATOS Y DISEÑADOR
+# ==========================================
+
+@login_required
+@perfil_memoria
+def generador_contratos(request, cliente_id):
+    from docxtpl import DocxTemplate
+    
+    if not request.user.access_contratos: return redirect('dashboard')
+    cliente = get_object_or_404(Cliente, id=cliente_id)
+    
+    if request.method == 'GET' and 'plantilla_id' not in request.GET:
+        return render(request, 'generador/seleccionar.html', {
+            'cliente': cliente,
+            'plantillas': Plantilla.objects.all().order_by('-fecha_subida'),
+            'glosario': VariableEstandar.objects.all().order_by('clave')
+        })
+
+    plantilla = get_object_or_404(Plantilla, id=request.GET.get('plantilla_id') or request.POST.get('plantilla_id'))
+    doc = DocxTemplate(plantilla.archivo.path)
+    vars_en_doc = doc.get_undeclared_template_variables()
+    memoria = cliente.datos_extra if isinstance(cliente.datos_extra, dict) else {}
+    formulario = []
+    
+    mapeo = {
+        'cliente.nombre_empresa': cliente.nombre_empresa,
+        'cliente.nombre_contacto': cliente.nombre_contacto,
+        'cliente.email': cliente.email,
+        'cliente.telefono': cliente.telefono,
+        'fecha_actual': timezone.now().strftime("%d/%m/%Y"),
+    }
+
+    for v in vars_en_doc:
+        var_std = VariableEstandar.objects.filter(clave=v).first()
+        val = ""
+        auto = False
+        desc = "Variable"
+        tipo = "text"
+
+        if var_std:
+            desc = var_std.descripcion
+            if var_std.tipo == 'fecha': tipo = 'date'
+            if var_std.origen == 'sistema':
+                val = mapeo.get(var_std.campo_bd, '')
+                auto = True
+            else: val = memoria.get(v, '')
+        else: val = memoria.get(v, '')
+
+        formulario.append({'clave': v, 'valor': val, 'descripcion': desc, 'es_automatico': auto, 'tipo': tipo})
+
+    if request.method == 'POST':
+        contexto = {}
+        nuevos_datos = {}
+        for item in formulario:
+            if item['es_automatico']: val = item['valor']
+            else:
+                val = request.POST.get(item['clave'], '').strip()
+                nuevos_datos[item['clave']] = val
+            contexto[item['clave']] = val
+            
+        cliente.datos_extra.update(nuevos_datos)
+        cliente.save(update_fields=['datos_extra'])
+        
+        doc.render(contexto)
+        buffer = BytesIO()
+        doc.save(buffer)
+        buffer.seek(0)
+        
+        nombre = request.POST.get('nombre_archivo_salida', '').strip() or f"{plantilla.nombre} - {cliente.nombre_empresa}"
+        if not nombre.lower().endswith('.docx'): nombre += ".docx"
+
+        c_contratos, _ = Carpeta.objects.get_or_create(nombre="Contratos Generados", cliente=cliente, padre=None)
+        nuevo = Documento(cliente=cliente, carpeta=c_contratos, nombre_archivo=nombre, subido_por=request.user)
+        nuevo.archivo.save(nombre, ContentFile(buffer.getvalue()))
+        nuevo.save()
+        registrar(request.user, cliente, 'generacion', f"Generó contrato: {nombre}")
+        return redirect('visor_docx', documento_id=nuevo.id)
+
+    return render(request, 'generador/llenar.html', {'cliente': cliente, 'plantilla': plantilla, 'variables': formulario})
+
+@login_required
+def visor_docx(request, documento_id):
+    import mammoth
+    
+    doc = get_object_or_404(Documento, id=documento_id)
+    html = ""
+    if doc.nombre_archivo.endswith('.docx'):
+        try:
+            with doc.archivo.open() as f, metricas.mammoth_segundos.medir(): html = mammoth.convert_to_html(f).value
+        except: pass
+    return render(request, 'generador/visor.html', {'doc': doc, 'contenido_html': html})
+
+@login_required
+def subir_plantilla(request):
+    if request.user.rol == 'admin' and request.method == 'POST':
+        Plantilla.objects.create(nombre=request.POST.get('nombre'), archivo=request.FILES.get('archivo'))
+    return redirect('dashboard')
+
+@login_required
+def diseñador_plantillas(request):
+    if not request.user.access_disenador: return redirect('dashboard')
+    
+    if request.method == 'POST':
+        nombre = request.POST.get('nombre')
+        archivo = request.FILES.get('archivo_base')
+        data_reemplazos = request.POST.get('reemplazos')
+
+        if archivo and nombre:
+            try:
+                from docx import Document as DocumentoWord
+                from ..reemplazos import aplicar_reemplazos
+                doc = DocumentoWord(archivo)
+                if data_reemplazos:
+                    # Una sola pasada por cuerpo, tablas, encabezados y pies (conserva formato)
+                    aplicar_reemplazos(doc, json.loads(data_reemplazos))
+
+                buffer = BytesIO()
+                doc.save(buffer)
+                buffer.seek(0)
+                nombre_archivo = nombre if nombre.endswith('.docx') else f"{nombre}.docx"
+                nueva_plantilla = Plantilla(nombre=nombre)
+                nueva_plantilla.archivo.save(nombre_archivo, ContentFile(buffer.getvalue()))
+                nueva_plantilla.save()
+                messages.success(request, f"¡Plantilla '{nombre}' guardada!")
+            except Exception as e:
+                messages.error(request, f"Error: {e}")
+            return redirect('dashboard')
+    return render(request, 'generador/diseñador.html', {'glosario': VariableEstandar.objects.all().order_by('clave')})
+
+@csrf_exempt
+@login_required
+def previsualizar_word_raw(request):
+    if request.method == 'POST' and request.FILES.get('archivo'):
+        try:
+            import mammoth
+            f = request.FILES['archivo']
+            with metricas.mammoth_segundos.medir(): result = mammoth.convert_to_html(f)
+            return JsonResponse({'html': result.value})
+        except Exception as e:
+            return JsonResponse({'status': 'error', 'msg': str(e)}, status=500)
+    return JsonResponse({'status': 'error', 'msg': 'No se envió archivo'}, status=400)
+
+@csrf_exempt
+@login_required
+def crear_variable_api(request):
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            clave = data.get('clave')
+            descripcion = data.get('descripcion', '')
+            tipo = data.get('tipo', 'texto')
+            if not clave: return JsonResponse({'status': 'error', 'msg': 'Falta la clave'}, status=400)
+            variable, created = VariableEstandar.objects.get_or_create(clave=clave, defaults={'descripcion': descripcion, 'tipo': tipo})
+            return JsonResponse({'status': 'ok', 'id': str(variable.id), 'clave': variable.clave, 'created': created})
+        except Exception as e:
+            return JsonResponse({'status': 'error', 'msg': str(e)}, status=500)
+    return JsonResponse({'status': 'error', 'msg': 'Método no permitido'}, status=405)
+
+@csrf_exempt
+def api_convertir_html(request):
+    if request.method == 'POST':
+        try:
+            try: data = json.loads(request.body); html_content = data.get('html', '')
+            except: html_content = request.POST.get('html', '')
+            if not html_content: return JsonResponse({'error': 'No content'}, status=400)
+            response = HttpResponse(content_type='application/pdf')
+            response['Content-Disposition'] = 'attachment; filename="documento_diseñado.pdf"'
+            base_url = request.build_absolute_uri('/')
+            escribir_pdf(html_content, base_url, response)
+            return response
+        except Exception as e: return JsonResponse({'error': str(e)}, status=500)
+    return JsonResponse({'status': 'error', 'message': 'Only POST allowed'}, status=405)
+
+@login_required
+def eliminar_plantilla(request, plantilla_id):
+    if request.user.rol != 'admin':
+        messages.error(request, "No tienes permisos.")
+        return redirect('dashboard')
+        
+    plantilla = get_object_or_404(Plantilla, id=plantilla_id)
+    nombre = plantilla.nombre
+    
+    # Borrar archivo físico y registro
+    plantilla.archivo.delete() 
+    plantilla.delete()
+    
+    messages.success(request, f"Plantilla '{nombre}' eliminada.")
+    
+    # Intentar volver a la página anterior
+    return redirect(request.META.get('HTTP_REFERER', 'dashboard'))
@@ -0,0 +1,415 @@
+import os
+from io import BytesIO
+import base64
+from decimal import Decimal
+from email.mime.image import MIMEImage
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.contrib.auth.decorators import login_required
+from django.contrib import messages
+from django.db.models import Q
+from django.http import JsonResponse, HttpResponse
+from django.utils import timezone
+from django.utils.text import slugify
+from django.template.loader import render_to_string
+from django.core.mail import EmailMultiAlternatives
+from django.conf import settings
+from django.utils.html import strip_tags
+
+from ..models import (
+    Cliente, Carpeta, Documento, Servicio, Cotizacion, ItemCotizacion, PlantillaMensaje,
+    CuentaPorCobrar,
+)
+from ..asincrono import enviar_correo
+from ..pdf import escribir_pdf, renderizar_pdf
+from ..memoria import perfil_memoria
+from ..cache import cachear_consulta, cachear_fragmento
+
+# ==========================================
+# 1. COTIZACIONES Y SERVICIOS
+# ==========================================
+
+@cachear_consulta(Servicio)
+def catalogo_servicios():
+    # Lo leen la gestión y cada cotización nueva; cambia rara vez
+    return Servicio.objects.all().order_by('nombre')
+
+@login_required
+def gestion_servicios(request):
+    if not request.user.access_cotizaciones: return redirect('dashboard')
+    return render(request, 'cotizaciones/servicios.html', {'servicios': catalogo_servicios()})
+
+@login_required
+def guardar_servicio(request):
+    if request.method == 'POST':
+        s_id = request.POST.get('servicio_id')
+        s = get_object_or_404(Servicio, id=s_id) if s_id else Servicio()
+        
+        s.nombre = request.POST.get('nombre')
+        s.descripcion = request.POST.get('descripcion')
+        s.precio_base = request.POST.get('precio')
+        
+        # Guardar lista de campos dinámicos (Nombre: Valor)
+        nombres = request.POST.getlist('campo_nombre[]')
+        valores = request.POST.getlist('campo_valor[]')
+        
+        estructura = []
+        for nombre, valor in zip(nombres, valores):
+            if nombre.strip():
+                estructura.append({'nombre': nombre.strip(), 'valor': valor.strip()})
+        
+        s.campos_dinamicos = estructura
+        s.save()
+        messages.success(request, "Servicio actualizado correctamente.")
+    return redirect('gestion_servicios')
+
+@login_required
+def eliminar_servicio(request, servicio_id):
+    get_object_or_404(Servicio, id=servicio_id).delete()
+    return redirect('gestion_servicios')
+
+@login_required
+def lista_cotizaciones(request):
+    if not request.user.access_cotizaciones: return redirect('dashboard')
+    return render(request, 'cotizaciones/lista.html', {'cotizaciones': Cotizacion.objects.all().order_by('-fecha_creacion')})
+
+@login_required
+def nueva_cotizacion(request):
+    if request.method == 'POST':
+        # 1. Datos Generales
+        titulo = request.POST.get('titulo')
+        
+        # 2. Datos Cliente
+        prospecto_empresa = request.POST.get('prospecto_empresa')
+        prospecto_nombre = request.POST.get('prospecto_nombre')
+        prospecto_email = request.POST.get('prospecto_email')
+        prospecto_telefono = request.POST.get('prospecto_telefono')
+        prospecto_direccion = request.POST.get('prospecto_direccion')
+        prospecto_cargo = request.POST.get('prospecto_cargo')
+        validez = request.POST.get('validez_hasta')
+        
+        # Título automático si viene vacío
+        if not titulo:
+            cliente_ref = prospecto_empresa if prospecto_empresa else prospecto_nombre
+            titulo = f"Cotización para {cliente_ref}"
+
+        # 3. Descuento
+        porcentaje_str = request.POST.get('porcentaje_descuento', '0')
+        try:
+            porcentaje_descuento = Decimal(porcentaje_str)
+        except:
+            porcentaje_descuento = Decimal('0.00')
+
+        # 4. LÓGICA DE IVA FLEXIBLE
+        aplica_iva = request.POST.get('aplica_iva') == 'on'
+        
+        # Capturamos la tasa personalizada del formulario
+        # Si no viene o hay error, usamos 16 por defecto
+        tasa_str = request.POST.get('porcentaje_iva_personalizado', '16')
+        try:
+            tasa_iva = Decimal(tasa_str)
+        except:
+            tasa_iva = Decimal('16.00')
+
+        # 5. Crear Objeto Cotización
+        cotizacion = Cotizacion.objects.create(
+            titulo=titulo,
+            prospecto_empresa=prospecto_empresa,
+            prospecto_nombre=prospecto_nombre,
+            prospecto_email=prospecto_email,
+            prospecto_telefono=prospecto_telefono,
+            prospecto_direccion=prospecto_direccion,
+            prospecto_cargo=prospecto_cargo,
+            porcentaje_descuento=porcentaje_descuento,
+            validez_hasta=validez if validez else None,
+            
+            # Guardamos configuración de IVA
+            aplica_iva=aplica_iva,
+            porcentaje_iva=tasa_iva,  # <--- AQUÍ SE GUARDA LA TASA (8, 16, etc)
+            
+            creado_por=request.user
+        )
+
+        # 6. Procesar Servicios (Items)
+        servicios_ids = request.POST.getlist('servicios_seleccionados')
+        cantidades = request.POST.getlist('cantidades')
+        precios = request.POST.getlist('precios_personalizados')
+        descripciones = request.POST.getlist('descripciones_personalizadas')
+
+        for s_id, cant, prec, desc in zip(servicios_ids, cantidades, precios, descripciones):
+            if s_id:
+                servicio = get_object_or_404(Servicio, id=s_id)
+                cantidad = int(cant)
+                try:
+                    precio_u = Decimal(prec)
+                except:
+                    precio_u = Decimal('0.00')
+                
+                ItemCotizacion.objects.create(
+                    cotizacion=cotizacion,
+                    servicio=servicio,
+                    cantidad=cantidad,
+                    precio_unitario=precio_u,
+                    descripcion_personalizada=desc
+                )
+        
+        # 7. Calcular Totales Finales
+        cotizacion.calcular_totales()
+
+        messages.success(request, 'Cotización creada exitosamente.')
+        return redirect('detalle_cotizacion', cotizacion_id=cotizacion.id)
+
+    # GET: Mostrar formulario
+    return render(request, 'cotizaciones/crear.html', {'servicios': catalogo_servicios()})
+
+@login_required
+def detalle_cotizacion(request, cotizacion_id):
+    c = get_object_or_404(Cotizacion, id=cotizacion_id)
+    return render(request, 'cotizaciones/detalle.html', {'c': c, 'plantillas_ws': PlantillaMensaje.objects.filter(tipo='whatsapp')})
+
+@login_required
+@perfil_memoria
+def generar_pdf_cotizacion(request, cotizacion_id):
+    c = get_object_or_404(Cotizacion, id=cotizacion_id)
+    html = render_to_string('cotizaciones/pdf_template.html', {'c': c, 'base_url': request.build_absolute_uri('/')})
+    response = HttpResponse(content_type='application/pdf')
+    escribir_pdf(html, request.build_absolute_uri('/'), response)
+    return response
+
+@login_required
+@perfil_memoria
+def convertir_a_cliente(request, cotizacion_id):
+    # Imports necesarios para esta lógica específica
+    from django.core.files.base import ContentFile
+    
+    c = get_object_or_404(Cotizacion, id=cotizacion_id)
+    
+    # 1. Validación: Si ya es cliente, redirigir
+    if c.cliente_convertido:
+        messages.warning(request, f"Esta cotización ya pertenece al cliente {c.cliente_convertido}")
+        return redirect('detalle_cliente', cliente_id=c.cliente_convertido.id)
+
+    # 2. Buscar o Crear Cliente
+    nombre_busqueda = c.prospecto_empresa if c.prospecto_empresa else c.prospecto_nombre
+    cli = Cliente.objects.filter(nombre_empresa__iexact=nombre_busqueda).first()
+
+    if not cli:
+        # Crear Cliente Nuevo
+        cli = Cliente.objects.create(
+            nombre_empresa=nombre_busqueda,
+            nombre_contacto=c.prospecto_nombre,
+            email=c.prospecto_email,
+            telefono=c.prospecto_telefono,
+            datos_extra={'direccion': c.prospecto_direccion, 'cargo': c.prospecto_cargo}
+        )
+        # Asignar permisos si no es admin
+        if request.user.rol != 'admin':
+            request.user.clientes_asignados.add(cli)
+
+    # 3. Buscar la Carpeta "Cotizaciones"
+    # Usamos "Cotizaciones" (Mayúscula) para coincidir con el Signal
+    carpeta_db, _ = Carpeta.objects.get_or_create(
+        nombre="Cotizaciones",
+        cliente=cli,
+        defaults={'es_expediente': False}
+    )
+
+    # 4. Generar el PDF en memoria
+    html_string = render_to_string('cotizaciones/pdf_template.html', {'c': c})
+    pdf_content = escribir_pdf(html_string, request.build_absolute_uri())
+
+    # 5. Definir nombre del archivo seguro
+    nombre_safe = slugify(c.titulo or f"v1_{c.id}").replace("-", "_")
+    nombre_archivo = f"Cotizacion_{c.id}_{nombre_safe}.pdf"
+
+    # 6. GUARDAR EL ARCHIVO (Usando modelo DOCUMENTO)
+    # Esto soluciona que no apareciera en el Dashboard y evita errores de ruta
+    if not Documento.objects.filter(carpeta=carpeta_db, nombre_archivo=nombre_archivo).exists():
+        nuevo_doc = Documento(
+            cliente=cli,
+            carpeta=carpeta_db,
+            nombre_archivo=nombre_archivo,
+            subido_por=request.user
+        )
+        # ContentFile guarda los bytes del PDF directamente en el sistema de archivos
+        nuevo_doc.archivo.save(nombre_archivo, ContentFile(pdf_content))
+        nuevo_doc.save()
+
+    # 7. Registrar en Finanzas (Cuentas por Cobrar)
+    # Seleccionamos el monto correcto dependiendo si la cotización llevaba IVA o no
+    monto_final_cobro = c.total_con_iva if c.aplica_iva else c.total
+
+    CuentaPorCobrar.objects.create(
+        cliente=cli,
+        cotizacion=c,
+        concepto=f"Cotización #{c.id} - {c.titulo or 'Proyecto'}",
+        monto_total=monto_final_cobro,     # <--- Total real (con o sin IVA)
+        saldo_pendiente=monto_final_cobro, # Inicialmente se debe todo
+        fecha_vencimiento=c.validez_hasta or timezone.now().date()
+    )
+
+    # 8. Actualizar Cotización
+    c.estado = 'aceptada'
+    c.cliente_convertido = cli
+    c.save()
+
+    messages.success(request, "Cliente creado/asociado, PDF guardado y cuenta por cobrar generada.")
+    return redirect('detalle_cliente', cliente_id=cli.id)
+
+def _leer_logo_firma():
+    # Ruta a tu logo estático (Asegúrate de que la ruta sea correcta en tu PC)
+    logo_path = os.path.join(settings.BASE_DIR, 'static', 'img', 'logo.png')
+    if not os.path.exists(logo_path):
+        return None
+    with open(logo_path, 'rb') as f:
+        return f.read()
+
+# FUNCIÓN DE CORREO ACTUALIZADA (RESEND + NOMBRE INTELIGENTE)
+# ----------------------------------------------------
+@login_required
+async def enviar_cotizacion_email(request, cotizacion_id):
+    cotizacion = await aget_object_or_404(Cotizacion, id=cotizacion_id)
+    
+    if request.method == 'POST':
+        asunto = request.POST.get('asunto')
+        mensaje_usuario = request.POST.get('mensaje')
+        
+        # Datos de la Firma Personalizable
+        firma_nombre = request.POST.get('firma_nombre', 'Lic. Maribel Aldana Santos')
+        firma_cargo = request.POST.get('firma_cargo', 'Gestiones Corpad | Directora General')
+        usar_logo_default = request.POST.get('usar_logo_default') == 'on'
+        
+        # 1. Renderizar el PDF (para adjuntarlo): la plantilla consulta los items en un hilo
+        # y WeasyPrint corre en su propio pool, sin bloquear el event loop
+        html_string = await sync_to_async(render_to_string)('cotizaciones/pdf_template.html', {'c': cotizacion})
+        pdf_file = await renderizar_pdf(html_string, request.build_absolute_uri())
+
+        # 2. Construir el Cuerpo del Correo (HTML)
+        # Aquí incrustamos tu mensaje y la firma editable
+        html_content = f"""
+        <html>
+            <body style="font-family: Arial, sans-serif; color: #333;">
+                <div style="padding: 20px;">
+                    <p style="white-space: pre-line;">{mensaje_usuario}</p>
+                    <br><br>
+                    <div style="border-top: 1px solid #ddd; padding-top: 20px; display: flex; align-items: center;">
+                        {'<img src="cid:logo_firma" style="width: 50px; height: 50px; border-radius: 50%; margin-right: 15px;">' if usar_logo_default else ''}
+                        <div>
+                            <strong style="font-size: 14px; color: #2D1B4B; display: block;">{firma_nombre}</strong>
+                            <span style="font-size: 12px; color: #666;">{firma_cargo}</span>
+                        </div>
+                    </div>
+                </div>
+            </body>
+        </html>
+        """
+        text_content = strip_tags(html_content)
+
+        # 3. Configurar el Email
+        email = EmailMultiAlternatives(
+            subject=asunto,
+            body=text_content,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[cotizacion.prospecto_email]
+        )
+        email.attach_alternative(html_content, "text/html")
+
+        # 4. Adjuntar PDF
+        filename = f"Cotizacion_{cotizacion.id}.pdf"
+        email.attach(filename, pdf_file, 'application/pdf')
+
+        # 5. Adjuntar Logo como imagen en línea (CID) si se solicitó
+        if usar_logo_default:
+            # Lectura de disco: en un hilo, fuera del event loop
+            logo_data = await sync_to_async(_leer_logo_firma)()
+            if logo_data:
+                logo = MIMEImage(logo_data)
+                logo.add_header('Content-ID', '<logo_firma>')
+                email.attach(logo)
+
+        # Enviar
+        await enviar_correo(email)
+        messages.success(request, f'Correo enviado exitosamente a {cotizacion.prospecto_email}')
+        
+    return redirect('detalle_cotizacion', cotizacion_id=cotizacion_id)
+@login_required
+def eliminar_cotizacion(request, cotizacion_id):
+    if not request.user.access_cotizaciones:
+        messages.error(request, "No tienes permiso para realizar esta acción.")
+        return redirect('lista_cotizaciones')
+    
+    cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id)
+    cotizacion_id_ref = cotizacion.id 
+    cotizacion.delete()
+    
+    messages.success(request, f"La cotización #{cotizacion_id_ref} fue eliminada exitosamente.")
+    return redirect('lista_cotizaciones')
+
+@login_required
+def generador_qr(request):
+    qr_url = None
+    
+    # Valores por defecto
+    data = ""
+    color_fill = "#2D1B4B" # Morado oscuro de tu marca
+    color_back = "#FFFFFF" # Blanco
+
+    if request.method == 'POST':
+        data = request.POST.get('data')
+        color_fill = request.POST.get('color_fill', '#2D1B4B')
+        color_back = request.POST.get('color_back', '#FFFFFF')
+
+        if data:
+            import qrcode
+
+            # Configuración del QR
+            qr = qrcode.QRCode(
+                version=1,
+                error_correction=qrcode.constants.ERROR_CORRECT_H,
+                box_size=10,
+                border=4,
+            )
+            qr.add_data(data)
+            qr.make(fit=True)
+
+            # Generar imagen con colores personalizados
+            img = qr.make_image(
+                fill_color=color_fill, 
+                back_color=color_back
+            )
+
+            # Convertir a base64 para mostrar en HTML sin guardar archivo
+            buffer = BytesIO()
+            img.save(buffer, format="PNG")
+            img_str = base64.b64encode(buffer.getvalue()).decode()
+            qr_url = f"data:image/png;base64,{img_str}"
+
+    return render(request, 'generador_qr.html', {
+        'qr_url': qr_url,
+        'data_input': data,
+        'color_fill': color_fill,
+        'color_back': color_back
+    })
+@login_required
+@cachear_fragmento(Cotizacion, por_usuario=False)
+async def buscar_cliente_api(request):
+    query = request.GET.get('q', '')
+    if len(query) < 2:
+        return JsonResponse([], safe=False)
+    
+    # Buscamos en cotizaciones anteriores empresas que se parezcan
+    # Usamos 'distinct' para no traer repetidos
+    resultados = Cotizacion.objects.filter(
+        Q(prospecto_empresa__icontains=query) | 
+        Q(prospecto_nombre__icontains=query)
+    ).values(
+        'prospecto_empresa', 
+        'prospecto_nombre', 
+        'prospecto_email', 
+        'prospecto_telefono',
+        'prospecto_direccion',
+        'prospecto_cargo'
+    ).distinct()[:5] # Limitamos a 5 sugerencias
+
+    return JsonResponse([r async for r in resultados], safe=False)
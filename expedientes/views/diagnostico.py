@@ -0,0 +1,62 @@
+import json
+
+from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, FileResponse, Http404
+from django.utils.crypto import constant_time_compare
+
+from ..diagnostico import resumen_vistas, VENTANA, PRESUPUESTO_MODO
+from ..memoria import resumen_memoria, HISTORIAL as HISTORIAL_MEMORIA
+from ..metricas import exposicion, TOKEN_METRICAS
+from ..models import PerfilPeticion
+
+# ==========================================
+# 1. DIAGNÓSTICO DE RENDIMIENTO (ADMIN)
+# ==========================================
+
+@login_required
+def panel_diagnostico(request):
+    if request.user.rol != 'admin': return redirect('dashboard')
+    perfiles = PerfilPeticion.objects.select_related('usuario').order_by('-creado_el')[:50]
+    return render(request, 'diagnostico/panel.html', {
+        'vistas': resumen_vistas(), 'ventana': VENTANA, 'modo': PRESUPUESTO_MODO, 'perfiles': perfiles,
+        'memoria': resumen_memoria(), 'historial_memoria': HISTORIAL_MEMORIA,
+    })
+
+@login_required
+def detalle_perfil(request, perfil_id):
+    if request.user.rol != 'admin': return redirect('dashboard')
+    perfil = get_object_or_404(PerfilPeticion, id=perfil_id)
+    try:
+        with perfil.sql.open('rb') as f:
+            consultas = json.load(f)
+    except (OSError, ValueError):
+        consultas = []
+
+    # Mismo SQL repetido muchas veces = N+1: se agrupa por texto para que salte a la vista
+    grupos = {}
+    for c in consultas:
+        g = grupos.setdefault(c['sql'], {'sql': c['sql'], 'veces': 0, 'ms': 0.0})
+        g['veces'] += 1
+        g['ms'] += c['ms']
+    return render(request, 'diagnostico/perfil.html', {
+        'perfil': perfil,
+        'repetidas': sorted((g for g in grupos.values() if g['veces'] > 1), key=lambda g: g['veces'], reverse=True)[:20],
+        'lentas': sorted(consultas, key=lambda c: c['ms'], reverse=True)[:30],
+        'total_sql_ms': sum(c['ms'] for c in consultas),
+    })
+
+@login_required
+def descargar_perfil(request, perfil_id, archivo):
+    if request.user.rol != 'admin': return redirect('dashboard')
+    perfil = get_object_or_404(PerfilPeticion, id=perfil_id)
+    if archivo not in ('perfil', 'sql'): raise Http404
+    campo = getattr(perfil, archivo)
+    return FileResponse(campo.open('rb'), as_attachment=True, filename=campo.name.rsplit('/', 1)[-1])
+
+def metricas_prometheus(request):
+    autorizado = request.user.is_authenticated and request.user.rol == 'admin'
+    if not autorizado and TOKEN_METRICAS:
+        autorizado = constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {TOKEN_METRICAS}")
+    if not autorizado: return HttpResponse("Acceso Denegado", status=403)
+    return HttpResponse(exposicion(), content_type='text/plain; version=0.0.4; charset=utf-8')
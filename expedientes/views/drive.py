@@ -0,0 +1,348 @@
+import json
+import mimetypes
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.urls import reverse
+from django.contrib.auth.decorators import login_required
+from django.contrib import messages
+from django.db import transaction
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse, Http404
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, content_disposition_header, parse_http_date_safe
+
+from ..models import Cliente, Carpeta, Expediente, Documento, CampoAdicional, SubidaFragmentada
+from .. import metricas
+from ..auditoria import registrar, aregistrar
+from ..almacenamiento import (
+    iniciar_subida, guardar_fragmento, finalizar_subida, fragmentos_recibidos, ErrorSubida,
+    SubidaDirectaLocal, backend_subida_directa, firmar_subida_directa, leer_token_subida,
+    confirmar_subida_directa, modo_descarga, etag_documento, parsear_rango, leer_rango,
+    aleer_rango, DESCARGAS_PREFIJO_INTERNO, eliminar_documentos, zip_en_flujo, azip_en_flujo,
+)
+from ..asincrono import servido_por_asgi
+from ..memoria import perfil_memoria
+
+# ==========================================
+# 1. CONFIGURACIÓN Y DRIVE
+# ==========================================
+
+@login_required
+def configurar_campos(request):
+    if request.user.rol != 'admin': return redirect('dashboard')
+    campos = CampoAdicional.objects.all()
+    if request.method == 'POST':
+        nombre = request.POST.get('nombre')
+        if not CampoAdicional.objects.filter(nombre__iexact=nombre).exists():
+            CampoAdicional.objects.create(nombre=nombre, tipo=request.POST.get('tipo'))
+            messages.success(request, f"Campo '{nombre}' agregado.")
+        return redirect('configurar_campos')
+    return render(request, 'clientes/configurar_campos.html', {'campos': campos})
+
+@login_required
+def eliminar_campo_dinamico(request, campo_id):
+    if request.user.rol != 'admin': return redirect('dashboard')
+    get_object_or_404(CampoAdicional, id=campo_id).delete()
+    return redirect('configurar_campos')
+
+@login_required
+def crear_carpeta(request, cliente_id):
+    if request.method == 'POST':
+        padre_id = request.POST.get('padre_id')
+        padre = get_object_or_404(Carpeta, id=padre_id) if padre_id else None
+        Carpeta.objects.create(nombre=request.POST.get('nombre'), cliente_id=cliente_id, padre=padre)
+        if padre: return redirect('detalle_carpeta', cliente_id=cliente_id, carpeta_id=padre.id)
+    return redirect('detalle_cliente', cliente_id=cliente_id)
+
+@login_required
+def eliminar_carpeta(request, carpeta_id):
+    if not (request.user.can_delete_client or request.user.rol == 'admin'): return redirect('dashboard')
+    c = get_object_or_404(Carpeta, id=carpeta_id)
+    url_destino = 'detalle_carpeta' if c.padre else 'detalle_cliente'
+    kwargs = {'cliente_id': c.cliente.id}
+    if c.padre: kwargs['carpeta_id'] = c.padre.id
+    c.delete()
+    return redirect(url_destino, **kwargs)
+
+@login_required
+def crear_expediente(request, cliente_id):
+    if request.method == 'POST':
+        f = Carpeta.objects.create(nombre=f"EXP {request.POST.get('num_expediente')}: {request.POST.get('titulo')}", cliente_id=cliente_id, es_expediente=True)
+        Expediente.objects.create(cliente_id=cliente_id, num_expediente=request.POST.get('num_expediente'), titulo=request.POST.get('titulo'), carpeta=f)
+    return redirect('detalle_cliente', cliente_id=cliente_id)
+
+@login_required
+def subir_archivo_drive(request, cliente_id):
+    if not (request.user.can_upload_files or request.user.rol == 'admin'): return redirect('detalle_cliente', cliente_id=cliente_id)
+    if request.method == 'POST':
+        cliente = get_object_or_404(Cliente, id=cliente_id)
+        archivos = request.FILES.getlist('archivo')
+        carpeta_raiz_id = request.POST.get('carpeta_id')
+        carpeta_raiz = get_object_or_404(Carpeta, id=carpeta_raiz_id) if carpeta_raiz_id else None
+        
+        count = 0
+        for f in archivos:
+            Documento.objects.create(cliente_id=cliente_id, archivo=f, nombre_archivo=f.name, carpeta=carpeta_raiz, subido_por=request.user)
+            count += 1
+        
+        ubicacion = carpeta_raiz.nombre if carpeta_raiz else "Raíz"
+        registrar(request.user, cliente, 'subida', f"Subió {count} archivos en '{ubicacion}'.")
+        if carpeta_raiz: return redirect('detalle_carpeta', cliente_id=cliente_id, carpeta_id=carpeta_raiz.id)
+    return redirect('detalle_cliente', cliente_id=cliente_id)
+
+@login_required
+def iniciar_subida_api(request, cliente_id):
+    if not (request.user.can_upload_files or request.user.rol == 'admin'): return JsonResponse({'status': 'error', 'msg': 'Sin permiso'}, status=403)
+    if request.method != 'POST': return JsonResponse({'status': 'error', 'msg': 'Método no permitido'}, status=405)
+    cliente = get_object_or_404(Cliente, id=cliente_id)
+    try:
+        data = json.loads(request.body)
+        carpeta = get_object_or_404(Carpeta, id=data['carpeta_id'], cliente=cliente) if data.get('carpeta_id') else None
+        subida = iniciar_subida(request.user, cliente, carpeta, data['nombre'], int(data['tamano']), data.get('huella', ''))
+    except (KeyError, ValueError, TypeError): return JsonResponse({'status': 'error', 'msg': 'Datos incompletos'}, status=400)
+    except ErrorSubida as e: return JsonResponse({'status': 'error', 'msg': str(e)}, status=e.status)
+    return JsonResponse({
+        'status': 'ok', 'id': str(subida.id), 'tamano_fragmento': subida.tamano_fragmento,
+        'total': subida.total_fragmentos, 'recibidos': fragmentos_recibidos(subida),
+    })
+
+@login_required
+def subir_fragmento_api(request, subida_id, n):
+    if request.method != 'PUT': return JsonResponse({'status': 'error', 'msg': 'Método no permitido'}, status=405)
+    subida = get_object_or_404(SubidaFragmentada, id=subida_id, usuario=request.user)
+    try:
+        longitud = int(request.META.get('CONTENT_LENGTH') or 0)
+        # Se lee el flujo directamente: request.body cargaría el fragmento completo en memoria
+        guardar_fragmento(subida, n, request, longitud, request.headers.get('X-Fragmento-Sha256', ''))
+    except ErrorSubida as e: return JsonResponse({'status': 'error', 'msg': str(e)}, status=e.status)
+    return JsonResponse({'status': 'ok', 'n': n})
+
+@login_required
+def finalizar_subida_api(request, subida_id):
+    if request.method != 'POST': return JsonResponse({'status': 'error', 'msg': 'Método no permitido'}, status=405)
+    subida = get_object_or_404(SubidaFragmentada.objects.select_related('cliente', 'carpeta'), id=subida_id, usuario=request.user)
+    try: doc = finalizar_subida(subida, request.user)
+    except ErrorSubida as e: return JsonResponse({'status': 'error', 'msg': str(e)}, status=e.status)
+    return JsonResponse({'status': 'ok', 'documento_id': doc.id, 'nombre': doc.nombre_archivo})
+
+@login_required
+def firmar_subida_api(request, cliente_id):
+    if not (request.user.can_upload_files or request.user.rol == 'admin'): return JsonResponse({'status': 'error', 'msg': 'Sin permiso'}, status=403)
+    if request.method != 'POST': return JsonResponse({'status': 'error', 'msg': 'Método no permitido'}, status=405)
+    cliente = get_object_or_404(Cliente, id=cliente_id)
+    try:
+        data = json.loads(request.body)
+        carpeta = get_object_or_404(Carpeta, id=data['carpeta_id'], cliente=cliente) if data.get('carpeta_id') else None
+        destino = firmar_subida_directa(request.user, cliente, carpeta, data['nombre'], int(data['tamano']))
+    except (KeyError, ValueError, TypeError): return JsonResponse({'status': 'error', 'msg': 'Datos incompletos'}, status=400)
+    except ErrorSubida as e: return JsonResponse({'status': 'error', 'msg': str(e)}, status=e.status)
+    return JsonResponse(dict(destino, status='ok'))
+
+@csrf_exempt
+def recibir_subida_local(request, token):
+    # Sustituto local del almacenamiento externo: la autorización es el token firmado, no la sesión
+    if request.method != 'POST': return JsonResponse({'error': {'message': 'Método no permitido'}}, status=405)
+    backend = backend_subida_directa()
+    if not isinstance(backend, SubidaDirectaLocal): raise Http404
+    try: datos = leer_token_subida(token)
+    except ErrorSubida as e: return JsonResponse({'error': {'message': str(e)}}, status=e.status)
+    archivo = request.FILES.get('file')
+    if not archivo or archivo.size != datos['t']: return JsonResponse({'error': {'message': 'Archivo incompleto'}}, status=400)
+    return JsonResponse(backend.recibir(datos['l'], archivo))
+
+@login_required
+def confirmar_subida_api(request):
+    if request.method != 'POST': return JsonResponse({'status': 'error', 'msg': 'Método no permitido'}, status=405)
+    try:
+        data = json.loads(request.body)
+        doc = confirmar_subida_directa(request.user, data['token'], data.get('resultado') or {})
+    except (KeyError, ValueError, TypeError): return JsonResponse({'status': 'error', 'msg': 'Datos incompletos'}, status=400)
+    except ErrorSubida as e: return JsonResponse({'status': 'error', 'msg': str(e)}, status=e.status)
+    return JsonResponse({'status': 'ok', 'documento_id': doc.id, 'nombre': doc.nombre_archivo})
+
+@login_required
+def eliminar_archivo_drive(request, archivo_id):
+    doc = get_object_or_404(Documento, id=archivo_id)
+    if not (request.user.can_delete_client or request.user.rol == 'admin'): return redirect('detalle_cliente', cliente_id=doc.cliente.id)
+    c_id, padre_id = doc.cliente.id, doc.carpeta.id if doc.carpeta else None
+    registrar(request.user, doc.cliente, 'eliminacion', f"Eliminó {doc.nombre_archivo}")
+    doc.delete()  # El archivo se libera en la señal post_delete (puede estar compartido)
+    if padre_id: return redirect('detalle_carpeta', cliente_id=c_id, carpeta_id=padre_id)
+    return redirect('detalle_cliente', cliente_id=c_id)
+
+def _respuesta_zip(request, documentos, nombre):
+    # El ZIP se arma mientras se envía; bajo ASGI sin ocupar un hilo por descarga
+    cuerpo = azip_en_flujo(documentos) if servido_por_asgi(request) else zip_en_flujo(documentos)
+    response = StreamingHttpResponse(cuerpo, content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{nombre}.zip"'
+    return response
+
+@login_required
+@perfil_memoria
+async def descargar_carpeta_zip(request, carpeta_id):
+    usuario = await request.auser()
+    carpeta = await aget_object_or_404(Carpeta.objects.select_related('cliente'), id=carpeta_id)
+    if usuario.rol != 'admin' and not await usuario.clientes_asignados.filter(id=carpeta.cliente_id).aexists():
+        return HttpResponse("Acceso Denegado", status=403)
+
+    await aregistrar(usuario, carpeta.cliente, 'descarga', f"Descargó ZIP: {carpeta.nombre}")
+    return _respuesta_zip(request, Documento.objects.filter(carpeta=carpeta), carpeta.nombre)
+
+def _eliminar_seleccion(usuario, cliente, docs):
+    # Un DELETE para todas las filas; los archivos se borran en segundo plano
+    with transaction.atomic():
+        count = eliminar_documentos(docs)
+        registrar(usuario, cliente, 'eliminacion', f"Eliminó {count} archivos masivamente.")
+    return count
+
+@login_required
+@perfil_memoria
+async def acciones_masivas_drive(request):
+    if request.method == 'POST':
+        usuario = await request.auser()
+        accion = request.POST.get('accion')
+        doc_ids = request.POST.getlist('doc_ids')
+        docs = Documento.objects.filter(id__in=doc_ids)
+        primero = await docs.select_related('cliente').afirst()
+        if not primero: return redirect(request.META.get('HTTP_REFERER'))
+        
+        cliente = primero.cliente
+        if accion == 'eliminar':
+            if not (usuario.can_delete_client or usuario.rol == 'admin'): return redirect(request.META.get('HTTP_REFERER'))
+            count = await sync_to_async(_eliminar_seleccion)(usuario, cliente, docs)
+            messages.success(request, f"Se eliminaron {count} archivos.")
+        
+        elif accion == 'descargar':
+            await aregistrar(usuario, cliente, 'descarga', "Descargó selección ZIP.")
+            return _respuesta_zip(request, docs, 'Seleccion')
+            
+    return redirect(request.META.get('HTTP_REFERER'))
+
+@login_required
+async def descargar_documento(request, documento_id):
+    usuario = await request.auser()
+    doc = await aget_object_or_404(Documento.objects.select_related('blob'), id=documento_id)
+    if usuario.rol != 'admin' and not await usuario.clientes_asignados.filter(id=doc.cliente_id).aexists():
+        return HttpResponse("Acceso Denegado", status=403)
+
+    storage, nombre = doc.archivo.storage, doc.archivo.name
+    adjunto = request.GET.get('descargar') == '1'
+    tipo = mimetypes.guess_type(doc.nombre_archivo)[0] or 'application/octet-stream'
+    modo = modo_descarga(storage)
+
+    if modo == 'redirect':
+        # Backends remotos: la URL del storage sirve los bytes y los Range. Es la de storage.url()
+        # tal cual, sin firma: con Cloudinary es pública y el permiso sólo protege el enlace
+        return redirect(storage.url(nombre))
+    if modo in ('x-accel', 'x-sendfile'):
+        # El proxy envía el archivo; Django sólo decide el acceso
+        response = HttpResponse(content_type=tipo)
+        if modo == 'x-accel': response['X-Accel-Redirect'] = quote(DESCARGAS_PREFIJO_INTERNO + nombre)
+        else: response['X-Sendfile'] = storage.path(nombre)
+        response['Content-Disposition'] = content_disposition_header(adjunto, doc.nombre_archivo)
+        return response
+
+    # Storage síncrono: cada llamada va a un hilo para no frenar al resto de los clientes
+    en_hilo = lambda f: sync_to_async(f, thread_sensitive=False)
+    try:
+        tamano, modificado = await en_hilo(storage.size)(nombre), await en_hilo(storage.get_modified_time)(nombre)
+    except (OSError, NotImplementedError):
+        raise Http404
+    etag, ultima = etag_documento(doc, tamano, modificado), int(modificado.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=ultima)
+    if response is None:
+        rango = parsear_rango(request.headers.get('Range'), tamano) if request.method == 'GET' else None
+        if_range = request.headers.get('If-Range')
+        if if_range and if_range != etag and parse_http_date_safe(if_range) != ultima:
+            # El archivo cambió desde la copia parcial del cliente: se manda completo (200),
+            # también si el rango pedido ya no es satisfacible
+            rango = None
+        if rango is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{tamano}'
+        elif rango or servido_por_asgi(request):
+            # Bajo ASGI también el archivo completo va como rango: FileResponse se leería entero a memoria
+            inicio, fin = rango or (0, tamano - 1)
+            archivo = await en_hilo(storage.open)(nombre, 'rb')
+            lector = aleer_rango if servido_por_asgi(request) else leer_rango
+            response = StreamingHttpResponse(lector(archivo, inicio, fin - inicio + 1), status=206 if rango else 200, content_type=tipo)
+            response['Content-Length'] = fin - inicio + 1
+            if rango: response['Content-Range'] = f'bytes {inicio}-{fin}/{tamano}'
+            response['Content-Disposition'] = content_disposition_header(adjunto, doc.nombre_archivo)
+        else:
+            response = FileResponse(await en_hilo(storage.open)(nombre, 'rb'), as_attachment=adjunto, filename=doc.nombre_archivo, content_type=tipo)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(ultima)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+@login_required
+@perfil_memoria
+def preview_archivo(request, documento_id):
+    doc = get_object_or_404(Documento, id=documento_id)
+    ext = doc.nombre_archivo.split('.')[-1].lower()
+    data = {'tipo': 'unknown', 'url': reverse('descargar_documento', args=[doc.id]), 'nombre': doc.nombre_archivo,
+            'miniatura': doc.miniatura.url if doc.miniatura else None}
+    if ext in ['jpg', 'jpeg', 'png', 'gif', 'webp']: data['tipo'] = 'imagen'
+    elif ext == 'pdf': data['tipo'] = 'pdf'
+    elif ext == 'docx':
+        data['tipo'] = 'docx'
+        try:
+            import mammoth
+            with doc.archivo.open() as f, metricas.mammoth_segundos.medir(): data['html'] = mammoth.convert_to_html(f).value
+        except: data['html'] = "Error de lectura."
+    return JsonResponse(data)
+
+def subir_archivo_requisito(request, carpeta_id):
+    if request.method == 'POST':
+        carpeta = get_object_or_404(Carpeta, id=carpeta_id)
+        archivo = request.FILES.get('archivo')
+        nombre_requisito = request.POST.get('nombre_requisito') # Aquí recibimos "ACTA CONSTITUTIVA", etc.
+
+        if archivo and nombre_requisito:
+            # 1. Borrar si ya existía uno anterior con ese nombre (para reemplazar)
+            Documento.objects.filter(carpeta=carpeta, nombre_archivo=nombre_requisito).delete()
+
+            # 2. Crear el nuevo documento renombrado
+            nuevo_doc = Documento(
+                cliente=carpeta.cliente,
+                carpeta=carpeta,
+                archivo=archivo,
+                nombre_archivo=nombre_requisito, # ¡Aquí ocurre la magia del renombrado!
+                subido_por=request.user
+            )
+            nuevo_doc.save()
+            messages.success(request, f'Se cargó correctamente: {nombre_requisito}')
+        else:
+            messages.error(request, 'Error al subir el archivo.')
+            
+        return redirect('detalle_cliente', cliente_id=carpeta.cliente.id)
+    return redirect('dashboard')
+@login_required
+def mover_archivo_drive(request, archivo_id):
+    doc = get_object_or_404(Documento, id=archivo_id)
+    
+    # Verificamos permisos
+    if not (request.user.can_edit_client or request.user.can_upload_files or request.user.rol == 'admin'):
+        messages.error(request, "No tienes permiso para mover archivos.")
+        return redirect('detalle_cliente', cliente_id=doc.cliente.id)
+
+    if request.method == 'POST':
+        destino_id = request.POST.get('carpeta_destino')
+        
+        if destino_id == 'ROOT':
+            doc.carpeta = None # Mover a Raíz
+            nombre_destino = "Carpeta Raíz"
+        else:
+            carpeta_destino = get_object_or_404(Carpeta, id=destino_id)
+            doc.carpeta = carpeta_destino
+            nombre_destino = carpeta_destino.nombre
+            
+        doc.save()
+        messages.success(request, f"Archivo movido a: {nombre_destino}")
+        
+    # Redirigir a donde estábamos
+    return redirect(request.META.get('HTTP_REFERER', 'dashboard'))
@@ -0,0 +1,88 @@
+from decimal import Decimal
+
+from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+
+from ..models import CuentaPorCobrar, Pago
+from ..pdf import escribir_pdf
+
+# ==========================================
+# 1. FINANZAS
+# ==========================================
+
+@login_required
+def panel_finanzas(request):
+    if not request.user.access_finanzas: return redirect('dashboard')
+    cuentas = CuentaPorCobrar.objects.select_related('cliente').prefetch_related('pagos').order_by('-fecha_emision')
+    return render(request, 'finanzas/panel.html', {'cuentas': cuentas, 'total_por_cobrar': sum(c.saldo_pendiente for c in cuentas), 'total_cobrado': sum(c.monto_pagado for c in cuentas)})
+
+@login_required
+def registrar_pago(request):
+    if request.method == 'POST':
+        Pago.objects.create(
+            cuenta_id=request.POST.get('cuenta_id'), monto=Decimal(request.POST.get('monto')),
+            metodo=request.POST.get('metodo'), referencia=request.POST.get('referencia'), registrado_por=request.user
+        )
+    return redirect('panel_finanzas')
+
+@login_required
+def recibo_pago_pdf(request, pago_id):
+    p = get_object_or_404(Pago, id=pago_id)
+    html = render_to_string('finanzas/recibo_template.html', {'p': p, 'base_url': request.build_absolute_uri('/')})
+    response = HttpResponse(content_type='application/pdf')
+    escribir_pdf(html, request.build_absolute_uri('/'), response)
+    return response
+
+@login_required
+def generar_orden_cobro(request, cuenta_id, tipo_pago):
+    from django.utils import timezone
+    
+    cuenta = get_object_or_404(CuentaPorCobrar, id=cuenta_id)
+    cotizacion = cuenta.cotizacion
+    
+    # 1. Capturar datos bancarios de la URL (GET request)
+    datos_bancarios = {
+        'banco': request.GET.get('banco', 'BBVA'),
+        'cuenta': request.GET.get('cuenta_num', ''),
+        'clabe': request.GET.get('clabe', ''),
+        'titular': request.GET.get('titular', '')
+    }
+
+    # 2. Cálculos Financieros
+    # Nota: cuenta.monto_total ya incluye IVA si la cotización lo tenía.
+    total_proyecto = cuenta.monto_total 
+    
+    if tipo_pago == 'anticipo':
+        titulo_doc = "ORDEN DE PAGO - ANTICIPO"
+        # El 50% del total (incluyendo impuestos si aplica)
+        monto_a_pagar = total_proyecto / Decimal(2)
+        nota = "Concepto: 50% de anticipo para inicio de gestiones administrativas."
+        porcentaje_pago = 50
+    else: # liquidacion
+        titulo_doc = "ORDEN DE PAGO - LIQUIDACIÓN"
+        # El saldo restante real
+        monto_a_pagar = cuenta.saldo_pendiente 
+        nota = "Concepto: Pago final contra entrega de resultados."
+        porcentaje_pago = 100 if cuenta.monto_pagado == 0 else 50 # Estimado
+
+    context = {
+        'cuenta': cuenta,
+        'c': cotizacion, # Pasamos la cotización para ver items e IVA
+        'titulo_doc': titulo_doc,
+        'monto_a_pagar': monto_a_pagar,
+        'nota': nota,
+        'tipo_pago': tipo_pago,
+        'porcentaje_pago': porcentaje_pago,
+        'banco': datos_bancarios,
+        'fecha_emision': timezone.now(),
+        'base_url': request.build_absolute_uri('/')
+    }
+
+    html = render_to_string('finanzas/orden_cobro_pdf.html', context)
+    response = HttpResponse(content_type='application/pdf')
+    filename = f"Cobro_{tipo_pago}_{cuenta.cliente.nombre_empresa}.pdf"
+    response['Content-Disposition'] = f'inline; filename="{filename}"'
+    escribir_pdf(html, request.build_absolute_uri('/'), response)
+    return response
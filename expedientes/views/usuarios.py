@@ -0,0 +1,132 @@
+from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib.auth import logout
+from django.contrib.auth.decorators import login_required
+from django.contrib import messages
+
+from ..models import Usuario, Cliente
+
+# ==========================================
+# 1. AUTENTICACIÓN Y PERFIL
+# ==========================================
+
+def signout(request):
+    logout(request)
+    return redirect('login')
+
+def registro(request):
+    if request.method == 'POST':
+        first_name = request.POST.get('first_name')
+        last_name = request.POST.get('last_name')
+        username = request.POST.get('username')
+        email = request.POST.get('email')
+        pass1 = request.POST.get('pass1')
+        pass2 = request.POST.get('pass2')
+
+        if pass1 != pass2:
+            messages.error(request, "Las contraseñas no coinciden.")
+            return render(request, 'registro.html')
+
+        if Usuario.objects.filter(username=username).exists():
+            messages.error(request, "El usuario ya existe.")
+            return render(request, 'registro.html')
+
+        try:
+            Usuario.objects.create_user(
+                username=username, email=email, password=pass1,
+                first_name=first_name, last_name=last_name, is_active=False
+            )
+            return render(request, 'registro_pendiente.html')
+        except Exception as e:
+            messages.error(request, f"Error del sistema: {e}")
+
+    return render(request, 'registro.html')
+
+@login_required
+def mi_perfil(request):
+    user = request.user
+    if request.method == 'POST':
+        user.first_name = request.POST.get('first_name')
+        user.last_name = request.POST.get('last_name')
+        user.email = request.POST.get('email')
+        user.telefono = request.POST.get('telefono')
+        user.puesto = request.POST.get('puesto')
+        
+        if request.FILES.get('avatar'):
+            user.avatar = request.FILES['avatar']
+            
+        user.save()
+        messages.success(request, "Perfil actualizado correctamente.")
+        return redirect('mi_perfil')
+    return render(request, 'usuarios/mi_perfil.html', {'user': user})
+
+# ==========================================
+# 2. GESTIÓN DE USUARIOS (ADMIN)
+# ==========================================
+
+@login_required
+def gestion_usuarios(request):
+    if request.user.rol != 'admin': return redirect('dashboard')
+    usuarios = Usuario.objects.all().order_by('-date_joined')
+    return render(request, 'gestion_usuarios.html', {'usuarios': usuarios})
+
+@login_required
+def autorizar_usuario(request, user_id):
+    if request.user.rol != 'admin': return redirect('dashboard')
+    user = get_object_or_404(Usuario, id=user_id)
+    user.is_active = True
+    user.save()
+    messages.success(request, f"Usuario {user.username} autorizado.")
+    return redirect('gestion_usuarios')
+
+@login_required
+def editar_usuario(request, user_id):
+    if request.user.rol != 'admin': return redirect('dashboard')
+    user_obj = get_object_or_404(Usuario, id=user_id)
+    clientes_disponibles = Cliente.objects.all().order_by('nombre_empresa')
+    
+    if request.method == 'POST':
+        user_obj.rol = request.POST.get('rol')
+        user_obj.first_name = request.POST.get('first_name') or ""
+        user_obj.last_name = request.POST.get('last_name') or ""
+        user_obj.email = request.POST.get('email')
+        user_obj.telefono = request.POST.get('telefono') or None
+        user_obj.puesto = request.POST.get('puesto') or None
+        
+        # Permisos booleanos
+        user_obj.can_create_client = request.POST.get('can_create_client') == 'on'
+        user_obj.can_edit_client = request.POST.get('can_edit_client') == 'on'
+        user_obj.can_delete_client = request.POST.get('can_delete_client') == 'on'
+        user_obj.can_upload_files = request.POST.get('can_upload_files') == 'on'
+        user_obj.can_view_documents = request.POST.get('can_view_documents') == 'on'
+        user_obj.can_manage_users = request.POST.get('can_manage_users') == 'on'
+
+        # Accesos a módulos
+        user_obj.access_finanzas = request.POST.get('access_finanzas') == 'on'
+        user_obj.access_cotizaciones = request.POST.get('access_cotizaciones') == 'on'
+        user_obj.access_contratos = request.POST.get('access_contratos') == 'on'
+        user_obj.access_disenador = request.POST.get('access_disenador') == 'on'
+        user_obj.access_agenda = request.POST.get('access_agenda') == 'on'
+        
+        clientes_ids = request.POST.getlist('clientes_asignados')
+        user_obj.save()
+        
+        if user_obj.rol != 'admin':
+            user_obj.clientes_asignados.set(clientes_ids)
+        else:
+            user_obj.clientes_asignados.clear()
+            
+        messages.success(request, f"Permisos de {user_obj.username} actualizados.")
+        return redirect('gestion_usuarios')
+
+    return render(request, 'usuarios/editar_usuario.html', {'u': user_obj, 'clientes': clientes_disponibles})
+
+@login_required
+def eliminar_usuario(request, user_id):
+    if request.user.rol != 'admin': return redirect('dashboard')
+    u = get_object_or_404(Usuario, id=user_id)
+    if u == request.user:
+        messages.error(request, "No puedes eliminarte a ti mismo.")
+        return redirect('gestion_usuarios')
+    u.delete()
+    messages.success(request, "Usuario eliminado.")
+    return redirect('gestion_usuarios')
@@ -0,0 +1,12 @@
+import os
+
+# GUNICORN_PRELOAD=1: la app (y las librerías pesadas) se importan una vez en el
+# maestro y los workers las comparten copy-on-write. Sin él cada worker arranca
+# ligero y carga weasyprint/docx/etc. sólo si atiende esas rutas.
+preload_app = os.environ.get('GUNICORN_PRELOAD') == '1'
+
+
+def on_starting(server):
+    if preload_app and os.environ.get('PRECARGAR_LIBRERIAS', '1') == '1':
+        from expedientes.arranque import precargar_librerias
+        precargar_librerias()
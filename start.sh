@@ -1,4 +1,10 @@
 #!/bin/bash
 python manage.py migrate
 python manage.py collectstatic --noinput
-gunicorn core.wsgi:application --bind 0.0.0.0:$PORT
\ No newline at end of file
+# ASGI (uvicorn) por defecto: las vistas async atienden muchas descargas lentas por proceso.
+# SERVIDOR=wsgi vuelve al worker síncrono clásico.
+if [ "${SERVIDOR:-asgi}" = "wsgi" ]; then
+    gunicorn core.wsgi:application --bind 0.0.0.0:$PORT
+else
+    gunicorn core.asgi:application -k uvicorn_worker.UvicornWorker --bind 0.0.0.0:$PORT
+fi